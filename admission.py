@@ -0,0 +1,201 @@
+"""
+Admission control in front of the request handlers.
+
+Every request is sorted into a class by its endpoint:
+
+    vote     ballot submission and the pages that lead to it
+    student  other student facing pages
+    admin    admin pages and listings
+
+A worker only runs ADMISSION_CAPACITY requests (default 8) at once, each
+class has its own limit on top of that, and single endpoints can be capped
+further with ADMISSION_ROUTE_LIMITS, e.g. "turnout_analytics=1,manage_elections=2".
+A request that cannot start waits in its class's bounded queue; while any
+vote request is waiting no student or admin request is admitted, and
+admin requests also give way to waiting student requests. A request is
+answered at once with 503 and a Retry-After header when its queue is full,
+or when it has waited longer than its class allows, instead of blocking a
+worker thread until gunicorn times it out.
+
+The capacity should stay below gunicorn's --threads so shed requests are
+answered by the spare threads. Static files, /metrics, the health probes
+and the long-lived live turnout stream are not counted, nor are exports,
+which stream for as long as a table takes to read and have their own limit
+(exports.EXPORT_CONCURRENCY) so they cannot hold the admin slots.
+ADMISSION_CONTROL=0 turns it off.
+"""
+import os
+import threading
+import time
+
+from flask import Response, g, request
+
+import metrics
+
+# Endpoints of the voting path, admitted first under load
+VOTE_ENDPOINTS = {'login', 'student_dasboard', 'view_ballot', 'ballot_data', 'submit_vote'}
+EXEMPT_ENDPOINTS = {'static', 'metrics', 'healthz', 'readyz', 'admin_live_turnout', 'export_data'}
+
+# priority (lower goes first), concurrent limit, queue length, longest wait in seconds
+CLASS_DEFAULTS = {
+    'vote': (0, 8, 64, 5.0),
+    'student': (1, 6, 32, 3.0),
+    'admin': (2, 3, 8, 1.0),
+}
+
+SHED = metrics.Counter('admission_shed_total', 'Requests answered with 503 by admission control',
+                       ('class', 'reason'))
+QUEUED = metrics.Counter('admission_queued_total', 'Requests that had to wait for a slot', ('class',))
+QUEUE_WAIT = metrics.Histogram('admission_queue_wait_seconds', 'Time spent waiting for a slot', ('class',))
+
+
+def _setting(name, default):
+    return os.environ.get(name, default)
+
+
+def is_enabled():
+    return _setting('ADMISSION_CONTROL', '1').lower() not in ('0', 'false', 'no')
+
+
+def _route_limits():
+    limits = {}
+    for item in _setting('ADMISSION_ROUTE_LIMITS', '').split(','):
+        endpoint, _, limit = item.partition('=')
+        if endpoint.strip() and limit.strip().isdigit():
+            limits[endpoint.strip()] = int(limit)
+    return limits
+
+
+def classify(endpoint, path):
+    """Admission class of a request, None when it is not counted"""
+    if endpoint is None or endpoint in EXEMPT_ENDPOINTS:
+        return None
+    if endpoint in VOTE_ENDPOINTS:
+        return 'vote'
+    if path.startswith('/admin'):
+        return 'admin'
+    return 'student'
+
+
+class AdmissionController:
+
+    def __init__(self):
+        self.capacity = int(_setting('ADMISSION_CAPACITY', '8'))
+        self.retry_after = int(_setting('ADMISSION_RETRY_AFTER', '5'))
+        self.classes = {}
+        for name, (priority, limit, queue, wait) in CLASS_DEFAULTS.items():
+            prefix = f"ADMISSION_{name.upper()}_"
+            self.classes[name] = {
+                'priority': priority,
+                'limit': int(_setting(prefix + 'LIMIT', str(limit))),
+                'queue': int(_setting(prefix + 'QUEUE', str(queue))),
+                'wait': float(_setting(prefix + 'WAIT', str(wait))),
+            }
+        self.route_limits = _route_limits()
+        self.active = {name: 0 for name in self.classes}
+        self.waiting = {name: 0 for name in self.classes}
+        self.active_routes = {}
+        self.total = 0
+        self.condition = threading.Condition()
+
+    def _can_start(self, name, endpoint):
+        if self.total >= self.capacity or self.active[name] >= self.classes[name]['limit']:
+            return False
+        route_limit = self.route_limits.get(endpoint)
+        if route_limit is not None and self.active_routes.get(endpoint, 0) >= route_limit:
+            return False
+        # Requests of a more urgent class that are already waiting go first
+        priority = self.classes[name]['priority']
+        return not any(self.waiting[other] for other, settings in self.classes.items()
+                       if settings['priority'] < priority)
+
+    def _start(self, name, endpoint):
+        self.active[name] += 1
+        self.active_routes[endpoint] = self.active_routes.get(endpoint, 0) + 1
+        self.total += 1
+
+    def acquire(self, name, endpoint):
+        """Take a slot; returns None when admitted, otherwise the reason it was shed"""
+        settings = self.classes[name]
+        with self.condition:
+            if self._can_start(name, endpoint):
+                self._start(name, endpoint)
+                return None
+            if self.waiting[name] >= settings['queue']:
+                return 'queue_full'
+
+            QUEUED.inc((name,))
+            started = time.monotonic()
+            deadline = started + settings['wait']
+            self.waiting[name] += 1
+            try:
+                while not self._can_start(name, endpoint):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return 'timeout'
+                    self.condition.wait(remaining)
+                self._start(name, endpoint)
+                return None
+            finally:
+                self.waiting[name] -= 1
+                QUEUE_WAIT.observe(time.monotonic() - started, (name,))
+                # Lower priority waiters may be able to start now that this one left the queue
+                self.condition.notify_all()
+
+    def release(self, name, endpoint):
+        with self.condition:
+            self.active[name] -= 1
+            self.active_routes[endpoint] -= 1
+            self.total -= 1
+            self.condition.notify_all()
+
+    def counts(self, which):
+        with self.condition:
+            return {(name,): value for name, value in getattr(self, which).items()}
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController()
+    return _controller
+
+
+IN_FLIGHT = metrics.Gauge('admission_in_flight', 'Requests holding an admission slot', ('class',),
+                          lambda: get_controller().counts('active'))
+WAITING = metrics.Gauge('admission_waiting', 'Requests waiting for an admission slot', ('class',),
+                        lambda: get_controller().counts('waiting'))
+
+
+def init_app(app):
+    """Admit or shed every request before its handler runs"""
+    if not is_enabled():
+        return
+
+    @app.before_request
+    def _admit():
+        name = classify(request.endpoint, request.path)
+        if name is None:
+            return None
+        controller = get_controller()
+        reason = controller.acquire(name, request.endpoint)
+        if reason is not None:
+            SHED.inc((name, reason))
+            response = Response('The voting system is busy, please try again in a few seconds.', 503,
+                                mimetype='text/plain')
+            response.headers['Retry-After'] = str(controller.retry_after)
+            return response
+        g._admission = (name, request.endpoint)
+        return None
+
+    @app.teardown_request
+    def _release(exc):
+        ticket = g.pop('_admission', None)
+        if ticket is not None:
+            get_controller().release(*ticket)
@@ -0,0 +1,222 @@
+"""
+Columnar in-memory voter snapshot for turnout analytics.
+
+The voters table is read once into one compact array per column instead of
+a dict per row: every category (school, program, academic year, gender,
+address type) is stored as a small integer code next to a lookup list of
+labels, has_voted is a byte per voter and the registration date a day
+number. 20k voters take a few hundred kilobytes.
+
+Breakdowns and cross-tabs are then counted with Counter, zip and
+itertools.compress over those arrays, which run in C, so a turnout slice
+takes milliseconds and never touches the database. The snapshot is
+reloaded after ANALYTICS_TTL seconds (default 120).
+"""
+import os
+import threading
+import time
+from array import array
+from collections import Counter
+from datetime import datetime
+from itertools import compress
+from operator import and_
+
+import metrics
+
+# Dimension name -> (column expression, label shown on the page)
+DIMENSIONS = {
+    'school': ("COALESCE(s.name, 'Unknown')", 'School'),
+    'program': ('v.program', 'Program'),
+    'academic_year': ('v.academic_year', 'Academic Year'),
+    'gender': ('v.gender', 'Gender'),
+    'address_type': ('v.address_type', 'Residence'),
+}
+FETCH_ROWS = 5000
+
+SNAPSHOT_ROWS = metrics.Gauge('analytics_snapshot_rows', 'Voters in the analytics snapshot', (),
+                              lambda: {(): _snapshot.size if _snapshot else 0})
+
+
+def snapshot_ttl():
+    return float(os.environ.get('ANALYTICS_TTL', '120'))
+
+
+class VoterSnapshot:
+    """Integer-coded columns of every voter, loaded in one pass"""
+
+    def __init__(self):
+        self.ids = array('l')
+        self.voted = array('B')
+        # date.toordinal() of each voter's registration, 0 when unknown
+        self.registered = array('l')
+        self.columns = {name: array('H') for name in DIMENSIONS}
+        self.labels = {name: [] for name in DIMENSIONS}
+        self.loaded_at = None
+        self.load_seconds = 0.0
+
+    @property
+    def size(self):
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, connection):
+        snapshot = cls()
+        started = time.perf_counter()
+        names = list(DIMENSIONS)
+        codes = {name: {} for name in names}
+        columns = [snapshot.columns[name] for name in names]
+        labels = [snapshot.labels[name] for name in names]
+        lookups = [codes[name] for name in names]
+
+        cursor = connection.cursor()
+        try:
+            select = ', '.join(DIMENSIONS[name][0] for name in names)
+            cursor.execute(f"""
+                SELECT v.id, v.has_voted, v.registration_date, {select}
+                FROM voters v
+                LEFT JOIN schools s ON v.school_id = s.id
+                ORDER BY v.id
+            """)
+            while True:
+                rows = cursor.fetchmany(FETCH_ROWS)
+                if not rows:
+                    break
+                for row in rows:
+                    snapshot.ids.append(row[0])
+                    snapshot.voted.append(1 if row[1] else 0)
+                    registered = row[2]
+                    if isinstance(registered, str):
+                        registered = datetime.fromisoformat(registered)
+                    snapshot.registered.append(registered.toordinal() if registered else 0)
+                    for column, lookup, label_list, value in zip(columns, lookups, labels, row[3:]):
+                        code = lookup.get(value)
+                        if code is None:
+                            code = lookup[value] = len(label_list)
+                            label_list.append(value)
+                        column.append(code)
+        finally:
+            cursor.close()
+
+        snapshot.loaded_at = time.time()
+        snapshot.load_seconds = time.perf_counter() - started
+        return snapshot
+
+    def _mask(self, filters):
+        """Byte per voter, 1 where every {dimension: label} filter matches"""
+        mask = None
+        for name, label in filters.items():
+            try:
+                code = self.labels[name].index(label)
+            except ValueError:
+                return bytes(self.size)
+            matches = map(code.__eq__, self.columns[name])
+            mask = bytes(matches) if mask is None else bytes(map(and_, mask, matches))
+        return mask
+
+    def totals(self, filters=None):
+        """Voters and voted counts, optionally within a filter"""
+        if filters:
+            mask = self._mask(filters)
+            voters = sum(mask)
+            voted = sum(map(and_, mask, self.voted))
+        else:
+            voters = self.size
+            voted = sum(self.voted)
+        return {'voters': voters, 'voted': voted, 'turnout': _percent(voted, voters)}
+
+    def count(self, filters=None, voted=None, registered_from=None, registered_to=None):
+        """Voters matching the filters, a voting status and an inclusive range of registration dates"""
+        mask = self._mask(filters) if filters else None
+        if voted is not None:
+            matches = self.voted if voted else map((1).__xor__, self.voted)
+            mask = bytes(matches) if mask is None else bytes(map(and_, mask, matches))
+        if registered_from or registered_to:
+            low = registered_from.toordinal() if registered_from else 1
+            high = registered_to.toordinal() if registered_to else datetime.max.toordinal()
+            matches = (low <= day <= high for day in self.registered)
+            mask = bytes(matches) if mask is None else bytes(map(and_, mask, matches))
+        return self.size if mask is None else sum(mask)
+
+    def breakdown(self, dimension, filters=None):
+        """Turnout per label of one dimension, largest group first"""
+        column = self.columns[dimension]
+        if filters:
+            mask = self._mask(filters)
+            voters = Counter(compress(column, mask))
+            voted = Counter(compress(column, map(and_, mask, self.voted)))
+        else:
+            voters = Counter(column)
+            voted = Counter(compress(column, self.voted))
+
+        labels = self.labels[dimension]
+        rows = [{'label': labels[code], 'voters': count, 'voted': voted[code],
+                 'turnout': _percent(voted[code], count)} for code, count in voters.items()]
+        rows.sort(key=lambda row: (-row['voters'], str(row['label'])))
+        return rows
+
+    def crosstab(self, row_dimension, column_dimension, filters=None):
+        """Voters and voted counts for every (row label, column label) pair"""
+        pairs = zip(self.columns[row_dimension], self.columns[column_dimension])
+        if filters:
+            mask = self._mask(filters)
+            pairs = list(compress(pairs, mask))
+            voted_pairs = compress(pairs, compress(self.voted, mask))
+        else:
+            pairs = list(pairs)
+            voted_pairs = compress(pairs, self.voted)
+        voters = Counter(pairs)
+        voted = Counter(voted_pairs)
+
+        row_labels = self.labels[row_dimension]
+        column_labels = self.labels[column_dimension]
+        row_codes = sorted({row for row, _ in voters}, key=lambda code: str(row_labels[code]))
+        column_codes = sorted({column for _, column in voters}, key=lambda code: str(column_labels[code]))
+        return {
+            'rows': [row_labels[code] for code in row_codes],
+            'columns': [column_labels[code] for code in column_codes],
+            'cells': [[{'voters': voters[(row, column)], 'voted': voted[(row, column)],
+                        'turnout': _percent(voted[(row, column)], voters[(row, column)])}
+                       for column in column_codes] for row in row_codes],
+        }
+
+
+def _percent(part, whole):
+    return round(100.0 * part / whole, 1) if whole else 0.0
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot(create_connection):
+    """The worker's snapshot, reloaded when older than the TTL; None if the database is down"""
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot is not None and time.time() - snapshot.loaded_at < snapshot_ttl():
+        metrics.record_cache('analytics', True)
+        return snapshot
+
+    with _snapshot_lock:
+        # Another thread may have reloaded while we waited for the lock
+        if _snapshot is not None and time.time() - _snapshot.loaded_at < snapshot_ttl():
+            metrics.record_cache('analytics', True)
+            return _snapshot
+        metrics.record_cache('analytics', False)
+        connection = create_connection()
+        if connection is None:
+            # Serve the stale snapshot rather than nothing
+            return _snapshot
+        try:
+            _snapshot = VoterSnapshot.load(connection)
+        finally:
+            if connection.is_connected():
+                connection.close()
+        print(f"Analytics snapshot loaded {_snapshot.size} voters in {_snapshot.load_seconds:.2f}s")
+        return _snapshot
+
+
+def invalidate():
+    """Force the next read to reload, e.g. after a bulk voter import"""
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = None
@@ -0,0 +1,188 @@
+"""
+Streaming detector for suspicious voting patterns by IP address.
+
+Every recorded ballot calls observe(ip). Rates are kept in fixed memory,
+whatever the number of distinct addresses:
+
+- a windowed count-min sketch per key type (IP and /24 subnet, /48 for
+  IPv6) counts ballots over the last ANOMALY_WINDOW seconds (default 60)
+  in a ring of time buckets; estimates can over-count on hash collisions
+  but never under-count,
+- a fixed hashed table of last-seen times catches ballots from one IP
+  closer together than ANOMALY_MIN_INTERVAL seconds (default 2), faster
+  than a student can log in and vote.
+
+A burst is flagged when an IP passes ANOMALY_IP_LIMIT ballots (default 30)
+or a subnet passes ANOMALY_SUBNET_LIMIT (default 300) within the window.
+Campus NAT puts many students behind one address, so the limits are
+settings rather than constants. Alerts are kept in a bounded list for the
+admin dashboard; the votes table is never queried. Each worker process
+sees only its own share of the traffic. The address is request.remote_addr
+as rewritten by ProxyFix in app.py, so PROXY_FIX_X_FOR must match the
+number of proxies in front of the app or every ballot looks like it comes
+from the proxy.
+"""
+import ipaddress
+import os
+import random
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+
+import metrics
+
+ALERTS = metrics.Counter('vote_anomaly_alerts_total', 'Suspicious voting patterns flagged', ('kind',))
+
+MAX_ALERTS = 200
+# An alert for the same key is repeated at most once per window
+MAX_SUPPRESSED_KEYS = 4096
+
+
+def _setting(name, default):
+    return float(os.environ.get(name, default))
+
+
+class WindowedCountMin:
+    """Count-min sketch over a sliding window made of a ring of time buckets"""
+
+    def __init__(self, window=60.0, buckets=6, width=16384, depth=4):
+        self.bucket_seconds = window / buckets
+        self.buckets = buckets
+        self.width = width
+        self.depth = depth
+        self.tables = [array('I', bytes(4 * width * depth)) for _ in range(buckets)]
+        self.epochs = [-1] * buckets
+        self.salts = [random.getrandbits(32) for _ in range(depth)]
+        self._zeros = array('I', bytes(4 * width * depth))
+
+    def _slots(self, key):
+        return [hash((salt, key)) % self.width + row * self.width for row, salt in enumerate(self.salts)]
+
+    def add(self, key, now):
+        """Count one event for key and return the key's estimated count in the window"""
+        epoch = int(now // self.bucket_seconds)
+        index = epoch % self.buckets
+        if self.epochs[index] != epoch:
+            # The bucket last held an older period, reuse it
+            self.tables[index][:] = self._zeros
+            self.epochs[index] = epoch
+        slots = self._slots(key)
+        table = self.tables[index]
+        for slot in slots:
+            table[slot] += 1
+
+        total = 0
+        for bucket in range(self.buckets):
+            if epoch - self.buckets < self.epochs[bucket] <= epoch:
+                table = self.tables[bucket]
+                total += min(table[slot] for slot in slots)
+        return total
+
+
+class LastSeen:
+    """Fixed hashed table of the last event time per key"""
+
+    def __init__(self, size=8192):
+        self.size = size
+        self.tags = array('q', bytes(8 * size))
+        self.times = array('d', bytes(8 * size))
+
+    def swap(self, key, now):
+        """Store now for key and return the previous time, or None"""
+        tag = hash(key) or 1
+        index = tag % self.size
+        previous = self.times[index] if self.tags[index] == tag else None
+        self.tags[index] = tag
+        self.times[index] = now
+        return previous
+
+
+def subnet_of(ip):
+    """/24 for IPv4 and /48 for IPv6 addresses"""
+    if ':' not in ip:
+        return ip.rsplit('.', 1)[0] + '.0/24'
+    try:
+        return str(ipaddress.ip_network(f"{ip}/48", strict=False))
+    except ValueError:
+        return ip
+
+
+class AnomalyDetector:
+
+    def __init__(self):
+        self.window = _setting('ANOMALY_WINDOW', '60')
+        self.ip_limit = _setting('ANOMALY_IP_LIMIT', '30')
+        self.subnet_limit = _setting('ANOMALY_SUBNET_LIMIT', '300')
+        self.min_interval = _setting('ANOMALY_MIN_INTERVAL', '2')
+        self.ip_rates = WindowedCountMin(self.window)
+        self.subnet_rates = WindowedCountMin(self.window)
+        self.last_seen = LastSeen()
+        self.alerts = deque(maxlen=MAX_ALERTS)
+        self._last_alerted = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _alert(self, kind, key, value, now):
+        last = self._last_alerted.get((kind, key))
+        if last is not None and now - last < self.window:
+            return
+        self._last_alerted[(kind, key)] = now
+        self._last_alerted.move_to_end((kind, key))
+        if len(self._last_alerted) > MAX_SUPPRESSED_KEYS:
+            self._last_alerted.popitem(last=False)
+
+        if kind == 'velocity':
+            message = f"Two ballots from {key} {value:.2f}s apart"
+        else:
+            message = f"{int(value)} ballots from {key} in the last {int(self.window)}s"
+        self.alerts.appendleft({'time': now, 'kind': kind, 'key': key, 'value': value, 'message': message})
+        ALERTS.inc((kind,))
+        print(f"Vote anomaly: {message}")
+
+    def observe(self, ip, now=None):
+        """Record one ballot from ip; returns the kinds of alert it raised"""
+        if not ip:
+            return []
+        now = now or time.time()
+        subnet = subnet_of(ip)
+        raised = []
+        with self.lock:
+            ip_count = self.ip_rates.add(ip, now)
+            subnet_count = self.subnet_rates.add(subnet, now)
+            previous = self.last_seen.swap(ip, now)
+
+            if ip_count > self.ip_limit:
+                raised.append('ip_burst')
+                self._alert('ip_burst', ip, ip_count, now)
+            if subnet_count > self.subnet_limit:
+                raised.append('subnet_burst')
+                self._alert('subnet_burst', subnet, subnet_count, now)
+            if previous is not None and now - previous < self.min_interval:
+                raised.append('velocity')
+                self._alert('velocity', ip, now - previous, now)
+        return raised
+
+    def recent_alerts(self, limit=20):
+        with self.lock:
+            return list(self.alerts)[:limit]
+
+
+_detector = None
+_detector_lock = threading.Lock()
+
+
+def get_detector():
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                _detector = AnomalyDetector()
+    return _detector
+
+
+def observe(ip):
+    return get_detector().observe(ip)
+
+
+def recent_alerts(limit=20):
+    return get_detector().recent_alerts(limit)
@@ -4,59 +4,79 @@
 #redirect: function is used to redirect users to different routes within the application.
 #url_for: This function is used to build URLs for specific functions dynamically.
 #flash: This function is used to send one-time messages to users, often used for notifications
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, Response, stream_with_context
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-#importing mysql.connector and Error to connect and handle MySQL database operations
-import mysql.connector
+#Connections are opened in db_backends.py; Error is imported below to handle database errors
 import json
 import os
+import time
 from mysql.connector import Error 
-from datetime import datetime
-from urllib.parse import urlparse
+from mysql.connector import IntegrityError, errorcode
+from datetime import datetime, timedelta
+
+#Request, query and cache instrumentation exposed on /metrics
+import metrics
+#Optional per-request SQL profiler (enabled with SQL_PROFILER=1)
+import sql_profiler
+#Routing of read-only views to MySQL read replicas
+import replicas
+#Background opening/closing of elections and cached eligibility rules
+import scheduler
+import eligibility
+#Shared dashboard aggregates and the turnout stream built on them
+import dashboard_snapshot
+import live_turnout
+#Columnar voter snapshot behind the turnout analytics page
+import analytics
+#Plurality, block and instant-runoff results per position
+import tally
+#Per-IP and per-subnet ballot rate alerts
+import anomaly
+#Per-minute and per-hour turnout rollup
+import turnout
+#Sessions kept on the server, the cookie only holds an opaque id
+import session_store
+#Per-route concurrency limits and load shedding
+import admission
+#Fail fast while the database is unreachable, plus /healthz and /readyz
+import circuit_breaker
+#Student number and name autocomplete served from memory
+import student_index
+#Ballots built once per election and pre-rendered per eligibility cohort
+import ballot_cache
+#CSV and JSON lines exports streamed straight from the database
+import exports
 
 #Creating an instance of the flask class to initialize the system. Also a secret string used to encrypt session data and flash messages
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'cbu_voting_system_dev_fallback')
 
+#Behind the platform's proxy request.remote_addr would be the proxy's address. PROXY_FIX_X_FOR is the
+#number of proxies in front of the app whose X-Forwarded-For entries are trusted (0 when serving directly)
+proxy_hops = int(os.environ.get('PROXY_FIX_X_FOR', '1'))
+if proxy_hops:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_hops)
+
 # Add this configuration to ensure HTML files process Jinja2 syntax
 app.jinja_env.add_extension('jinja2.ext.do')
 
-#This connects to the MySQL database using the provided configuration details
-def get_db_config():
-    """Get database configuration from Railway environment variables"""
-    # Try multiple possible database URL variables
-    db_url_str = (
-        os.environ.get('MYSQL_URL') or 
-        os.environ.get('DATABASE_URL')
-    )
-    
-    if db_url_str:
-        db_url = urlparse(db_url_str)
-        return {
-            'host': db_url.hostname,
-            'user': db_url.username,
-            'password': db_url.password,
-            'database': db_url.path[1:],
-            'port': db_url.port
-        }
-    else:
-        # Try individual MySQL variables
-        if all(key in os.environ for key in ['MYSQLHOST', 'MYSQLUSER', 'MYSQLPASSWORD', 'MYSQLDATABASE']):
-            return {
-                'host': os.environ['MYSQLHOST'],
-                'user': os.environ['MYSQLUSER'],
-                'password': os.environ['MYSQLPASSWORD'],
-                'database': os.environ['MYSQLDATABASE'],
-                'port': int(os.environ.get('MYSQLPORT', '3306'))
-            }
-        else:
-            # Local development fallback
-            return {
-                'host': 'localhost',
-                'user': 'root',
-                'password': '',
-                'database': 'voting_system_db'
-            }
+# Record request latency per endpoint and serve the /metrics endpoint
+metrics.init_app(app)
+
+# Summarise each request's SQL round trips when SQL_PROFILER=1
+sql_profiler.init_app(app)
+
+# Keep a session's reads on the primary right after it writes
+replicas.init_app(app)
+
+# Limit concurrent requests per route class, ballots first, and shed the excess with 503
+admission.init_app(app)
+
+#Database configuration and the MySQL / SQLite storage backends live in db_backends.py
+#get_db_config() reads the MySQL settings from Railway environment variables
+#DB_BACKEND=sqlite switches to the embedded SQLite backend
+from db_backends import get_db_config, get_backend
 
 # Use the function to get db_config
 db_config = get_db_config()
@@ -64,15 +84,53 @@ db_config = get_db_config()
 #A function that defines the database connections and uses exception handling to manage connection errors
 def create_connection():
     """Create and return a database Connection."""
+    # While the breaker is open return at once instead of waiting for the connect timeout
+    if not circuit_breaker.primary.allow():
+        return None
+
+    started = time.perf_counter()
     try:
         # Get fresh config each time (in case env vars change)
-        current_config = get_db_config()
-        connection = mysql.connector.connect(**current_config)
-        return connection
+        backend = get_backend()
+        if backend.name == 'mysql':
+            connection = backend.connect(get_db_config())
+        else:
+            connection = backend.connect()
+        metrics.observe_connection_wait(time.perf_counter() - started)
+        circuit_breaker.primary.record_success()
+        # Time every statement run through this connection
+        return metrics.instrument_connection(connection)
     except Error as e:
-        print(f"Error Connecting to MySQL Database: {e}")
+        metrics.observe_connection_wait(time.perf_counter() - started, failed=True)
+        circuit_breaker.primary.record_failure(e)
+        print(f"Error Connecting to the Database: {e}")
         return None
 
+# Health and readiness endpoints for the platform's probes
+circuit_breaker.init_app(app, create_connection)
+
+# Open and close elections on their start/end dates in the background
+scheduler.init_app(app, create_connection)
+
+# Keep session data in the user_sessions table instead of the signed cookie
+session_store.init_app(app, create_connection)
+
+# Let the scheduler pre-render ballots when an election opens
+ballot_cache.init_app(app)
+
+#Read-only views use this so they can be served by a read replica
+def create_read_connection():
+    """Return a replica connection when one is healthy, otherwise the primary."""
+    if get_backend().name != 'mysql':
+        return create_connection()
+
+    started = time.perf_counter()
+    connection, reason = replicas.connect_replica()
+    if connection is None:
+        return create_connection()
+    metrics.observe_connection_wait(time.perf_counter() - started)
+    return metrics.instrument_connection(connection)
+
 def init_database():
     """Initialize the database by ensuring all required tables exits.
     This function is called when the system starts."""
@@ -156,6 +214,30 @@ def init_database():
         """
         cursor.execute(create_votes_table)
 
+        # SQL query to create the one-row-per-ballot participation table; its primary key
+        # is what stops a student voting twice in an election, however many submits race
+        cursor.execute("SHOW TABLES LIKE 'ballots'")
+        ballots_existed = cursor.fetchone() is not None
+        create_ballots_table = """
+        CREATE TABLE IF NOT EXISTS ballots (
+            election_id INT NOT NULL,
+            voter_id INT NOT NULL,
+            cast_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (election_id, voter_id),
+            FOREIGN KEY (election_id) REFERENCES elections(id),
+            FOREIGN KEY (voter_id) REFERENCES voters(id)
+        )
+        """
+        cursor.execute(create_ballots_table)
+        if not ballots_existed:
+            # Ballots cast before the table existed
+            cursor.execute("""
+                INSERT IGNORE INTO ballots (election_id, voter_id, cast_at)
+                SELECT election_id, voter_id, MIN(voted_at) FROM votes
+                WHERE election_id IS NOT NULL AND voter_id IS NOT NULL
+                GROUP BY election_id, voter_id
+            """)
+
         # SQL query to create positions table if it doesn't exist
         create_positions_table = """
         CREATE TABLE IF NOT EXISTS positions (
@@ -227,6 +309,100 @@ def init_database():
         """
         cursor.execute(create_academic_years_table)
 
+        # SQL query to create the frozen final tallies of closed elections
+        create_election_tallies_table = """
+        CREATE TABLE IF NOT EXISTS election_tallies (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            election_id INT NOT NULL,
+            candidate_id INT NOT NULL,
+            position VARCHAR(100) NOT NULL,
+            votes INT NOT NULL DEFAULT 0,
+            frozen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE KEY uq_election_candidate (election_id, candidate_id),
+            FOREIGN KEY (election_id) REFERENCES elections(id)
+        )
+        """
+        cursor.execute(create_election_tallies_table)
+
+        # SQL query to create the manifest of elections whose raw ballots were archived
+        create_election_archives_table = """
+        CREATE TABLE IF NOT EXISTS election_archives (
+            election_id INT PRIMARY KEY,
+            vote_rows INT NOT NULL DEFAULT 0,
+            ballots INT NOT NULL DEFAULT 0,
+            archive_path VARCHAR(255) NOT NULL,
+            checksum VARCHAR(64) NOT NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (election_id) REFERENCES elections(id)
+        )
+        """
+        cursor.execute(create_election_archives_table)
+
+        # SQL query to create the per-minute / per-hour turnout rollup (school_id 0 is the whole campus)
+        create_turnout_rollup_table = """
+        CREATE TABLE IF NOT EXISTS turnout_rollup (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            election_id INT NOT NULL,
+            granularity ENUM('minute', 'hour') NOT NULL,
+            bucket_start DATETIME NOT NULL,
+            school_id INT NOT NULL DEFAULT 0,
+            ballots INT NOT NULL DEFAULT 0,
+            UNIQUE KEY uq_turnout_bucket (election_id, granularity, bucket_start, school_id),
+            FOREIGN KEY (election_id) REFERENCES elections(id)
+        )
+        """
+        cursor.execute(create_turnout_rollup_table)
+
+        # SQL query to create the server-side session store
+        create_user_sessions_table = """
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            session_id VARCHAR(64) PRIMARY KEY,
+            data TEXT NOT NULL,
+            student_id INT,
+            expires_at DATETIME NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        )
+        """
+        cursor.execute(create_user_sessions_table)
+        # Incremented by every write, so workers can tell a stale cached session and a lost update
+        get_backend().add_column(cursor, 'user_sessions', 'version', 'INT NOT NULL DEFAULT 0')
+        get_backend().ensure_index(cursor, 'user_sessions', 'idx_user_sessions_student', ['student_id'])
+        get_backend().ensure_index(cursor, 'user_sessions', 'idx_user_sessions_expires', ['expires_at'])
+
+        # Per-election vote counts only touch the election's slice of the votes index
+        get_backend().ensure_index(cursor, 'votes', 'idx_votes_election_candidate', ['election_id', 'candidate_id'])
+
+        # Ranked and multi-seat ballots: one vote row per preference, counted per position's method
+        get_backend().add_column(cursor, 'votes', 'preference_rank', 'INT NOT NULL DEFAULT 1')
+        get_backend().add_column(cursor, 'positions', 'seats', 'INT NOT NULL DEFAULT 1')
+        get_backend().add_column(cursor, 'positions', 'tally_method', "VARCHAR(20) NOT NULL DEFAULT 'plurality'")
+        # The results engine reads an election's ballots in voter and preference order
+        get_backend().ensure_index(cursor, 'votes', 'idx_votes_election_voter', ['election_id', 'voter_id', 'preference_rank'])
+
+        # Voter management filters; each index also carries the primary key used for keyset paging
+        get_backend().ensure_index(cursor, 'voters', 'idx_voters_school', ['school_id'])
+        get_backend().ensure_index(cursor, 'voters', 'idx_voters_program', ['program'])
+        get_backend().ensure_index(cursor, 'voters', 'idx_voters_academic_year', ['academic_year'])
+        get_backend().ensure_index(cursor, 'voters', 'idx_voters_has_voted', ['has_voted'])
+        get_backend().ensure_index(cursor, 'voters', 'idx_voters_registration_date', ['registration_date'])
+
+        # One candidacy per student per election, enforced by the database rather than a lookup.
+        # Existing duplicates would make the unique index fail, so they are reported and the
+        # index is left out until they are removed; the app still starts
+        cursor.execute("""
+            SELECT election_id, student_number, COUNT(*) FROM candidates
+            GROUP BY election_id, student_number
+            HAVING COUNT(*) > 1
+        """)
+        duplicates = cursor.fetchall()
+        if duplicates:
+            listed = ', '.join(f"student {row[1]} in election {row[0]} ({row[2]} rows)" for row in duplicates[:10])
+            print(f"Duplicate candidacies found, uq_candidates_election_student not created "
+                  f"until they are removed: {listed}")
+        else:
+            get_backend().ensure_index(cursor, 'candidates', 'uq_candidates_election_student',
+                                       ['election_id', 'student_number'], unique=True)
+
         # Insert default schools if they dont exist
         check_schools_query = "SELECT COUNT(*) as count FROM schools"
         cursor.execute(check_schools_query)
@@ -444,7 +620,7 @@ def manage_candidates():
         flash('Please login as admin to access this page.', 'error')
         return redirect(url_for('admin_login'))
     
-    connection = create_connection()
+    connection = create_read_connection()
     if connection is None:
         flash('Database connection error', 'error')
         return redirect(url_for('admin_dashboard'))
@@ -571,59 +747,57 @@ def create_candidate():
                                      elections=elections, 
                                      positions=positions)
 
-            # Check if student exists
-            cursor.execute("SELECT * FROM voters WHERE student_number = %s", (student_number,))
-            student = cursor.fetchone()
-
-            if not student:
-                flash('No student found with that student number.', 'error')
-                return render_template('create_candidate.html', 
-                                     elections=elections, 
-                                     positions=positions)
-
-            # Check if candidate already exists for this election and position
-            cursor.execute("""
-                SELECT id FROM candidates 
-                WHERE election_id = %s AND student_number = %s
-            """, (election_id, student_number))
-            existing_candidate = cursor.fetchone()
-
-            if existing_candidate:
-                flash('This student is already a candidate in this election.', 'error')
-                return render_template('create_candidate.html', 
-                                     elections=elections, 
-                                     positions=positions)
-
             # Handle file upload
+            photo = None
             photo_url = ''
             if 'photo' in request.files:
                 photo = request.files['photo']
                 if photo and photo.filename != '':
-                    # Secure filename and save
-                    import os
+                    # Secure filename
                     from werkzeug.utils import secure_filename
                     
-                    # Create uploads directory if it doesn't exist
-                    upload_dir = os.path.join(app.root_path, 'static', 'uploads', 'candidates')
-                    os.makedirs(upload_dir, exist_ok=True)
-                    
                     # Generate unique filename
                     filename = secure_filename(f"{student_number}_{photo.filename}")
-                    photo_path = os.path.join(upload_dir, filename)
-                    photo.save(photo_path)
                     
                     # Store relative path for web access
                     photo_url = f"uploads/candidates/{filename}"
 
             # Insert candidate into database
+            # The foreign key to voters rejects unknown students and the unique
+            # (election_id, student_number) index a second candidacy, no lookups first
             insert_query = """
             INSERT INTO candidates (election_id, student_number, position, manifesto, photo_url, is_approved)
             VALUES (%s, %s, %s, %s, %s, %s)
             """
-            cursor.execute(insert_query, 
-                         (election_id, student_number, position, manifesto, photo_url, True))
+            try:
+                cursor.execute(insert_query, 
+                             (election_id, student_number, position, manifesto, photo_url, True))
+            except IntegrityError as e:
+                if e.errno == errorcode.ER_DUP_ENTRY:
+                    flash('This student is already a candidate in this election.', 'error')
+                elif e.errno == errorcode.ER_NO_REFERENCED_ROW_2:
+                    # Both the election and the student are foreign keys, find out which one failed
+                    cursor.execute("SELECT id FROM elections WHERE id = %s", (election_id,))
+                    if cursor.fetchone():
+                        flash('No student found with that student number.', 'error')
+                    else:
+                        flash('The selected election no longer exists.', 'error')
+                else:
+                    raise
+                return render_template('create_candidate.html', 
+                                     elections=elections, 
+                                     positions=positions)
+
+            # Save the photo only once the candidate row is accepted
+            if photo_url:
+                # Create uploads directory if it doesn't exist
+                upload_dir = os.path.join(app.root_path, 'static', 'uploads', 'candidates')
+                os.makedirs(upload_dir, exist_ok=True)
+                photo.save(os.path.join(upload_dir, filename))
             
             connection.commit()
+            ballot_cache.invalidate(int(election_id))
+            tally.invalidate(int(election_id))
             flash('Candidate created successfully!', 'success')
             return redirect(url_for('manage_candidates'))
 
@@ -687,6 +861,18 @@ def get_student_info(student_number):
             cursor.close()
             connection.close()
 
+@app.route('/admin/students/search')
+def search_students():
+    """
+    AJAX autocomplete of students by student number or name prefix, e.g. ?q=2021&limit=10
+    Answered from the in-memory student index
+    """
+    if 'admin_logged_in' not in session:
+        return json.dumps({'error': 'Unauthorized'}), 401
+
+    return json.dumps(student_index.search(create_read_connection, request.args.get('q', ''),
+                                           request.args.get('limit', 10, type=int)))
+
 @app.route('/admin/candidates/<int:candidate_id>/toggle_approval', methods=['POST'])
 def toggle_candidate_approval(candidate_id):
     """
@@ -702,24 +888,20 @@ def toggle_candidate_approval(candidate_id):
         return redirect(url_for('manage_candidates'))
 
     try:
-        cursor = connection.cursor(dictionary=True)
-
-        # Check if candidate exists
-        cursor.execute("SELECT id, is_approved FROM candidates WHERE id = %s", (candidate_id,))
-        candidate = cursor.fetchone()
+        cursor = connection.cursor()
 
-        if not candidate:
+        # Flip the approval in place, no rows changed means no such candidate
+        update_query = "UPDATE candidates SET is_approved = NOT is_approved WHERE id = %s"
+        cursor.execute(update_query, (candidate_id,))
+        if cursor.rowcount == 0:
             flash('Candidate not found.', 'error')
             return redirect(url_for('manage_candidates'))
-
-        # Toggle approval status
-        new_status = not candidate['is_approved']
-        update_query = "UPDATE candidates SET is_approved = %s WHERE id = %s"
-        cursor.execute(update_query, (new_status, candidate_id))
         connection.commit()
+        # The candidate's election is not read, so drop every cached ballot
+        ballot_cache.invalidate()
+        tally.invalidate()
 
-        status_text = "approved" if new_status else "pending"
-        flash(f'Candidate status updated to {status_text}.', 'success')
+        flash('Candidate approval status updated.', 'success')
 
     except Error as e:
         flash(f'Database error: {str(e)}', 'error')
@@ -747,18 +929,15 @@ def delete_candidate(candidate_id):
     try:
         cursor = connection.cursor()
 
-        # Check if candidate exists
-        cursor.execute("SELECT id FROM candidates WHERE id = %s", (candidate_id,))
-        candidate = cursor.fetchone()
-
-        if not candidate:
-            flash('Candidate not found.', 'error')
-            return redirect(url_for('manage_candidates'))
-
-        # Delete candidate
+        # Delete candidate, no rows deleted means it did not exist
         delete_query = "DELETE FROM candidates WHERE id = %s"
         cursor.execute(delete_query, (candidate_id,))
+        if cursor.rowcount == 0:
+            flash('Candidate not found.', 'error')
+            return redirect(url_for('manage_candidates'))
         connection.commit()
+        ballot_cache.invalidate()
+        tally.invalidate()
 
         flash('Candidate deleted successfully!', 'success')
 
@@ -864,6 +1043,11 @@ def edit_candidate(candidate_id):
                          (election_id, position, manifesto, photo_url, is_approved, candidate_id))
             
             connection.commit()
+            # The candidate may have moved between elections
+            ballot_cache.invalidate(candidate['election_id'])
+            tally.invalidate(candidate['election_id'])
+            ballot_cache.invalidate(int(election_id))
+            tally.invalidate(int(election_id))
             flash('Candidate updated successfully!', 'success')
             return redirect(url_for('manage_candidates'))
 
@@ -912,7 +1096,7 @@ def login():
 
             #SQL Query to verify student credentials
             login_query = """
-            SELECT id, first_name, last_name, student_number, email, program, has_voted 
+            SELECT id, first_name, last_name, student_number, email, program, academic_year, school_id, has_voted 
             FROM voters
             WHERE email = %s AND student_number = %s
             """
@@ -925,13 +1109,15 @@ def login():
 
             #Check if student exists
             if student:
+                session_store.rotate(session)
                 session['student_id'] = student['id']
                 session['first_name'] = student['first_name']
                 session['last_name'] = student['last_name']
                 session['student_number'] = student['student_number']
                 session['email'] = student['email']
                 session['program'] = student['program']
-                session['has_voted'] = student['has_voted']
+                session['academic_year'] = student['academic_year']
+                session['school_id'] = student['school_id']
 
                 flash('Login successful! You can now vote.', 'success')
                 return redirect(url_for('student_dasboard'))
@@ -960,18 +1146,184 @@ def student_dasboard():
     if 'student_id' not in session:
         flash('Please login to access the voting dashboard.', 'error')
         return redirect(url_for('login'))
-    
+
+    # Voting state is read from voters, a copy kept in the session would go stale
+    has_voted = False
+    connection = create_connection()
+    if connection is not None:
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT has_voted FROM voters WHERE id = %s", (session['student_id'],))
+            row = cursor.fetchone()
+            cursor.close()
+            has_voted = bool(row[0]) if row else False
+        except Error as e:
+            print(f"Error reading voting state: {e}")
+        finally:
+            if connection.is_connected():
+                connection.close()
+
     student_data = {
         'first_name': session['first_name'],
         'last_name': session['last_name'],
         'student_number': session['student_number'],
         'email': session['email'],
         'program': session['program'],
-        'has_voted': session['has_voted']
+        'has_voted': has_voted
     }
 
     return render_template('student_dashboard.html', student=student_data)
 
+#Ballot Submission Route
+@app.route('/student/vote/<int:election_id>', methods=['POST'])
+def submit_vote(election_id):
+    """
+    Records a student's ballot for an active election
+    The form sends candidate ids in the 'candidate' field, in order of preference
+    Plurality positions take one candidate, block positions up to their seats
+    and instant-runoff positions may rank every candidate
+    """
+    if 'student_id' not in session:
+        flash('Please login to vote.', 'error')
+        return redirect(url_for('login'))
+
+    # Unused ranks of a ranked ballot arrive empty
+    selected_ids = [candidate_id for candidate_id in request.form.getlist('candidate') if candidate_id]
+    if not selected_ids:
+        flash('Please select at least one candidate.', 'error')
+        return redirect(url_for('student_dasboard'))
+
+    connection = create_connection()
+    if connection is None:
+        flash('Database connection error. Please try again later.', 'error')
+        return redirect(url_for('student_dasboard'))
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+
+        # Approved candidates of this election, only while it is active
+        cursor.execute("""
+            SELECT c.id, c.position, p.seats, p.tally_method
+            FROM candidates c
+            JOIN elections e ON c.election_id = e.id
+            LEFT JOIN positions p ON p.election_id = c.election_id AND p.position_name = c.position
+            WHERE c.election_id = %s AND c.is_approved = TRUE AND e.status = 'active'
+        """, (election_id,))
+        rows = cursor.fetchall()
+        candidates = {str(row['id']): row['position'] for row in rows}
+
+        # How many candidates each position's ballot may list
+        allowed = {}
+        for row in rows:
+            if row['tally_method'] == 'irv':
+                allowed[row['position']] = allowed.get(row['position'], 0) + 1
+            elif row['tally_method'] == 'block':
+                allowed[row['position']] = row['seats'] or 1
+            else:
+                allowed[row['position']] = 1
+
+        if not candidates:
+            flash('This election is not open for voting.', 'error')
+            return redirect(url_for('student_dasboard'))
+
+        # Sessions from before academic_year and school_id were stored need one lookup
+        if 'academic_year' not in session or 'school_id' not in session:
+            cursor.execute("SELECT academic_year, school_id FROM voters WHERE id = %s", (session['student_id'],))
+            voter = cursor.fetchone()
+            session['academic_year'] = voter['academic_year'] if voter else None
+            session['school_id'] = voter['school_id'] if voter else None
+
+        # Check the student's program and year against the cached election rules
+        if not eligibility.is_eligible(connection, election_id, session['program'], session['academic_year']):
+            flash('You are not eligible to vote in this election.', 'error')
+            return redirect(url_for('student_dasboard'))
+
+        # Valid candidates, no repeats, and no more per position than its method allows
+        ranks = []
+        chosen = {}
+        if len(set(selected_ids)) != len(selected_ids):
+            flash('Invalid ballot. Please check your selections for each position.', 'error')
+            return redirect(url_for('student_dasboard'))
+        for candidate_id in selected_ids:
+            position = candidates.get(candidate_id)
+            if position is None or chosen.get(position, 0) >= allowed[position]:
+                flash('Invalid ballot. Please check your selections for each position.', 'error')
+                return redirect(url_for('student_dasboard'))
+            chosen[position] = chosen.get(position, 0) + 1
+            ranks.append(chosen[position])
+
+        # Claim the student's ballot first: the primary key turns a second or concurrent
+        # submit into a duplicate key error before any vote row is written
+        try:
+            cursor.execute("INSERT INTO ballots (election_id, voter_id) VALUES (%s, %s)",
+                           (election_id, session['student_id']))
+        except IntegrityError as e:
+            if e.errno != errorcode.ER_DUP_ENTRY:
+                raise
+            connection.rollback()
+            flash('You have already voted in this election.', 'error')
+            return redirect(url_for('student_dasboard'))
+
+        # Record one vote row per selection with its preference and mark the student as voted
+        ip_address = request.remote_addr
+        cursor.executemany(
+            "INSERT INTO votes (election_id, voter_id, candidate_id, ip_address, preference_rank) VALUES (%s, %s, %s, %s, %s)",
+            [(election_id, session['student_id'], int(candidate_id), ip_address, rank)
+             for candidate_id, rank in zip(selected_ids, ranks)])
+        cursor.execute("UPDATE voters SET has_voted = TRUE WHERE id = %s", (session['student_id'],))
+        # Add the ballot to its turnout buckets last, so the hot rollup rows are locked briefly
+        turnout.record_ballot(cursor, election_id, session['school_id'])
+        connection.commit()
+
+        # Feed the in-memory rate detector, it never reads the votes table
+        anomaly.observe(ip_address)
+
+        flash('Your vote has been recorded. Thank you for voting!', 'success')
+
+    except Error as e:
+        connection.rollback()
+        flash(f'Database error: {str(e)}', 'error')
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+    return redirect(url_for('student_dasboard'))
+
+#Ballot Route
+@app.route('/student/ballot/<int:election_id>')
+def view_ballot(election_id):
+    """
+    Shows the ballot of an active election to an eligible student
+    The ballot is pre-rendered per cohort, so this normally runs no queries
+    """
+    if 'student_id' not in session:
+        flash('Please login to vote.', 'error')
+        return redirect(url_for('login'))
+
+    # Ballots are rebuilt right after candidate changes, so read from the primary
+    ballot = ballot_cache.get_ballot(create_connection, election_id,
+                                     session.get('program'), session.get('academic_year'))
+    if ballot is None or ballot['ballot']['status'] != 'active':
+        flash('This election is not open for you to vote in.', 'error')
+        return redirect(url_for('student_dasboard'))
+
+    return render_template('ballot.html', ballot_html=ballot['html'])
+
+#Ballot as JSON
+@app.route('/student/ballot/<int:election_id>/data')
+def ballot_data(election_id):
+    """The student's ballot for scripts and mobile clients"""
+    if 'student_id' not in session:
+        return json.dumps({'error': 'Unauthorized'}), 401
+
+    ballot = ballot_cache.get_ballot(create_connection, election_id,
+                                     session.get('program'), session.get('academic_year'))
+    # Only open elections, as on the ballot page
+    if ballot is None or ballot['ballot']['status'] != 'active':
+        return json.dumps({'error': 'Ballot not found'}), 404
+    return ballot['json']
+
 
 #Registration Route
 @app.route('/', methods=['GET', 'POST'])
@@ -1022,20 +1374,8 @@ def register():
         try: 
             cursor = connection.cursor()
 
-            #SQL Query to check if student number already exists
-            check_query = "SELECT id FROM voters WHERE student_number = %s"
-
-            #Execute the query with the student_number as parameter
-            cursor.execute(check_query, (student_number,))
-
-            existing_voter = cursor.fetchone()
-
-            #If a voter is with this student number show error message
-            if existing_voter:
-                flash('A voter with this student number already exists.', 'error')
-                return redirect(url_for('register'))
-            
             #SQL Query  to insert new voter into the database
+            #The unique student_number column rejects a second registration, no lookup first
             insert_query = """
                 INSERT INTO voters
                 (first_name, last_name, date_of_birth, school_id, program, academic_year, student_number,
@@ -1049,10 +1389,16 @@ def register():
                 student_number, nrc, gender, email, phone_number, address_type))
             
             connection.commit()
+            student_index.register(cursor.lastrowid, student_number, first_name, last_name, program)
 
             #Show success message to user
             flash('Registration successful! You can now login to vote when the election opens.', 'success')
 
+        except IntegrityError as e:
+            if e.errno == errorcode.ER_DUP_ENTRY:
+                flash('A voter with this student number already exists.', 'error')
+            else:
+                flash(f'Database error: {str(e)}', 'error')
         except Error as e:
             flash(f'Database error: {str(e)}', 'error')
         finally:
@@ -1075,6 +1421,7 @@ def admin_dashboard():
     """
     Displays all registered voters to the admin
     Only accessible by admin users
+    The figures come from a shared snapshot refreshed every few seconds
     """
 
     # Check if admin is logged in
@@ -1082,105 +1429,71 @@ def admin_dashboard():
         flash('Please login as admin to access this page.', 'error')
         return redirect(url_for('admin_login'))
 
-    connection = create_connection()
-    if connection is None:
-        return "Database connection error", 500
-    
     try:
-        cursor = connection.cursor(dictionary=True)
-
-        # Get total number of registered voters
-        cursor.execute("SELECT COUNT(*) as count FROM voters")
-        total_voters_result = cursor.fetchone()
-        total_voters = total_voters_result['count'] if total_voters_result else 0 
+        snapshot = dashboard_snapshot.get_snapshot(create_read_connection)
+    except Error as e:
+        flash(f'Database error: {str(e)}', 'error')
+        print(f"Database error in admin_dashboard: {e}")
+        snapshot = None
 
-        # Get number of voters who have voted
-        cursor.execute("SELECT COUNT(*) as count FROM voters WHERE has_voted = TRUE")
-        voted_count_result = cursor.fetchone()
-        voted_count = voted_count_result['count'] if voted_count_result else 0
+    if snapshot is None:
+        # Return empty data if the database is unavailable
+        return render_template('admin_dashboard.html',
+                             stats={'total_voters': 0, 'voted_count': 0, 'pending_count': 0, 'active_elections': 0},
+                             recent_voters=[],
+                             elections=[],
+                             alerts=anomaly.recent_alerts(5),
+                             generated_at=None)
 
-        # Get number of pending votes
-        pending_count = total_voters - voted_count
+    return render_template('admin_dashboard.html', 
+                           stats=snapshot['stats'],
+                           recent_voters=snapshot['recent_voters'],
+                           elections=snapshot['elections'][:3],
+                           alerts=anomaly.recent_alerts(5),
+                           generated_at=datetime.fromtimestamp(snapshot['generated_at']))
 
-        # Get number of active elections
-        cursor.execute("SELECT COUNT(*) as count FROM elections WHERE status='active'")
-        active_elections_result = cursor.fetchone()
-        active_elections = active_elections_result['count'] if active_elections_result else 0
 
-        # Get recent voter registration
-        cursor.execute("""
-        SELECT first_name, last_name, student_number, program, email,
-                       registration_date, has_voted
-        FROM voters
-        ORDER BY registration_date DESC
-        LIMIT 5
-        """)
-        recent_voters = cursor.fetchall()
+#Live turnout stream for the admin dashboard
+@app.route('/admin/live-turnout')
+def admin_live_turnout():
+    """
+    Server-sent events stream of turnout and per-election vote counts
+    Every viewer reads the same snapshot, polled once per interval per worker
+    With ?poll=1 it returns the current figures once, as JSON
+    """
+    if 'admin_logged_in' not in session:
+        return "Unauthorized", 401
 
-        # Get active elections with vote counts
-        elections = []
+    if request.args.get('poll'):
         try:
-            # Check if the votes table exists
-            cursor.execute("SHOW TABLES LIKE 'votes'")
-            votes_table_exists = cursor.fetchone()
-
-            if votes_table_exists:
-                cursor.execute("""
-                SELECT e.*, COUNT(v.id) as votes_cast
-                FROM elections e
-                LEFT JOIN votes v ON e.id = v.election_id
-                WHERE e.status = 'active'
-                GROUP BY e.id
-                ORDER BY e.start_date DESC
-                LIMIT 3
-                """)
-            else:
-                cursor.execute("""
-                SELECT e.*, 0 as votes_cast
-                FROM elections e
-                WHERE e.status = 'active'
-                ORDER BY e.start_date DESC
-                LIMIT 3
-                """)
-            elections = cursor.fetchall()  # Fixed typo: was 'featchall'
-
+            data = live_turnout.current(create_read_connection)
         except Error as e:
-            print(f"Error fetching elections: {e}")
-            # If there's an error, just get basic election data
-            cursor.execute("""
-            SELECT e.*, 0 as votes_cast
-            FROM elections e
-            WHERE e.status = 'active'
-            ORDER BY e.start_date DESC
-            LIMIT 3
-            """)
-            elections = cursor.fetchall()
-
-        # Statistics 
-        stats = {
-            'total_voters': total_voters,
-            'voted_count': voted_count,
-            'pending_count': pending_count,
-            'active_elections': active_elections
-        }
+            print(f"Error reading live turnout: {e}")
+            data = None
+        if data is None:
+            return "Database connection error", 503
+        return json.dumps(data), 200, {'Content-Type': 'application/json', 'Cache-Control': 'no-cache'}
+
+    # Each open stream holds a worker thread, so their number is capped
+    if not live_turnout.acquire():
+        return "Too many live streams, poll instead.", 503, {'Retry-After': '30'}
+    aggregator = live_turnout.get_aggregator(create_read_connection)
+    response = Response(stream_with_context(aggregator.stream()), mimetype='text/event-stream')
+    response.call_on_close(live_turnout.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx style proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+#Voting anomaly alerts
+@app.route('/admin/anomalies')
+def vote_anomalies():
+    """Recent burst and velocity alerts from this worker's detector"""
+    if 'admin_logged_in' not in session:
+        return json.dumps({'error': 'Unauthorized'}), 401
 
-        return render_template('admin_dashboard.html', 
-                               stats=stats,
-                               recent_voters=recent_voters,
-                               elections=elections)  
-        
-    except Error as e:
-        flash(f'Database error: {str(e)}', 'error')
-        print(f"Database error in admin_dashboard: {e}")
-        # Return empty data if database error occurs
-        return render_template('admin_dashboard.html',
-                             stats={'total_voters': 0, 'voted_count': 0, 'pending_count': 0, 'active_elections': 0},
-                             recent_voters=[],
-                             elections=[])
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
+    return json.dumps(anomaly.recent_alerts(request.args.get('limit', 50, type=int)))
 
 
 #Admin login Route
@@ -1236,6 +1549,7 @@ def admin_login():
 
             # Check if admin exists
             if admin_user:
+                session_store.rotate(session)
                 session['admin_logged_in'] = True
                 session['admin_id'] = admin_user['id']
                 session['admin_username'] = admin_user['username']
@@ -1299,16 +1613,339 @@ def admin_debug():
 #Voters
 @app.route('/admin/voters')
 def manage_voters():
-    """Placeholder for manage voters page"""
-    flash('Voter management feature coming soon!', 'info')
-    return redirect(url_for('admin_dashboard'))
+    """
+    Browse the voter roll, newest registrations first, filtered by school, program,
+    academic year, voting status and registration date
+    Pages are keyset pages on the voter id (?after= / ?before=), so a page costs the
+    same however deep it is, and the match count comes from the analytics snapshot
+    """
+    if 'admin_logged_in' not in session:
+        flash('Please login as admin to access this page.', 'error')
+        return redirect(url_for('admin_login'))
+
+    page_size = 50
+    schools = get_schools_from_db()
+    programs = get_programs_from_db()
+    academic_years = get_academic_years_from_db()
+
+    #Get filter parameters
+    filters = {
+        'school': request.args.get('school', type=int),
+        'program': request.args.get('program', ''),
+        'academic_year': request.args.get('academic_year', ''),
+        'status': request.args.get('status', 'all'),
+        'registered_from': request.args.get('registered_from', ''),
+        'registered_to': request.args.get('registered_to', ''),
+    }
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+
+    try:
+        registered_from = datetime.strptime(filters['registered_from'], '%Y-%m-%d') if filters['registered_from'] else None
+        registered_to = datetime.strptime(filters['registered_to'], '%Y-%m-%d') if filters['registered_to'] else None
+    except ValueError:
+        flash('Registration dates must look like 2025-01-31.', 'error')
+        return redirect(url_for('manage_voters'))
+
+    #Builds Where conditions based on filters, each one an indexed column
+    conditions = []
+    params = []
+    if filters['school']:
+        conditions.append("v.school_id = %s")
+        params.append(filters['school'])
+    if filters['program']:
+        conditions.append("v.program = %s")
+        params.append(filters['program'])
+    if filters['academic_year']:
+        conditions.append("v.academic_year = %s")
+        params.append(filters['academic_year'])
+    if filters['status'] in ('voted', 'not_voted'):
+        conditions.append("v.has_voted = %s")
+        params.append(filters['status'] == 'voted')
+    if registered_from:
+        conditions.append("v.registration_date >= %s")
+        params.append(registered_from)
+    if registered_to:
+        # Inclusive of the whole last day
+        conditions.append("v.registration_date < %s")
+        params.append(registered_to + timedelta(days=1))
+
+    # Keyset paging: newest first, the next page continues below the last id shown
+    order = "DESC"
+    if before:
+        conditions.append("v.id > %s")
+        params.append(before)
+        order = "ASC"
+    elif after:
+        conditions.append("v.id < %s")
+        params.append(after)
+
+    query = """
+        SELECT v.id, v.first_name, v.last_name, v.student_number, v.program, v.academic_year,
+               v.email, v.registration_date, v.has_voted, s.name AS school_name
+        FROM voters v
+        LEFT JOIN schools s ON v.school_id = s.id
+    """
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    # One extra row tells whether there is a further page
+    query += f" ORDER BY v.id {order} LIMIT %s"
+    params.append(page_size + 1)
+
+    connection = create_read_connection()
+    if connection is None:
+        flash('Database connection error', 'error')
+        return redirect(url_for('admin_dashboard'))
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(query, tuple(params))
+        voters = cursor.fetchall()
+    except Error as e:
+        flash(f'Database error: {str(e)}', 'error')
+        print(f"Database error in manage_voters: {e}")
+        return redirect(url_for('admin_dashboard'))
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+    more = len(voters) > page_size
+    voters = voters[:page_size]
+    if before:
+        # Fetched oldest first to step back a page, shown newest first
+        voters.reverse()
+        has_newer, has_older = more, True
+    else:
+        has_newer, has_older = bool(after), more
+
+    # Matching voters from the in-memory analytics snapshot instead of a COUNT(*) per page
+    matching = None
+    snapshot = analytics.get_snapshot(create_read_connection)
+    if snapshot is not None:
+        school_names = {school['id']: school['name'] for school in schools}
+        snapshot_filters = {}
+        if filters['school']:
+            snapshot_filters['school'] = school_names.get(filters['school'], '')
+        if filters['program']:
+            snapshot_filters['program'] = filters['program']
+        if filters['academic_year']:
+            snapshot_filters['academic_year'] = filters['academic_year']
+        voted = {'voted': True, 'not_voted': False}.get(filters['status'])
+        matching = {
+            'count': snapshot.count(snapshot_filters, voted, registered_from, registered_to),
+            'total': snapshot.size,
+            'loaded_at': datetime.fromtimestamp(snapshot.loaded_at),
+        }
+
+    # Filters carried over to the paging links
+    page_args = {name: value for name, value in filters.items() if value and value != 'all'}
+
+    return render_template('manage_voters.html',
+                           voters=voters,
+                           schools=schools,
+                           programs=programs,
+                           academic_years=academic_years,
+                           filters=filters,
+                           page_args=page_args,
+                           matching=matching,
+                           newer_before=voters[0]['id'] if voters and has_newer else None,
+                           older_after=voters[-1]['id'] if voters and has_older else None)
+
+#Exports
+@app.route('/admin/export/<dataset>')
+def export_data(dataset):
+    """
+    Download the voter roll, the candidates or an election's results as CSV or JSON lines
+    Rows are sent as they are read, so memory use does not grow with the table
+    """
+    if 'admin_logged_in' not in session:
+        flash('Please login as admin to access this page.', 'error')
+        return redirect(url_for('admin_login'))
+
+    fmt = request.args.get('format', 'csv')
+    election_id = request.args.get('election', type=int)
+    if dataset not in exports.DATASETS or fmt not in exports.FORMATS:
+        return "Unknown export", 404
+    if dataset == 'results' and election_id is None:
+        return "Choose an election to export its results", 400
+
+    # Exports skip admission control and are limited on their own instead
+    if not exports.acquire():
+        return "Too many exports are running, please try again shortly.", 503, {'Retry-After': '30'}
+    try:
+        chunks = exports.stream(create_read_connection, dataset, fmt, election_id)
+    except Error as e:
+        exports.release()
+        print(f"Error starting {dataset} export: {e}")
+        return "Database connection error", 503
+
+    filename = f"{dataset}-{election_id}.{fmt}" if election_id else f"{dataset}.{fmt}"
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    # The slot is held until the server has sent the last chunk or the client went away
+    response.call_on_close(exports.release)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 #Election Results
 @app.route('/admin/results')
 def view_results():
-    """Placeholder for view results page"""
-    flash('Results feature coming soon!', 'info')
-    return redirect(url_for('admin_dashboard'))
+    """
+    Results per position of the selected election
+    Counted by the tally engine with each position's method
+    """
+    if 'admin_logged_in' not in session:
+        flash('Please login as admin to access this page.', 'error')
+        return redirect(url_for('admin_login'))
+
+    connection = create_read_connection()
+    if connection is None:
+        flash('Database connection error', 'error')
+        return redirect(url_for('admin_dashboard'))
+
+    try:
+        cursor = connection.cursor(dictionary=True)
+
+        # Elections that have ballots to count
+        cursor.execute("""
+            SELECT id, name, status, end_date
+            FROM elections
+            WHERE status IN ('active', 'completed')
+            ORDER BY end_date DESC
+        """)
+        elections = cursor.fetchall()
+
+        results = None
+        election_id = request.args.get('election', type=int)
+        if election_id is None and elections:
+            election_id = elections[0]['id']
+        if election_id is not None:
+            results = tally.get_results(connection, election_id)
+
+        # Hourly turnout reads the rollup, not the votes table
+        hourly_turnout = turnout.series(connection, election_id, 'hour') if results else []
+
+        return render_template('results.html',
+                               elections=elections,
+                               selected_election=election_id,
+                               results=results,
+                               hourly_turnout=hourly_turnout)
+
+    except Error as e:
+        flash(f'Database error: {str(e)}', 'error')
+        print(f"Database error in view_results: {e}")
+        return redirect(url_for('admin_dashboard'))
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
+#Turnout over time from the rollup table
+@app.route('/admin/elections/<int:election_id>/turnout')
+def election_turnout(election_id):
+    """Ballots per minute or hour, e.g. ?granularity=minute&school=2"""
+    if 'admin_logged_in' not in session:
+        return json.dumps({'error': 'Unauthorized'}), 401
+
+    connection = create_read_connection()
+    if connection is None:
+        return json.dumps({'error': 'Database connection error'}), 500
+
+    try:
+        points = turnout.series(connection, election_id,
+                                request.args.get('granularity', 'hour'),
+                                request.args.get('school', type=int))
+        return json.dumps(points)
+    except Error as e:
+        print(f"Error reading turnout of election {election_id}: {e}")
+        return json.dumps({'error': 'Database error'}), 500
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+#Election Results as JSON
+@app.route('/admin/results/<int:election_id>/data')
+def results_data(election_id):
+    """Results of one election for scripts and charts"""
+    if 'admin_logged_in' not in session:
+        return json.dumps({'error': 'Unauthorized'}), 401
+
+    connection = create_read_connection()
+    if connection is None:
+        return json.dumps({'error': 'Database connection error'}), 500
+
+    try:
+        results = tally.get_results(connection, election_id)
+        if results is None:
+            return json.dumps({'error': 'Election not found'}), 404
+        return json.dumps(results)
+    except Error as e:
+        print(f"Error counting election {election_id}: {e}")
+        return json.dumps({'error': 'Database error'}), 500
+    finally:
+        if connection.is_connected():
+            connection.close()
+
+#Turnout Analytics
+@app.route('/admin/analytics')
+def turnout_analytics():
+    """
+    Turnout broken down by school, program, year, gender or residence
+    Answered from the in-memory columnar snapshot, not the database
+    """
+    if 'admin_logged_in' not in session:
+        flash('Please login as admin to access this page.', 'error')
+        return redirect(url_for('admin_login'))
+
+    by = request.args.get('by', 'school')
+    cross = request.args.get('cross', '')
+    if by not in analytics.DIMENSIONS:
+        by = 'school'
+    if cross not in analytics.DIMENSIONS or cross == by:
+        cross = ''
+
+    snapshot = analytics.get_snapshot(create_read_connection)
+    if snapshot is None:
+        flash('Database connection error', 'error')
+        return redirect(url_for('admin_dashboard'))
+
+    return render_template('analytics.html',
+                           dimensions=analytics.DIMENSIONS,
+                           by=by,
+                           cross=cross,
+                           totals=snapshot.totals(),
+                           breakdown=snapshot.breakdown(by),
+                           crosstab=snapshot.crosstab(by, cross) if cross else None,
+                           loaded_at=datetime.fromtimestamp(snapshot.loaded_at))
+
+#Turnout Analytics data for charts and scripts
+@app.route('/admin/analytics/data')
+def turnout_analytics_data():
+    """JSON breakdown, e.g. ?by=program&cross=gender&school=Engineering"""
+    if 'admin_logged_in' not in session:
+        return json.dumps({'error': 'Unauthorized'}), 401
+
+    by = request.args.get('by', 'school')
+    cross = request.args.get('cross')
+    if by not in analytics.DIMENSIONS or (cross and cross not in analytics.DIMENSIONS):
+        return json.dumps({'error': 'Unknown dimension'}), 400
+    # Any other dimension in the query string narrows the voters counted
+    filters = {name: request.args[name] for name in analytics.DIMENSIONS if name in request.args}
+
+    snapshot = analytics.get_snapshot(create_read_connection)
+    if snapshot is None:
+        return json.dumps({'error': 'Database connection error'}), 500
+
+    data = {
+        'loaded_at': snapshot.loaded_at,
+        'totals': snapshot.totals(filters),
+        'breakdown': snapshot.breakdown(by, filters),
+    }
+    if cross:
+        data['crosstab'] = snapshot.crosstab(by, cross, filters)
+    return json.dumps(data, default=str)
 
 #Admin Settings
 @app.route('/admin/settings')
@@ -1327,7 +1964,7 @@ def manage_elections():
         flash('Please login as admin to access this page.', 'error')
         return redirect(url_for('admin_login'))
     
-    connection = create_connection()
+    connection = create_read_connection()
     if connection is None:
         flash('Database connection error', 'error')
         return redirect(url_for('admin_dashboard'))
@@ -1341,14 +1978,16 @@ def manage_elections():
         search_query = request.args.get('search', '')
 
         #Base Query
+        # Archived elections keep their vote count in election_archives
         query = """
         SELECT e.*,
                 COUNT(DISTINCT c.id) as candidate_count,
-                COUNT(DISTINCT v.id) as vote_count,
+                COUNT(DISTINCT v.id) + COALESCE(MAX(ar.vote_rows), 0) as vote_count,
                 a.username as created_by_name
         FROM elections e
         LEFT JOIN candidates c ON e.id = c.election_id
         LEFT JOIN votes v ON e.id = v.election_id
+        LEFT JOIN election_archives ar ON e.id = ar.election_id
         LEFT JOIN admin_users a ON e.created_by = a.id
         """
 
@@ -1500,10 +2139,10 @@ def create_election():
             else:  # Association elections - no default positions
                 default_positions = []
             
-            # Insert default positions
-            for position_name in default_positions:
+            # Insert default positions in one multi-row statement
+            if default_positions:
                 position_query = "INSERT INTO positions (election_id, position_name) VALUES (%s, %s)"
-                cursor.execute(position_query, (election_id, position_name))
+                cursor.executemany(position_query, [(election_id, position_name) for position_name in default_positions])
 
             connection.commit()
 
@@ -1527,6 +2166,121 @@ def create_election():
                          programs=programs,
                          academic_years=academic_years)
 
+#Bulk Class Representative Elections
+@app.route('/admin/elections/bulk', methods=['GET', 'POST'])
+def bulk_create_elections():
+    """
+    Create one Class Representative election per selected program x academic year
+    All elections and positions are inserted with multi-row statements in one transaction
+    """
+    if 'admin_logged_in' not in session:
+        flash('Please login as admin to access this page', 'error')
+        return redirect(url_for('admin_login'))
+
+    programs = get_programs_from_db()
+    academic_years = get_academic_years_from_db()
+    defaults = {
+        'name_template': '{program} {year} Class Representative Election',
+        'positions': '\n'.join(['Male Class Representative', 'Female Class Representative']),
+    }
+
+    def show_form():
+        return render_template('bulk_create_elections.html',
+                               programs=programs,
+                               academic_years=academic_years,
+                               form=request.form if request.method == 'POST' else defaults,
+                               selected_programs=request.form.getlist('program'),
+                               selected_years=request.form.getlist('academic_year'))
+
+    if request.method == 'GET':
+        return show_form()
+
+    name_template = request.form.get('name_template', '').strip()
+    description = request.form.get('description', '')
+    program_ids = request.form.getlist('program')
+    year_ids = request.form.getlist('academic_year')
+    position_names = [line.strip() for line in request.form.get('positions', '').splitlines() if line.strip()]
+    start_date = request.form.get('start_date', '')
+    end_date = request.form.get('end_date', '')
+    status = request.form.get('status', 'draft')
+
+    # Validate required fields
+    if not all([name_template, program_ids, year_ids, position_names, start_date, end_date]):
+        flash('Please fill in all required fields.', 'error')
+        return show_form()
+    if start_date >= end_date:
+        flash('End date must be after start date.', 'error')
+        return show_form()
+
+    # One election per cohort, named from the template
+    selected_programs = [program for program in programs if str(program['id']) in program_ids]
+    selected_years = [year for year in academic_years if str(year['id']) in year_ids]
+    elections = []
+    try:
+        for program in selected_programs:
+            for year in selected_years:
+                name = name_template.format(program=program['name'], program_code=program['code'],
+                                            school=program['school_name'], year=year['name'])
+                elections.append((name, description, 'Class Representative', program['school_name'],
+                                  json.dumps([str(program['id'])]), json.dumps([str(year['id'])]),
+                                  start_date, end_date, status, session['admin_id']))
+    except (KeyError, IndexError, ValueError) as e:
+        flash(f'Invalid election name template: {e}', 'error')
+        return show_form()
+
+    names = [election[0] for election in elections]
+    if len(set(names)) != len(names):
+        flash('The name template gives several elections the same name, add {program} and {year} to it.', 'error')
+        return show_form()
+
+    connection = create_connection()
+    if connection is None:
+        flash('Database connection error. Please try again later.', 'error')
+        return redirect(url_for('manage_elections'))
+
+    try:
+        cursor = connection.cursor()
+        placeholders = ', '.join(['%s'] * len(names))
+
+        # Cohorts that already have an election of this name are left alone
+        cursor.execute(f"SELECT name FROM elections WHERE name IN ({placeholders})", tuple(names))
+        existing = {row[0] for row in cursor.fetchall()}
+        elections = [election for election in elections if election[0] not in existing]
+        if not elections:
+            flash('Every selected cohort already has an election with that name.', 'error')
+            return show_form()
+
+        # One insert per election so each one's own id comes back; names are not unique,
+        # so reading ids back by name could pick up another election of the same name
+        election_ids = []
+        for election in elections:
+            cursor.execute("""
+                INSERT INTO elections
+                (name, description, election_type, school, program, academic_year, start_date, end_date, status, created_by)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, election)
+            election_ids.append(cursor.lastrowid)
+
+        cursor.executemany("INSERT INTO positions (election_id, position_name) VALUES (%s, %s)",
+                           [(election_id, position_name)
+                            for election_id in election_ids for position_name in position_names])
+        connection.commit()
+
+        message = f'Created {len(elections)} Class Representative elections with {len(position_names)} positions each.'
+        if existing:
+            message += f' Skipped {len(existing)} that already exist.'
+        flash(message, 'success')
+        return redirect(url_for('manage_elections', type='Class Representative'))
+
+    except Error as e:
+        connection.rollback()
+        flash(f'Database error: {str(e)}', 'error')
+        return show_form()
+    finally:
+        if connection.is_connected():
+            cursor.close()
+            connection.close()
+
 
 #Get programs by school in AJAX
 @app.route('/admin/get-programs/<int:school_id>')
@@ -1619,6 +2373,9 @@ def edit_election(election_id):
                            (name, description, election_type, school_name, program, academic_year,
                             start_date, end_date, status, election_id))
             connection.commit()
+            eligibility.invalidate(election_id)
+            ballot_cache.invalidate(election_id)
+            tally.invalidate(election_id)
        
         flash('Election updated successfully!', 'success')
         return redirect(url_for('manage_elections'))
@@ -1672,18 +2429,15 @@ def delete_election(election_id):
     try:
         cursor = connection.cursor()
 
-        #Check if election exists
-        cursor.execute("SELECT id FROM elections WHERE id = %s", (election_id,))
-        election = cursor.fetchone()
-
-        if not election:
-            flash('Election not found.', 'error')
-            return redirect(url_for('manage_elections'))
-
-        #SQL Query to delete election
+        #SQL Query to delete election, no rows deleted means it did not exist
         delete_query = "DELETE FROM elections WHERE id = %s"
         cursor.execute(delete_query, (election_id,))
+        if cursor.rowcount == 0:
+            flash('Election not found.', 'error')
+            return redirect(url_for('manage_elections'))
         connection.commit()
+        ballot_cache.invalidate(election_id)
+        tally.invalidate(election_id)
 
         flash('Election deleted successfully!', 'success')
 
@@ -1712,25 +2466,23 @@ def toggle_election_status(election_id):
         return redirect(url_for('manage_elections'))
 
     try:
-        cursor = connection.cursor(dictionary=True)
-
-        #Check if election exists
-        cursor.execute("SELECT status FROM elections WHERE id = %s", (election_id,))
-        election = cursor.fetchone()
+        cursor = connection.cursor()
 
-        if not election:
+        #SQL Query to flip the election status in place, no rows changed means no such election
+        update_query = """
+        UPDATE elections
+        SET status = CASE WHEN status = 'active' THEN 'draft' ELSE 'active' END
+        WHERE id = %s
+        """
+        cursor.execute(update_query, (election_id,))
+        if cursor.rowcount == 0:
             flash('Election not found.', 'error')
             return redirect(url_for('manage_elections'))
-
-        #Determine new status
-        new_status = 'draft' if election['status'] == 'active' else 'active'
-
-        #SQL Query to update election status
-        update_query = "UPDATE elections SET status = %s WHERE id = %s"
-        cursor.execute(update_query, (new_status, election_id))
         connection.commit()
+        ballot_cache.invalidate(election_id)
+        tally.invalidate(election_id)
 
-        flash(f'Election status updated to {new_status}.', 'success')
+        flash('Election status updated.', 'success')
 
     except Error as e:
         flash(f'Database error: {str(e)}', 'error')
@@ -1769,11 +2521,21 @@ def manage_positions(election_id):
 
         if request.method == 'POST':
             position_name = request.form['position_name']
+            # Counting method and number of seats, plurality for one seat unless chosen
+            tally_method = request.form.get('tally_method', 'plurality')
+            if tally_method not in tally.METHODS:
+                tally_method = 'plurality'
+            try:
+                seats = max(1, int(request.form.get('seats', 1)))
+            except ValueError:
+                seats = 1
             
             if position_name:
-                insert_query = "INSERT INTO positions (election_id, position_name) VALUES (%s, %s)"
-                cursor.execute(insert_query, (election_id, position_name))
+                insert_query = "INSERT INTO positions (election_id, position_name, seats, tally_method) VALUES (%s, %s, %s, %s)"
+                cursor.execute(insert_query, (election_id, position_name, seats, tally_method))
                 connection.commit()
+                ballot_cache.invalidate(election_id)
+                tally.invalidate(election_id)
                 flash('Position added successfully!', 'success')
 
         # Get existing positions
@@ -0,0 +1,265 @@
+"""
+Archival of completed elections and partitioning of the votes table.
+
+Archiving an election in 'completed' status:
+1. freezes its final results, as counted by the results engine for each
+   position's method, into election_tallies,
+2. streams its raw ballots, in ballot order (voter, then preference), into
+   a gzip-compressed CSV file in ARCHIVE_DIR (default ./archive) and records
+   it in election_archives, so the results engine can recount an archive
+   while reading it,
+3. deletes those rows from votes in small id-range chunks.
+
+The hot votes table then only holds ballots of elections still running.
+Re-running is safe: an election already in election_archives only has any
+leftover rows deleted.
+
+On MySQL the votes table can additionally be hash-partitioned by
+election_id so per-election counts only scan one partition.
+
+    python archival.py archive --all-completed
+    python archival.py archive --election 12
+    python archival.py partition --partitions 16
+"""
+import argparse
+import csv
+import gzip
+import hashlib
+import io
+import os
+
+from mysql.connector import Error
+
+ARCHIVE_COLUMNS = ['id', 'election_id', 'voter_id', 'candidate_id', 'voted_at', 'ip_address', 'preference_rank']
+CHUNK_ROWS = 10000
+
+
+def archive_dir():
+    return os.environ.get('ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive'))
+
+
+def tally_rows(results):
+    """(election_id, candidate_id, position, votes) of a results engine count"""
+    return [(results['election_id'], candidate['id'], position['position'], candidate['votes'])
+            for position in results['positions'] for candidate in position['candidates']]
+
+
+def freeze_tallies(connection, election_id):
+    """Replace the stored final tallies of an election with a fresh count by the results engine"""
+    # Imported here because the results engine reads archives through this module
+    import tally
+    results = tally.count_election(connection, election_id)
+    rows = tally_rows(results) if results else []
+    cursor = connection.cursor()
+    try:
+        cursor.execute("DELETE FROM election_tallies WHERE election_id = %s", (election_id,))
+        if rows:
+            cursor.executemany("""
+                INSERT INTO election_tallies (election_id, candidate_id, position, votes)
+                VALUES (%s, %s, %s, %s)
+            """, rows)
+        connection.commit()
+        return len(rows)
+    finally:
+        cursor.close()
+
+
+def read_archive(path):
+    """Yield the archived vote rows of one election as dicts"""
+    with gzip.open(path, 'rt', newline='') as f:
+        for row in csv.DictReader(f):
+            yield row
+
+
+def _write_archive(connection, election_id, path):
+    """Stream an election's votes into a gzip CSV in ballot order; returns rows, ballots and checksum"""
+    temp_path = path + '.tmp'
+    digest = hashlib.sha256()
+    rows = 0
+    ballots = 0
+    last_voter = None
+    # Unbuffered: rows arrive CHUNK_ROWS at a time in the order of idx_votes_election_voter
+    cursor = connection.cursor(buffered=False)
+    try:
+        cursor.execute("""
+            SELECT id, election_id, voter_id, candidate_id, voted_at, ip_address, preference_rank
+            FROM votes
+            WHERE election_id = %s
+            ORDER BY voter_id, preference_rank, id
+        """, (election_id,))
+        with gzip.open(temp_path, 'wb') as raw:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(ARCHIVE_COLUMNS)
+            while True:
+                batch = cursor.fetchmany(CHUNK_ROWS)
+                if not batch:
+                    break
+                for row in batch:
+                    writer.writerow(['' if value is None else value for value in row])
+                    if row[2] != last_voter:
+                        ballots += 1
+                        last_voter = row[2]
+                rows += len(batch)
+
+                data = buffer.getvalue().encode()
+                digest.update(data)
+                raw.write(data)
+                buffer.seek(0)
+                buffer.truncate()
+            data = buffer.getvalue().encode()
+            digest.update(data)
+            raw.write(data)
+    finally:
+        cursor.close()
+    os.replace(temp_path, path)
+    return rows, ballots, digest.hexdigest()
+
+
+def _delete_archived_rows(connection, election_id):
+    """Delete an election's hot rows in bounded id ranges"""
+    cursor = connection.cursor()
+    deleted = 0
+    try:
+        # Find whatever is left a chunk at a time, which also resumes an interrupted run
+        while True:
+            cursor.execute("SELECT MIN(id), MAX(id) FROM (SELECT id FROM votes WHERE election_id = %s "
+                           "ORDER BY id LIMIT %s) AS chunk", (election_id, CHUNK_ROWS))
+            low, high = cursor.fetchone()
+            if low is None:
+                break
+            cursor.execute("DELETE FROM votes WHERE election_id = %s AND id BETWEEN %s AND %s",
+                           (election_id, low, high))
+            deleted += cursor.rowcount
+            connection.commit()
+    finally:
+        cursor.close()
+    return deleted
+
+
+def archive_election(connection, election_id):
+    """Freeze tallies, move raw ballots to cold storage and trim the hot table"""
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT status FROM elections WHERE id = %s", (election_id,))
+        election = cursor.fetchone()
+        if not election:
+            raise ValueError(f"Election {election_id} not found")
+        if election['status'] != 'completed':
+            raise ValueError(f"Election {election_id} is '{election['status']}', only completed elections are archived")
+
+        cursor.execute("SELECT archive_path FROM election_archives WHERE election_id = %s", (election_id,))
+        existing = cursor.fetchone()
+    finally:
+        cursor.close()
+
+    if existing:
+        deleted = _delete_archived_rows(connection, election_id)
+        print(f"Election {election_id} already archived to {existing['archive_path']}, removed {deleted} leftover rows")
+        return existing['archive_path']
+
+    freeze_tallies(connection, election_id)
+
+    os.makedirs(archive_dir(), exist_ok=True)
+    path = os.path.join(archive_dir(), f"votes_election_{election_id}.csv.gz")
+    rows, ballots, checksum = _write_archive(connection, election_id, path)
+
+    cursor = connection.cursor()
+    try:
+        # The manifest is committed before any delete so a crash can be resumed
+        cursor.execute("""
+            INSERT INTO election_archives (election_id, vote_rows, ballots, archive_path, checksum)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (election_id, rows, ballots, path, checksum))
+        connection.commit()
+    finally:
+        cursor.close()
+
+    deleted = _delete_archived_rows(connection, election_id)
+    print(f"Archived election {election_id}: {rows} vote rows from {ballots} ballots to {path}, "
+          f"removed {deleted} rows from votes")
+    return path
+
+
+def archive_completed(connection):
+    """Archive every completed election that still has rows in the hot table"""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+            SELECT e.id FROM elections e
+            LEFT JOIN election_archives a ON a.election_id = e.id
+            WHERE e.status = 'completed' AND a.election_id IS NULL
+            ORDER BY e.id
+        """)
+        election_ids = [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+    for election_id in election_ids:
+        archive_election(connection, election_id)
+    return election_ids
+
+
+def partition_votes(connection, partitions=16):
+    """
+    Hash-partition the MySQL votes table by election_id.
+    InnoDB does not allow foreign keys on partitioned tables and needs the
+    partition column in the primary key, so both are adjusted first.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+            SELECT constraint_name FROM information_schema.table_constraints
+            WHERE table_schema = DATABASE() AND table_name = 'votes' AND constraint_type = 'FOREIGN KEY'
+        """)
+        foreign_keys = [row[0] for row in cursor.fetchall()]
+        for name in foreign_keys:
+            cursor.execute(f"ALTER TABLE votes DROP FOREIGN KEY {name}")
+
+        cursor.execute("""
+            ALTER TABLE votes
+                MODIFY election_id INT NOT NULL,
+                DROP PRIMARY KEY,
+                ADD PRIMARY KEY (id, election_id)
+        """)
+        cursor.execute(f"ALTER TABLE votes PARTITION BY HASH (election_id) PARTITIONS {int(partitions)}")
+        connection.commit()
+        print(f"votes partitioned by election_id into {partitions} partitions")
+    finally:
+        cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Archive completed elections and partition votes')
+    commands = parser.add_subparsers(dest='command', required=True)
+    archive = commands.add_parser('archive', help='Move raw ballots of completed elections to cold storage')
+    archive.add_argument('--election', type=int, help='Archive a single completed election')
+    archive.add_argument('--all-completed', action='store_true', help='Archive every completed election')
+    partition = commands.add_parser('partition', help='Hash-partition votes by election_id (MySQL only)')
+    partition.add_argument('--partitions', type=int, default=16)
+    args = parser.parse_args()
+
+    import app as voting_app
+    connection = voting_app.create_connection()
+    if connection is None:
+        raise SystemExit('Database connection failed')
+    try:
+        if args.command == 'archive':
+            if args.election:
+                archive_election(connection, args.election)
+            elif args.all_completed:
+                archived = archive_completed(connection)
+                print(f"Archived {len(archived)} election(s)")
+            else:
+                parser.error('pass --election ID or --all-completed')
+        elif args.command == 'partition':
+            if voting_app.get_backend().name != 'mysql':
+                raise SystemExit('Partitioning is only available on MySQL')
+            partition_votes(connection, args.partitions)
+    except (Error, ValueError) as e:
+        raise SystemExit(f"Archival failed: {e}")
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
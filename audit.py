@@ -0,0 +1,357 @@
+"""
+Independent recount and audit of recorded ballots.
+
+The votes table is split into primary-key ranges of --chunk-rows ids and
+every range is recounted by a worker process with its own database
+connection; archived elections are recounted from their archive files,
+whose checksums are verified on the way. The partial counts are merged in
+the parent and compared against:
+
+- election_tallies, the per-position results frozen when an election closed.
+  Workers also send back the ballots of tallied elections as compact
+  (voter, rank, vote id, candidate) rows; the parent orders them into
+  ballots and counts every position by its own method (plurality, block or
+  IRV), since IRV and block results are not a plain count of vote rows,
+- election_archives, the row and ballot counts recorded at archive time,
+- candidates, every vote must name a candidate of the same election,
+- ballots, the one row per voter per election claimed when a ballot is
+  cast: every voter with vote rows in an election must have its ballots
+  row and every ballots row must have vote rows. voters.has_voted is not
+  checked, it only says whether a student voted in the current term.
+
+By default one worker runs per CPU core.
+
+    python audit.py --all
+    python audit.py --election 12 --workers 8 --json audit_report.json
+
+Exits with status 1 when any discrepancy is found.
+"""
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import os
+import time
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from mysql.connector import Error
+
+import tally
+from db_backends import get_backend
+
+CHUNK_ROWS = 50000
+# Ids listed per discrepancy in the report, the totals are always exact
+SAMPLE_SIZE = 20
+
+# Set in each worker process by _init_worker
+_connection = None
+_candidate_elections = None
+_tallied_elections = None
+
+
+def _init_worker(candidate_elections, tallied_elections):
+    global _connection, _candidate_elections, _tallied_elections
+    _connection = get_backend().connect()
+    _candidate_elections = candidate_elections
+    _tallied_elections = tallied_elections
+
+
+def _tally_rows(rows, source):
+    """Partial counts of an iterable of (election_id, voter_id, candidate_id, preference_rank, vote_id)"""
+    counts = Counter()
+    voters = {}
+    ranked = {}
+    foreign = []
+    rows_seen = 0
+    for election_id, voter_id, candidate_id, preference_rank, vote_id in rows:
+        rows_seen += 1
+        counts[(election_id, candidate_id)] += 1
+        voters.setdefault(election_id, set()).add(voter_id)
+        if election_id in _tallied_elections:
+            # Flattened 4-tuples, rebuilt into ballots by the parent
+            ranked.setdefault(election_id, array('l')).extend((voter_id, preference_rank, vote_id, candidate_id))
+        if _candidate_elections.get(candidate_id) != election_id and len(foreign) < SAMPLE_SIZE:
+            foreign.append((source, election_id, voter_id, candidate_id))
+    return {
+        'rows': rows_seen,
+        'counts': counts,
+        # Voter ids travel back to the parent as compact arrays, not sets
+        'voters': {election_id: array('l', sorted(ids)) for election_id, ids in voters.items()},
+        'ranked': ranked,
+        'foreign': foreign,
+    }
+
+
+def recount_range(low, high, election_id=None):
+    """Recount votes with ids in [low, high]; runs in a worker process"""
+    cursor = _connection.cursor()
+    try:
+        query = ("SELECT election_id, voter_id, candidate_id, preference_rank, id "
+                 "FROM votes WHERE id BETWEEN %s AND %s")
+        params = [low, high]
+        if election_id is not None:
+            query += " AND election_id = %s"
+            params.append(election_id)
+        cursor.execute(query, params)
+        result = _tally_rows(cursor.fetchall(), f"votes {low}-{high}")
+    finally:
+        cursor.close()
+    result['chunk'] = ('votes', low, high)
+    return result
+
+
+def recount_archive(election_id, path, expected_checksum):
+    """Recount an archive file and verify its checksum; runs in a worker process"""
+    digest = hashlib.sha256()
+
+    def lines():
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                digest.update(line)
+                yield line.decode()
+
+    reader = csv.DictReader(lines())
+    rows = ((int(row['election_id']), int(row['voter_id']), int(row['candidate_id']),
+             int(row.get('preference_rank') or 1), int(row['id'])) for row in reader)
+    result = _tally_rows(rows, f"archive {os.path.basename(path)}")
+    result['chunk'] = ('archive', election_id, path)
+    result['checksum_ok'] = digest.hexdigest() == expected_checksum
+    return result
+
+
+def plan(connection, election_id=None, chunk_rows=CHUNK_ROWS):
+    """Primary-key ranges of the votes table and the archives to recount"""
+    cursor = connection.cursor()
+    try:
+        if election_id is None:
+            cursor.execute("SELECT MIN(id), MAX(id) FROM votes")
+        else:
+            cursor.execute("SELECT MIN(id), MAX(id) FROM votes WHERE election_id = %s", (election_id,))
+        low, high = cursor.fetchone()
+        ranges = []
+        if low is not None:
+            for start in range(low, high + 1, chunk_rows):
+                ranges.append((start, min(start + chunk_rows - 1, high)))
+
+        query = "SELECT election_id, vote_rows, ballots, archive_path, checksum FROM election_archives"
+        params = ()
+        if election_id is not None:
+            query += " WHERE election_id = %s"
+            params = (election_id,)
+        cursor.execute(query, params)
+        archives = [{'election_id': row[0], 'vote_rows': row[1], 'ballots': row[2],
+                     'archive_path': row[3], 'checksum': row[4]} for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+    return ranges, archives
+
+
+def _load_reference(connection, election_id=None):
+    """Candidate elections and frozen tallies to compare against"""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT id, election_id FROM candidates")
+        candidate_elections = dict(cursor.fetchall())
+
+        if election_id is None:
+            cursor.execute("SELECT election_id, candidate_id, votes FROM election_tallies")
+        else:
+            cursor.execute("SELECT election_id, candidate_id, votes FROM election_tallies WHERE election_id = %s",
+                           (election_id,))
+        tallies = {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+    return candidate_elections, tallies
+
+
+def _check_ballots(connection, voters, election_id=None):
+    """Compare recounted voters per election with the ballots table, streamed in batches"""
+    without_ballot = {vote_election: set(ids) for vote_election, ids in voters.items()}
+    without_votes = []
+    cursor = connection.cursor()
+    try:
+        query = "SELECT election_id, voter_id FROM ballots"
+        params = ()
+        if election_id is not None:
+            query += " WHERE election_id = %s"
+            params = (election_id,)
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(CHUNK_ROWS)
+            if not rows:
+                break
+            for ballot_election, voter_id in rows:
+                pending = without_ballot.get(ballot_election)
+                if pending is not None and voter_id in pending:
+                    pending.discard(voter_id)
+                else:
+                    without_votes.append((ballot_election, voter_id))
+    finally:
+        cursor.close()
+    without_ballot = sorted((vote_election, voter_id) for vote_election, ids in without_ballot.items()
+                            for voter_id in ids)
+    return without_ballot, sorted(without_votes)
+
+
+def _method_counts(connection, election_id, ranked):
+    """Per-candidate results of one election's recounted ballots, each position by its method"""
+    positions = tally.load_positions(connection, election_id)
+    # Same ballot order as the results engine reads: voter, preference rank, vote id
+    rows = sorted(zip(*[iter(ranked)] * 4))
+    matrices = tally.build_matrices(positions, ((row[0], row[3]) for row in rows))
+    counts = {}
+    for name, position in positions.items():
+        for candidate in tally.count_position(name, position, matrices[name])['candidates']:
+            counts[(election_id, candidate['id'])] = candidate['votes']
+    return counts
+
+
+def run_audit(connection, election_id=None, workers=None, chunk_rows=CHUNK_ROWS):
+    """Recount in parallel and return a report dict"""
+    started = time.perf_counter()
+    candidate_elections, tallies = _load_reference(connection, election_id)
+    ranges, archives = plan(connection, election_id, chunk_rows)
+    workers = workers or os.cpu_count() or 1
+
+    tallied_elections = {key[0] for key in tallies}
+    counts = Counter()
+    voters = {}
+    ranked = {}
+    foreign = []
+    rows = 0
+    archive_problems = []
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(candidate_elections, tallied_elections)) as pool:
+        futures = [pool.submit(recount_range, low, high, election_id) for low, high in ranges]
+        archive_futures = {pool.submit(recount_archive, archive['election_id'], archive['archive_path'],
+                                       archive['checksum']): archive for archive in archives}
+        for future in as_completed(futures + list(archive_futures)):
+            try:
+                result = future.result()
+            except (OSError, Error) as e:
+                archive = archive_futures.get(future)
+                if archive is None:
+                    raise
+                archive_problems.append({'election_id': archive['election_id'], 'problem': f"unreadable: {e}"})
+                continue
+            rows += result['rows']
+            counts.update(result['counts'])
+            for vote_election, ids in result['voters'].items():
+                voters.setdefault(vote_election, set()).update(ids)
+            for vote_election, cells in result['ranked'].items():
+                ranked.setdefault(vote_election, array('l')).extend(cells)
+            foreign.extend(result['foreign'])
+
+            archive = archive_futures.get(future)
+            if archive is not None:
+                if not result['checksum_ok']:
+                    archive_problems.append({'election_id': archive['election_id'], 'problem': 'checksum mismatch'})
+                if result['rows'] != archive['vote_rows']:
+                    archive_problems.append({'election_id': archive['election_id'],
+                                             'problem': f"{result['rows']} rows, manifest says {archive['vote_rows']}"})
+                ballots = len(result['voters'].get(archive['election_id'], ()))
+                if ballots != archive['ballots']:
+                    archive_problems.append({'election_id': archive['election_id'],
+                                             'problem': f"{ballots} ballots, manifest says {archive['ballots']}"})
+
+    # Frozen tallies must match the workers' recount, counted by each position's method
+    recounts = {}
+    for tallied_election in sorted(tallied_elections):
+        recounts.update(_method_counts(connection, tallied_election, ranked.pop(tallied_election, array('l'))))
+    tally_mismatches = []
+    for key in sorted(set(tallies) | set(recounts)):
+        stored = tallies.get(key, 0)
+        recounted = recounts.get(key, 0)
+        if stored != recounted:
+            tally_mismatches.append({'election_id': key[0], 'candidate_id': key[1],
+                                     'stored': stored, 'recounted': recounted})
+
+    # Participation is per election: vote rows and the ballots row claimed with them
+    votes_without_ballot, ballot_without_votes = _check_ballots(connection, voters, election_id)
+
+    elections = {}
+    for (vote_election, candidate_id), votes in counts.items():
+        summary = elections.setdefault(vote_election, {'rows': 0, 'ballots': len(voters.get(vote_election, ())),
+                                                       'candidates': {}})
+        summary['rows'] += votes
+        summary['candidates'][candidate_id] = votes
+
+    discrepancies = (len(tally_mismatches) + len(archive_problems) + len(foreign) +
+                     len(votes_without_ballot) + len(ballot_without_votes))
+    return {
+        'election_id': election_id,
+        'workers': workers,
+        'chunks': len(ranges),
+        'archives': len(archives),
+        'rows': rows,
+        'seconds': round(time.perf_counter() - started, 2),
+        'elections': elections,
+        'tally_mismatches': tally_mismatches,
+        'archive_problems': archive_problems,
+        'votes_for_foreign_candidates': foreign,
+        'votes_without_ballot': {'count': len(votes_without_ballot), 'sample': votes_without_ballot[:SAMPLE_SIZE]},
+        'ballot_without_votes': {'count': len(ballot_without_votes), 'sample': ballot_without_votes[:SAMPLE_SIZE]},
+        'discrepancies': discrepancies,
+    }
+
+
+def print_report(report):
+    scope = f"election {report['election_id']}" if report['election_id'] else 'all elections'
+    print(f"Audit of {scope}: {report['rows']} vote rows in {report['chunks']} chunks and "
+          f"{report['archives']} archives, {report['workers']} workers, {report['seconds']}s")
+    for election_id, summary in sorted(report['elections'].items()):
+        print(f"  election {election_id}: {summary['ballots']} ballots, {summary['rows']} vote rows")
+    for mismatch in report['tally_mismatches'][:SAMPLE_SIZE]:
+        print(f"  TALLY election {mismatch['election_id']} candidate {mismatch['candidate_id']}: "
+              f"stored {mismatch['stored']}, recounted {mismatch['recounted']}")
+    for problem in report['archive_problems']:
+        print(f"  ARCHIVE election {problem['election_id']}: {problem['problem']}")
+    for source, election_id, voter_id, candidate_id in report['votes_for_foreign_candidates']:
+        print(f"  CANDIDATE {source}: voter {voter_id} voted for candidate {candidate_id} "
+              f"not standing in election {election_id}")
+    if report['votes_without_ballot']['count']:
+        print(f"  PARTICIPATION {report['votes_without_ballot']['count']} (election, voter) pairs have vote rows "
+              f"but no ballots row, e.g. {report['votes_without_ballot']['sample']}")
+    if report['ballot_without_votes']['count']:
+        print(f"  PARTICIPATION {report['ballot_without_votes']['count']} ballots rows have no vote rows, "
+              f"e.g. {report['ballot_without_votes']['sample']}")
+    if report['discrepancies']:
+        print(f"❌ {report['discrepancies']} discrepancies found")
+    else:
+        print("✅ Recount matches the stored records")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recount ballots in parallel and audit the stored results')
+    scope = parser.add_mutually_exclusive_group(required=True)
+    scope.add_argument('--election', type=int, help='Audit a single election')
+    scope.add_argument('--all', action='store_true', help='Audit every election')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: one per CPU core)')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help='Vote ids per chunk')
+    parser.add_argument('--json', help='Also write the full report to this file')
+    args = parser.parse_args()
+
+    import app as voting_app
+    connection = voting_app.create_connection()
+    if connection is None:
+        raise SystemExit('Database connection failed')
+    try:
+        report = run_audit(connection, args.election, args.workers, args.chunk_rows)
+    except Error as e:
+        raise SystemExit(f"Audit failed: {e}")
+    finally:
+        connection.close()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    raise SystemExit(1 if report['discrepancies'] else 0)
+
+
+if __name__ == '__main__':
+    main()
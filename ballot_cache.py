@@ -0,0 +1,207 @@
+"""
+Materialized ballots served from memory.
+
+An election's ballot is its approved candidates grouped by position, with
+their names and photos; positions nobody is standing for are left off. It
+is built with two queries the first time a student opens it, or as soon as
+the scheduler opens the election, and kept per worker together with the
+election's eligibility rules. Each eligibility
+cohort (eligibility.cohort_key: an election open to everyone has the single
+cohort ('*', '*'), one restricted by program has one per program) then gets
+its ballot rendered once, as JSON and as the HTML form, so opening a ballot
+is a dict lookup with no database round trip.
+
+Candidate and position changes and election edits call invalidate(); the
+other workers pick changes up after BALLOT_CACHE_TTL seconds (default 60).
+"""
+import json
+import os
+import threading
+import time
+
+from flask import render_template, url_for
+from mysql.connector import Error
+
+import eligibility
+import metrics
+import scheduler
+
+_app = None
+_ballots = {}
+_ballots_lock = threading.Lock()
+
+
+def ballot_ttl():
+    return float(os.environ.get('BALLOT_CACHE_TTL', '60'))
+
+
+def _max_choices(method, seats, candidates):
+    """How many candidates a ballot may list for a position, as submit_vote enforces"""
+    if method == 'irv':
+        return candidates
+    if method == 'block':
+        return seats or 1
+    return 1
+
+
+def build(connection, election_id):
+    """The election's ballot as a dict, None if there is no such election"""
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT id, name, description, end_date, status FROM elections WHERE id = %s",
+                       (election_id,))
+        election = cursor.fetchone()
+        if not election:
+            return None
+
+        # Candidates of a position without a positions row still stand, as in submit_vote
+        cursor.execute("""
+            SELECT c.position, p.seats, p.tally_method,
+                   c.id AS candidate_id, c.manifesto, c.photo_url,
+                   vo.first_name, vo.last_name, vo.program
+            FROM candidates c
+            LEFT JOIN positions p ON p.election_id = c.election_id AND p.position_name = c.position
+            LEFT JOIN voters vo ON vo.student_number = c.student_number
+            WHERE c.election_id = %s AND c.is_approved = TRUE
+            ORDER BY p.id, c.position, c.id
+        """, (election_id,))
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    positions = {}
+    for row in rows:
+        position = positions.setdefault(row['position'], {
+            'name': row['position'],
+            'seats': row['seats'] or 1,
+            'method': row['tally_method'] or 'plurality',
+            'candidates': [],
+        })
+        position['candidates'].append({
+            'id': row['candidate_id'],
+            'name': f"{row['first_name'] or ''} {row['last_name'] or ''}".strip(),
+            'program': row['program'],
+            'manifesto': row['manifesto'] or '',
+            'photo_url': row['photo_url'] or '',
+        })
+    for position in positions.values():
+        position['max_choices'] = _max_choices(position['method'], position['seats'], len(position['candidates']))
+
+    return {
+        'election_id': election['id'],
+        'name': election['name'],
+        'description': election['description'] or '',
+        'end_date': str(election['end_date']),
+        'status': election['status'],
+        'positions': list(positions.values()),
+    }
+
+
+def _load(connection, election_id):
+    ballot = build(connection, election_id)
+    if ballot is None:
+        return None
+    return {
+        'ballot': ballot,
+        'rules': eligibility.get_rules(connection, election_id),
+        'built_at': time.time(),
+        'cohorts': {},
+    }
+
+
+def _entry(create_connection, election_id):
+    entry = _ballots.get(election_id)
+    if entry is not None and time.time() - entry['built_at'] < ballot_ttl():
+        metrics.record_cache('ballot', True)
+        return entry
+    metrics.record_cache('ballot', False)
+    connection = create_connection()
+    if connection is None:
+        # Keep serving what this worker has while the database is down
+        return entry
+    try:
+        entry = _load(connection, election_id)
+    except Error as e:
+        print(f"Error building ballot of election {election_id}: {e}")
+        return _ballots.get(election_id)
+    finally:
+        if connection.is_connected():
+            connection.close()
+    with _ballots_lock:
+        if entry is None:
+            _ballots.pop(election_id, None)
+        else:
+            _ballots[election_id] = entry
+    return entry
+
+
+def _render(entry, cohort):
+    """JSON and HTML of one cohort's ballot; needs a request context for url_for"""
+    rendered = entry['cohorts'].get(cohort)
+    if rendered is not None:
+        return rendered
+    ballot = dict(entry['ballot'], cohort={'program': cohort[0], 'academic_year': cohort[1]})
+    ballot['positions'] = [dict(position, candidates=[
+        dict(candidate, photo_url=url_for('static', filename=candidate['photo_url']) if candidate['photo_url'] else '')
+        for candidate in position['candidates']]) for position in ballot['positions']]
+    rendered = {
+        'ballot': ballot,
+        'json': json.dumps(ballot),
+        'html': render_template('ballot_form.html', ballot=ballot),
+    }
+    with _ballots_lock:
+        entry['cohorts'][cohort] = rendered
+    return rendered
+
+
+def get_ballot(create_connection, election_id, program, academic_year):
+    """The rendered ballot for a voter of this program and year, None if they may not vote in it"""
+    entry = _entry(create_connection, election_id)
+    if entry is None or entry['rules'] is None:
+        return None
+    rules = entry['rules']
+    if rules['programs'] is not None and program not in rules['programs']:
+        return None
+    if rules['academic_years'] is not None and academic_year not in rules['academic_years']:
+        return None
+    return _render(entry, eligibility.cohort_key(rules, program, academic_year))
+
+
+def invalidate(election_id=None):
+    """Drop one election's ballot, or all of them when the election is not known"""
+    with _ballots_lock:
+        if election_id is None:
+            _ballots.clear()
+        else:
+            _ballots.pop(election_id, None)
+
+
+@scheduler.on_open
+def prewarm(connection, election_id):
+    """Build the ballot and render it for every eligible cohort when voting opens"""
+    entry = _load(connection, election_id)
+    if entry is None or entry['rules'] is None:
+        return
+    with _ballots_lock:
+        _ballots[election_id] = entry
+    if _app is None:
+        return
+    rules = entry['rules']
+    programs = sorted(rules['programs']) if rules['programs'] is not None else ['*']
+    years = sorted(rules['academic_years']) if rules['academic_years'] is not None else ['*']
+    # The scheduler thread has no request, url_for and templates need one
+    with _app.test_request_context():
+        for program in programs:
+            for year in years:
+                _render(entry, (program, year))
+
+
+@scheduler.on_close
+def drop_closed(connection, election_id):
+    invalidate(election_id)
+
+
+def init_app(app):
+    """Let the scheduler render ballots outside of a request"""
+    global _app
+    _app = app
@@ -0,0 +1,255 @@
+"""
+Micro-benchmarks for every route handler and get_*_from_db helper.
+
+Each case runs through the Flask test client (or calls the helper directly)
+against a seeded local database and reports the median and p95 time per
+call, the peak memory allocated during one call and the number of SQL
+statements it issues. Seed the database first. The election scheduler is
+off unless ELECTION_SCHEDULER is set, so the seed's open term stays open
+whatever --now it was seeded with and runs compare like with like, e.g.:
+
+    python seed_data.py --voters 5000 --votes 20000 --reset
+    python benchmarks.py --save-baseline          # record a baseline
+    python benchmarks.py                          # compare against it
+
+Pass --backend sqlite or --backend mysql to pick the storage backend;
+baselines are kept per backend. The comparison exits non-zero when a case
+got slower than the tolerance, allocates noticeably more, or issues more
+queries than the baseline.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks_baseline.json')
+
+# Ignore timing differences below this, they are noise at this scale
+MIN_TIME_DELTA_MS = 0.5
+
+
+class QueryCounter:
+    """Counts statements seen by the instrumented cursors"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, record):
+        self.count += 1
+
+
+class BenchmarkContext:
+    """Flask clients and ids picked from the seeded database"""
+
+    def __init__(self, voting_app):
+        self.app = voting_app
+        self.admin = voting_app.app.test_client()
+        with self.admin.session_transaction() as flask_session:
+            flask_session['admin_logged_in'] = True
+            flask_session['admin_id'] = 1
+            flask_session['admin_username'] = 'admin'
+        self.anonymous = voting_app.app.test_client()
+        self.student_client = voting_app.app.test_client()
+        self.registrations = 0
+
+        connection = voting_app.create_connection()
+        if connection is None:
+            raise SystemExit('Database connection failed')
+        cursor = connection.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT id, email, student_number FROM voters ORDER BY id LIMIT 1")
+            self.student = cursor.fetchone()
+            cursor.execute("SELECT id FROM elections ORDER BY id DESC LIMIT 1")
+            election = cursor.fetchone()
+            cursor.execute("SELECT id FROM schools ORDER BY id LIMIT 1")
+            school = cursor.fetchone()
+            cursor.execute("SELECT name FROM programs ORDER BY id LIMIT 1")
+            self.program = cursor.fetchone()['name']
+            cursor.execute("SELECT name FROM academic_years ORDER BY code LIMIT 1")
+            self.academic_year = cursor.fetchone()['name']
+            cursor.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM voters")
+            self.next_student = 60000000 + cursor.fetchone()['max_id']
+        finally:
+            cursor.close()
+            connection.close()
+
+        if not self.student or not election:
+            raise SystemExit('Database is empty, run seed_data.py first')
+        self.election_id = election['id']
+        self.school_id = school['id']
+
+        self.student_client.post('/login', data={'email-address': self.student['email'],
+                                                 'SIN': self.student['student_number']})
+
+    def register_form(self):
+        self.registrations += 1
+        student_number = f"{(self.next_student + self.registrations) % 100000000:08d}"
+        return {'first_name': 'Bench', 'last_name': 'Student', 'date_of_birth': '2002-01-01',
+                'school': self.school_id, 'program': self.program, 'student_number': student_number,
+                'academic_year': self.academic_year, 'nrc': '123456/78/9', 'gender': 'Female',
+                'email': f"bench{student_number}@example.com", 'phone_number': '0970000000',
+                'address_type': 'Campus'}
+
+
+def build_cases(ctx):
+    """Benchmark name -> zero-argument callable"""
+    voting_app = ctx.app
+    return {
+        'route:register GET': lambda: ctx.anonymous.get('/register'),
+        'route:register POST': lambda: ctx.anonymous.post('/register', data=ctx.register_form()),
+        'route:login POST': lambda: ctx.anonymous.post('/login', data={
+            'email-address': ctx.student['email'], 'SIN': ctx.student['student_number']}),
+        'route:student_dasboard': lambda: ctx.student_client.get('/student/dashboard'),
+        'route:admin_dashboard': lambda: ctx.admin.get('/admin/dashboard'),
+        'route:manage_candidates': lambda: ctx.admin.get('/admin/candidates'),
+        'route:manage_candidates search': lambda: ctx.admin.get('/admin/candidates?search=Mulenga'),
+        'route:manage_elections': lambda: ctx.admin.get('/admin/elections'),
+        'route:manage_elections filtered': lambda: ctx.admin.get('/admin/elections?status=active'),
+        'route:create_election GET': lambda: ctx.admin.get('/admin/elections/create'),
+        'route:turnout_analytics crosstab': lambda: ctx.admin.get('/admin/analytics?by=program&cross=gender'),
+        'ajax:results_data': lambda: ctx.admin.get(f'/admin/results/{ctx.election_id}/data'),
+        'ajax:get_positions_by_election': lambda: ctx.admin.get(f'/admin/get-positions/{ctx.election_id}'),
+        'ajax:get_student_info': lambda: ctx.admin.get(f"/admin/get-student/{ctx.student['student_number']}"),
+        'ajax:search_students': lambda: ctx.admin.get(f"/admin/students/search?q={ctx.student['student_number'][:4]}"),
+        'ajax:get_programs': lambda: ctx.anonymous.get(f'/get-programs/{ctx.school_id}'),
+        'ajax:get_programs_by_school': lambda: ctx.admin.get(f'/admin/get-programs/{ctx.school_id}'),
+        'helper:get_schools_from_db': voting_app.get_schools_from_db,
+        'helper:get_programs_from_db': voting_app.get_programs_from_db,
+        'helper:get_programs_from_db school': lambda: voting_app.get_programs_from_db(ctx.school_id),
+        'helper:get_academic_years_from_db': voting_app.get_academic_years_from_db,
+    }
+
+
+def measure(func, iterations, warmup, counter):
+    """Median/p95 time, queries per call and peak allocation for one case"""
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    counter.count = 0
+    for _ in range(iterations):
+        started = time.perf_counter()
+        response = func()
+        timings.append((time.perf_counter() - started) * 1000)
+    queries = counter.count / iterations
+
+    # Allocation pass is separate so tracing does not distort the timings
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(0.95 * len(timings)))], 3),
+        'queries': round(queries, 2),
+        'alloc_kb': round((peak - before) / 1024, 1),
+        'status': getattr(response, 'status_code', None),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Names of cases that regressed against the baseline, with reasons"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        reasons = []
+        if (current['median_ms'] > previous['median_ms'] * (1 + tolerance)
+                and current['median_ms'] - previous['median_ms'] > MIN_TIME_DELTA_MS):
+            reasons.append(f"median {previous['median_ms']}ms -> {current['median_ms']}ms")
+        if current['queries'] > previous['queries']:
+            reasons.append(f"queries {previous['queries']} -> {current['queries']}")
+        if current['alloc_kb'] > previous['alloc_kb'] * (1 + tolerance) + 16:
+            reasons.append(f"alloc {previous['alloc_kb']}KiB -> {current['alloc_kb']}KiB")
+        if reasons:
+            regressions.append((name, reasons))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for route handlers and DB helpers')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--filter', default='', help='Only run cases whose name contains this text')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='Store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown before failing (0.25 = 25%%)')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    parser.add_argument('--backend', choices=['mysql', 'sqlite'],
+                        help='Storage backend to benchmark (default: DB_BACKEND or mysql)')
+    args = parser.parse_args()
+
+    # The backend has to be chosen before the app is imported
+    if args.backend:
+        os.environ['DB_BACKEND'] = args.backend
+    # Keep the seeded elections in the state they were seeded in
+    os.environ.setdefault('ELECTION_SCHEDULER', '0')
+    backend = os.environ.get('DB_BACKEND', 'mysql')
+
+    # The helpers print every row they fetch, keep that out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as voting_app
+        import metrics
+        counter = QueryCounter()
+        metrics.add_query_observer(counter)
+        ctx = BenchmarkContext(voting_app)
+    # Failing handlers are reported through their status code instead of tracebacks
+    voting_app.app.logger.disabled = True
+    cases = build_cases(ctx)
+
+    results = {}
+    print(f"{'benchmark':42} {'median ms':>10} {'p95 ms':>9} {'queries':>8} {'alloc KiB':>10} {'status':>7}")
+    for name, func in cases.items():
+        if args.filter and args.filter not in name:
+            continue
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = measure(func, args.iterations, args.warmup, counter)
+        results[name] = result
+        print(f"{name:42} {result['median_ms']:10.3f} {result['p95_ms']:9.3f} "
+              f"{result['queries']:8.2f} {result['alloc_kb']:10.1f} {result['status'] or '':>7}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        stored = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                stored = json.load(f)
+        stored.setdefault(backend, {}).update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, run with --save-baseline first")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f).get(backend, {})
+    if not baseline:
+        print(f"\nNo {backend} baseline in {args.baseline}, run with --save-baseline first")
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+        for name, reasons in regressions:
+            print(f"  {name}: {'; '.join(reasons)}")
+        return 1
+    print(f"\nNo regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+Circuit breaker around database connections, and the health endpoints.
+
+create_connection() asks the breaker before connecting:
+
+    closed     connections are attempted; DB_BREAKER_FAILURES consecutive
+               failures (default 5) open the breaker
+    open       create_connection() returns None at once instead of waiting
+               for the connect timeout; after DB_BREAKER_RESET_SECONDS
+               (default 10) the breaker goes half-open
+    half-open  a single request probes the database, the others still fail
+               fast; success closes the breaker, failure opens it again
+
+Only connection failures count. A query that fails on a working connection
+(a duplicate key, a deadlock) says nothing about whether the database is
+reachable.
+
+/healthz answers 200 while the process is serving requests and never
+touches the database. /readyz answers 503 while the breaker is open or a
+SELECT 1 fails, so the platform stops routing traffic to this node until
+its database path recovers.
+"""
+import json
+import os
+import threading
+import time
+
+from mysql.connector import Error
+
+import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+_breakers = []
+
+REJECTED = metrics.Counter('db_circuit_rejected_total', 'Connections refused by an open circuit breaker',
+                           ('breaker',))
+TRANSITIONS = metrics.Counter('db_circuit_transitions_total', 'Circuit breaker state changes',
+                              ('breaker', 'state'))
+STATE = metrics.Gauge('db_circuit_state', 'Circuit breaker state (0 closed, 1 half-open, 2 open)', ('breaker',),
+                      lambda: {(breaker.name,): STATE_VALUES[breaker.state] for breaker in _breakers})
+
+
+class CircuitBreaker:
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or int(os.environ.get('DB_BREAKER_FAILURES', '5'))
+        self.reset_timeout = reset_timeout or float(os.environ.get('DB_BREAKER_RESET_SECONDS', '10'))
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = None
+        self.last_error = None
+        self.lock = threading.Lock()
+        _breakers.append(self)
+
+    def _move(self, state):
+        if state != self.state:
+            self.state = state
+            TRANSITIONS.inc((self.name, state))
+            print(f"Database circuit breaker {self.name} is now {state}")
+
+    def allow(self):
+        """True if the caller may try the database now"""
+        with self.lock:
+            now = time.monotonic()
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and now - self.opened_at >= self.reset_timeout:
+                self._move(HALF_OPEN)
+                self.probe_started = None
+            if self.state == HALF_OPEN:
+                # One probe at a time, and a new one if the last never reported back
+                if self.probe_started is None or now - self.probe_started >= self.reset_timeout:
+                    self.probe_started = now
+                    return True
+            REJECTED.inc((self.name,))
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.probe_started = None
+            self._move(CLOSED)
+
+    def record_failure(self, error=None):
+        with self.lock:
+            self.failures += 1
+            self.last_error = str(error) if error is not None else None
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.probe_started = None
+                self._move(OPEN)
+
+    def status(self):
+        with self.lock:
+            status = {'state': self.state, 'consecutive_failures': self.failures}
+            if self.state != CLOSED:
+                status['retry_in'] = round(max(0.0, self.opened_at + self.reset_timeout - time.monotonic()), 1)
+                status['last_error'] = self.last_error
+            return status
+
+
+# Guards create_connection() to the primary database
+primary = CircuitBreaker('primary')
+
+
+def init_app(app, create_connection):
+    """Register /healthz and /readyz"""
+
+    def healthz():
+        """Liveness: the worker answers requests"""
+        return json.dumps({'status': 'ok', 'database': primary.status()})
+
+    def readyz():
+        """Readiness: the database can be reached through this worker"""
+        # Fails fast while the breaker is open, and serves as the probe when it is due
+        connection = create_connection()
+        body = {'database': primary.status()}
+        if connection is None:
+            body['status'] = 'unavailable'
+            return json.dumps(body), 503, {'Retry-After': str(int(primary.reset_timeout))}
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+        except Error as e:
+            print(f"Readiness check failed: {e}")
+            body['status'] = 'unavailable'
+            return json.dumps(body), 503
+        finally:
+            if connection.is_connected():
+                connection.close()
+        body['status'] = 'ready'
+        return json.dumps(body)
+
+    app.add_url_rule('/healthz', 'healthz', healthz)
+    app.add_url_rule('/readyz', 'readyz', readyz)
@@ -0,0 +1,110 @@
+"""
+Shared snapshot of the admin dashboard aggregates.
+
+Everything the dashboard shows is computed together in three statements:
+the voter and election totals in one row of scalar subqueries, the latest
+registrations, and the active elections with their vote counts. The
+result is kept in memory and recomputed at most once every
+DASHBOARD_SNAPSHOT_TTL seconds (default 5) per worker, by whichever request
+first finds it stale while the others wait for it, so the dashboard's
+database cost does not grow with the number of admins watching. The live
+turnout stream reads the same snapshot.
+"""
+import os
+import threading
+import time
+
+import metrics
+
+RECENT_VOTERS = 5
+
+
+def snapshot_ttl():
+    return float(os.environ.get('DASHBOARD_SNAPSHOT_TTL', '5'))
+
+
+def compute(connection):
+    """Run the dashboard queries and return the snapshot dict"""
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT
+                (SELECT COUNT(*) FROM voters) AS total_voters,
+                (SELECT COUNT(*) FROM voters WHERE has_voted = TRUE) AS voted_count,
+                (SELECT COUNT(*) FROM elections WHERE status = 'active') AS active_elections
+        """)
+        totals = cursor.fetchone()
+
+        cursor.execute("""
+            SELECT first_name, last_name, student_number, program, email,
+                   registration_date, has_voted
+            FROM voters
+            ORDER BY registration_date DESC
+            LIMIT %s
+        """, (RECENT_VOTERS,))
+        recent_voters = cursor.fetchall()
+
+        cursor.execute("""
+            SELECT e.id, e.name, e.election_type, e.start_date, e.end_date,
+                   COUNT(v.id) AS votes_cast, COUNT(DISTINCT v.voter_id) AS ballots
+            FROM elections e
+            LEFT JOIN votes v ON e.id = v.election_id
+            WHERE e.status = 'active'
+            GROUP BY e.id, e.name, e.election_type, e.start_date, e.end_date
+            ORDER BY e.start_date DESC
+        """)
+        elections = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    total_voters = int(totals['total_voters'] or 0)
+    voted_count = int(totals['voted_count'] or 0)
+    return {
+        'stats': {
+            'total_voters': total_voters,
+            'voted_count': voted_count,
+            'pending_count': total_voters - voted_count,
+            'active_elections': int(totals['active_elections'] or 0),
+        },
+        'recent_voters': recent_voters,
+        'elections': elections,
+        'generated_at': time.time(),
+    }
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def _fresh(snapshot):
+    return snapshot is not None and time.time() - snapshot['generated_at'] < snapshot_ttl()
+
+
+def get_snapshot(create_connection):
+    """The current snapshot, recomputed once per TTL; None if it was never computed and the database is down"""
+    global _snapshot
+    if _fresh(_snapshot):
+        metrics.record_cache('dashboard', True)
+        return _snapshot
+
+    with _snapshot_lock:
+        # Requests that queued behind the recompute reuse its result
+        if _fresh(_snapshot):
+            metrics.record_cache('dashboard', True)
+            return _snapshot
+        metrics.record_cache('dashboard', False)
+        connection = create_connection()
+        if connection is None:
+            return _snapshot
+        try:
+            _snapshot = compute(connection)
+        finally:
+            if connection.is_connected():
+                connection.close()
+        return _snapshot
+
+
+def invalidate():
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = None
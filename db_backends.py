@@ -0,0 +1,379 @@
+"""
+Storage backends for the voting system.
+
+The app is written against the mysql.connector API (%s placeholders,
+cursor(dictionary=True), mysql.connector.Error). Two backends provide it:
+
+- MySQLBackend: the production MySQL server configured by get_db_config()
+- SQLiteBackend: an embedded SQLite file in WAL mode for single-node
+  deployments and test runs, with no server and no network hop per query
+
+The backend is chosen with DB_BACKEND=mysql|sqlite (or a sqlite:///path
+DATABASE_URL). SQLITE_PATH sets the database file for SQLite.
+"""
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, datetime
+from urllib.parse import urlparse
+
+import mysql.connector
+from mysql.connector import errors as mysql_errors
+
+DEFAULT_SQLITE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'voting_system.db')
+
+
+def get_db_config():
+    """Get database configuration from Railway environment variables"""
+    # Try multiple possible database URL variables
+    db_url_str = (
+        os.environ.get('MYSQL_URL') or
+        os.environ.get('DATABASE_URL')
+    )
+
+    if db_url_str:
+        db_url = urlparse(db_url_str)
+        return {
+            'host': db_url.hostname,
+            'user': db_url.username,
+            'password': db_url.password,
+            'database': db_url.path[1:],
+            'port': db_url.port
+        }
+    else:
+        # Try individual MySQL variables
+        if all(key in os.environ for key in ['MYSQLHOST', 'MYSQLUSER', 'MYSQLPASSWORD', 'MYSQLDATABASE']):
+            return {
+                'host': os.environ['MYSQLHOST'],
+                'user': os.environ['MYSQLUSER'],
+                'password': os.environ['MYSQLPASSWORD'],
+                'database': os.environ['MYSQLDATABASE'],
+                'port': int(os.environ.get('MYSQLPORT', '3306'))
+            }
+        else:
+            # Local development fallback
+            return {
+                'host': 'localhost',
+                'user': 'root',
+                'password': '',
+                'database': 'voting_system_db'
+            }
+
+
+class MySQLBackend:
+    """MySQL server, the production backend"""
+
+    name = 'mysql'
+
+    def __init__(self, config=None):
+        self.config = config
+
+    def connect(self, config=None):
+        return mysql.connector.connect(**(config or self.config or get_db_config()))
+
+    def ensure_index(self, cursor, table, index_name, columns, unique=False):
+        """Create an index unless it already exists (MySQL has no IF NOT EXISTS)"""
+        cursor.execute("""
+            SELECT 1 FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+            LIMIT 1
+        """, (table, index_name))
+        if cursor.fetchone():
+            return False
+        kind = 'UNIQUE INDEX' if unique else 'INDEX'
+        cursor.execute(f"CREATE {kind} {index_name} ON {table} ({', '.join(columns)})")
+        return True
+
+    def add_column(self, cursor, table, column, definition):
+        """Add a column to an existing table unless it is already there"""
+        cursor.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+            LIMIT 1
+        """, (table, column))
+        if cursor.fetchone():
+            return False
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+
+    def set_constraint_checks(self, cursor, enabled):
+        """Toggle foreign key and unique checks for bulk loads"""
+        flag = 1 if enabled else 0
+        cursor.execute(f"SET FOREIGN_KEY_CHECKS = {flag}")
+        cursor.execute(f"SET UNIQUE_CHECKS = {flag}")
+
+    def upsert_add_sql(self, table, columns, key_columns, add_columns):
+        """INSERT that adds add_columns onto an existing row with the same unique key"""
+        updates = ', '.join(f"{column} = {column} + VALUES({column})" for column in add_columns)
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+                f"ON DUPLICATE KEY UPDATE {updates}")
+
+
+# ---------------------------------------------------------------------------
+# SQLite
+# ---------------------------------------------------------------------------
+
+def _adapt_datetime(value):
+    return value.isoformat(' ')
+
+
+def _convert_datetime(value):
+    text = value.decode()
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        return text
+
+
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter('DATETIME', _convert_datetime)
+sqlite3.register_converter('TIMESTAMP', _convert_datetime)
+
+# MySQL dialect -> SQLite rewrites, applied once per distinct statement
+_SQL_REWRITES = (
+    (re.compile(r'\bINT\s+AUTO_INCREMENT\s+PRIMARY\s+KEY\b', re.I), 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+    (re.compile(r"\bENUM\s*\((?:\s*'[^']*'\s*,?)+\)", re.I), 'TEXT'),
+    (re.compile(r'\s+ON\s+UPDATE\s+CURRENT_TIMESTAMP\b', re.I), ''),
+    (re.compile(r'\bDEFAULT\s+CURRENT_TIMESTAMP\b', re.I), "DEFAULT (datetime('now', 'localtime'))"),
+    (re.compile(r'\bUNIQUE\s+KEY\s+\w+\s*\(', re.I), 'UNIQUE ('),
+    (re.compile(r'\)\s*ENGINE\s*=\s*\w+[^;]*$', re.I), ')'),
+    (re.compile(r"^\s*SHOW\s+TABLES\s+LIKE\s+('[^']*')\s*$", re.I),
+     r"SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE \1"),
+    (re.compile(r'\bINSERT\s+IGNORE\b', re.I), 'INSERT OR IGNORE'),
+    (re.compile(r'\bNOW\(\)', re.I), "datetime('now', 'localtime')"),
+    (re.compile(r'%s'), '?'),
+)
+_translated = {}
+
+
+def translate_sql(sql):
+    """Rewrite a MySQL statement into the SQLite dialect"""
+    translated = _translated.get(sql)
+    if translated is None:
+        translated = sql
+        for pattern, replacement in _SQL_REWRITES:
+            translated = pattern.sub(replacement, translated)
+        if len(_translated) < 5000:
+            _translated[sql] = translated
+    return translated
+
+
+def _translate_error(e, sql=''):
+    """Map sqlite3 errors onto the mysql.connector errors the handlers catch"""
+    message = str(e)
+    if isinstance(e, sqlite3.IntegrityError):
+        if 'UNIQUE' in message:
+            return mysql_errors.IntegrityError(msg=f"Duplicate entry: {message}", errno=1062, sqlstate='23000')
+        if 'FOREIGN KEY' in message:
+            # Deleting a referenced parent and inserting an orphan child share one message
+            errno = 1451 if sql.lstrip().upper().startswith('DELETE') else 1452
+            return mysql_errors.IntegrityError(msg=message, errno=errno, sqlstate='23000')
+        if 'NOT NULL' in message:
+            return mysql_errors.IntegrityError(msg=message, errno=1048, sqlstate='23000')
+        return mysql_errors.IntegrityError(msg=message, sqlstate='23000')
+    if isinstance(e, sqlite3.OperationalError):
+        if 'locked' in message or 'busy' in message:
+            return mysql_errors.OperationalError(msg=message, errno=1205)
+        return mysql_errors.ProgrammingError(msg=message)
+    return mysql_errors.DatabaseError(msg=message)
+
+
+class SQLiteCursor:
+    """mysql.connector style cursor over sqlite3"""
+
+    def __init__(self, connection, dictionary=False):
+        self._connection = connection
+        self._cursor = connection._db.cursor()
+        self._dictionary = dictionary
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return dict(zip(self.column_names, row))
+
+    @property
+    def column_names(self):
+        description = self._cursor.description or ()
+        return tuple(column[0] for column in description)
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def execute(self, sql, params=None, multi=False):
+        translated = translate_sql(sql)
+        try:
+            if params is None:
+                self._cursor.execute(translated)
+            else:
+                self._cursor.execute(translated, tuple(params))
+        except sqlite3.Error as e:
+            raise _translate_error(e, sql) from e
+
+    def executemany(self, sql, seq_params):
+        try:
+            self._cursor.executemany(translate_sql(sql), [tuple(params) for params in seq_params])
+        except sqlite3.Error as e:
+            raise _translate_error(e, sql) from e
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        if not self._dictionary:
+            return rows
+        names = self.column_names
+        return [dict(zip(names, row)) for row in rows]
+
+    def __iter__(self):
+        for row in self._cursor:
+            yield self._row(row)
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """mysql.connector style connection over sqlite3"""
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, timeout=30, detect_types=sqlite3.PARSE_DECLTYPES,
+                                   check_same_thread=False)
+        self._db.execute('PRAGMA foreign_keys = ON')
+        # WAL makes NORMAL durable across application crashes and much cheaper than FULL
+        self._db.execute('PRAGMA synchronous = NORMAL')
+        self._open = True
+
+    def cursor(self, dictionary=False, **kwargs):
+        return SQLiteCursor(self, dictionary=dictionary)
+
+    @property
+    def autocommit(self):
+        return self._db.isolation_level is None
+
+    @autocommit.setter
+    def autocommit(self, value):
+        self._db.isolation_level = None if value else ''
+
+    def start_transaction(self, **kwargs):
+        if not self._db.in_transaction:
+            self._db.execute('BEGIN')
+
+    @property
+    def in_transaction(self):
+        return self._db.in_transaction
+
+    def commit(self):
+        self._db.commit()
+
+    def rollback(self):
+        self._db.rollback()
+
+    def is_connected(self):
+        return self._open
+
+    def ping(self, reconnect=False, **kwargs):
+        self._db.execute('SELECT 1')
+
+    def close(self):
+        if self._open:
+            self._db.close()
+            self._open = False
+
+
+class SQLiteBackend:
+    """Embedded SQLite database in WAL mode"""
+
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._wal_lock = threading.Lock()
+        self._wal_ready = False
+
+    def connect(self, config=None):
+        connection = SQLiteConnection(self.path)
+        if not self._wal_ready:
+            # journal_mode is stored in the database file, set it once per process
+            with self._wal_lock:
+                if not self._wal_ready:
+                    connection._db.execute('PRAGMA journal_mode = WAL')
+                    self._wal_ready = True
+        return connection
+
+    def ensure_index(self, cursor, table, index_name, columns, unique=False):
+        kind = 'UNIQUE INDEX' if unique else 'INDEX'
+        cursor.execute(f"CREATE {kind} IF NOT EXISTS {index_name} ON {table} ({', '.join(columns)})")
+        return True
+
+    def add_column(self, cursor, table, column, definition):
+        cursor.execute(f"PRAGMA table_info({table})")
+        if any(row[1] == column for row in cursor.fetchall()):
+            return False
+        cursor.execute(translate_sql(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+        return True
+
+    def set_constraint_checks(self, cursor, enabled):
+        # SQLite ignores this pragma inside a transaction, so commit pending work first
+        cursor._connection.commit()
+        cursor.execute(f"PRAGMA foreign_keys = {'ON' if enabled else 'OFF'}")
+
+    def upsert_add_sql(self, table, columns, key_columns, add_columns):
+        updates = ', '.join(f"{column} = {column} + excluded.{column}" for column in add_columns)
+        return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+                f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {updates}")
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def backend_name():
+    """Configured backend: 'sqlite' or 'mysql' (default)"""
+    name = os.environ.get('DB_BACKEND', '').lower()
+    if name:
+        return name
+    if (os.environ.get('DATABASE_URL') or '').startswith('sqlite:'):
+        return 'sqlite'
+    return 'mysql'
+
+
+def sqlite_path():
+    url = os.environ.get('DATABASE_URL') or ''
+    if url.startswith('sqlite:'):
+        # sqlite:///relative.db or sqlite:////absolute/path.db
+        return url.split(':///', 1)[1] if ':///' in url else DEFAULT_SQLITE_PATH
+    return os.environ.get('SQLITE_PATH', DEFAULT_SQLITE_PATH)
+
+
+def get_backend():
+    """Backend instance for the current configuration, shared per process"""
+    name = backend_name()
+    key = (name, sqlite_path()) if name == 'sqlite' else (name,)
+    backend = _backends.get(key)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(key)
+            if backend is None:
+                if name == 'sqlite':
+                    backend = SQLiteBackend(sqlite_path())
+                elif name == 'mysql':
+                    backend = MySQLBackend()
+                else:
+                    raise ValueError(f"Unknown DB_BACKEND '{name}', expected 'mysql' or 'sqlite'")
+                _backends[key] = backend
+    return backend
@@ -0,0 +1,105 @@
+"""
+Cached eligibility rules per election.
+
+Elections store the eligible programs and academic years as JSON lists of
+ids (or 'all'), while voters store program and academic year names. The
+rules are resolved to name sets once per election and kept in memory, so
+checking a voter is a set lookup instead of two joins.
+"""
+import json
+import threading
+import time
+
+import metrics
+
+# Rules are re-read after this many seconds in case an admin edited them
+RULES_TTL = 300
+
+_rules = {}
+_rules_lock = threading.Lock()
+
+
+def _parse_ids(value):
+    """None means every value is allowed"""
+    if not value or value == 'all':
+        return None
+    try:
+        ids = json.loads(value)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(ids, list) or 'all' in ids or not ids:
+        return None
+    return [str(item) for item in ids]
+
+
+def load_rules(connection, election_id):
+    """Resolve an election's program/year ids into name sets"""
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT program, academic_year FROM elections WHERE id = %s", (election_id,))
+        election = cursor.fetchone()
+        if not election:
+            return None
+
+        rules = {'programs': None, 'academic_years': None, 'loaded_at': time.monotonic()}
+        program_ids = _parse_ids(election['program'])
+        if program_ids:
+            cursor.execute("SELECT id, name FROM programs")
+            names = {str(row['id']): row['name'] for row in cursor.fetchall()}
+            # Older elections may hold names instead of ids
+            rules['programs'] = frozenset(names.get(item, item) for item in program_ids)
+        year_ids = _parse_ids(election['academic_year'])
+        if year_ids:
+            cursor.execute("SELECT id, name FROM academic_years")
+            names = {str(row['id']): row['name'] for row in cursor.fetchall()}
+            rules['academic_years'] = frozenset(names.get(item, item) for item in year_ids)
+        return rules
+    finally:
+        cursor.close()
+
+
+def warm(connection, election_id):
+    """Load and cache an election's rules ahead of the first voter"""
+    rules = load_rules(connection, election_id)
+    with _rules_lock:
+        if rules is None:
+            _rules.pop(election_id, None)
+        else:
+            _rules[election_id] = rules
+    return rules
+
+
+def get_rules(connection, election_id):
+    rules = _rules.get(election_id)
+    if rules is not None and time.monotonic() - rules['loaded_at'] < RULES_TTL:
+        metrics.record_cache('eligibility', True)
+        return rules
+    metrics.record_cache('eligibility', False)
+    return warm(connection, election_id)
+
+
+def is_eligible(connection, election_id, program, academic_year):
+    """True when a voter of this program and year may vote in the election"""
+    rules = get_rules(connection, election_id)
+    if rules is None:
+        return False
+    if rules['programs'] is not None and program not in rules['programs']:
+        return False
+    if rules['academic_years'] is not None and academic_year not in rules['academic_years']:
+        return False
+    return True
+
+
+def cohort_key(rules, program, academic_year):
+    """Part of the voter's identity the election actually restricts on"""
+    return (program if rules['programs'] is not None else '*',
+            academic_year if rules['academic_years'] is not None else '*')
+
+
+def invalidate(election_id=None):
+    """Drop cached rules for one election, or all of them"""
+    with _rules_lock:
+        if election_id is None:
+            _rules.clear()
+        else:
+            _rules.pop(election_id, None)
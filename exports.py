@@ -0,0 +1,251 @@
+"""
+Streaming exports of the voter roll, candidates and election results.
+
+Rows are read from an unbuffered cursor FETCH_ROWS at a time and written
+out by a generator, so an export holds one batch in memory whatever the
+size of the table:
+
+- over HTTP, /admin/export/<dataset>?format=csv|jsonl is sent as a chunked
+  response while the rows are still being read,
+- from the command line the same generator writes to a file, gzipped when
+  the name ends in .gz:
+
+    python exports.py voters --output voters.csv.gz
+    python exports.py candidates --election 12 --format jsonl --output candidates.jsonl
+    python exports.py results --election 12 --output results.csv
+
+CSV cells that a spreadsheet would read as a formula (starting with = + -
+@, tab or carriage return) are prefixed with a single quote. If reading
+fails part way the HTTP export ends with an error line and the transfer is
+aborted rather than completed, so a truncated download cannot pass for a
+whole one.
+
+At most EXPORT_CONCURRENCY exports (default 2) stream at once per worker;
+they are outside admission control, so a long export never holds one of
+the admin request slots. The voter roll leaves out NRC numbers, dates of
+birth and phone numbers.
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+import threading
+
+from mysql.connector import Error
+
+import metrics
+
+FETCH_ROWS = 2000
+FORMATS = ('csv', 'jsonl')
+# Leading characters that make spreadsheets evaluate a cell
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+EXPORT_CONCURRENCY = int(os.environ.get('EXPORT_CONCURRENCY', '2'))
+
+_slots = threading.BoundedSemaphore(EXPORT_CONCURRENCY)
+
+EXPORTED_ROWS = metrics.Counter('export_rows_total', 'Rows written by exports', ('dataset', 'format'))
+
+QUERIES = {
+    'voters': ("""
+        SELECT v.id, v.student_number, v.first_name, v.last_name, s.name AS school, v.program,
+               v.academic_year, v.gender, v.email, v.address_type, v.registration_date, v.has_voted
+        FROM voters v
+        LEFT JOIN schools s ON v.school_id = s.id
+        ORDER BY v.id
+    """, None),
+    'candidates': ("""
+        SELECT c.id, c.election_id, e.name AS election, c.position, c.student_number,
+               vo.first_name, vo.last_name, vo.program, c.is_approved
+        FROM candidates c
+        JOIN elections e ON c.election_id = e.id
+        LEFT JOIN voters vo ON vo.student_number = c.student_number
+    """, "c.election_id = %s"),
+}
+DATASETS = tuple(QUERIES) + ('results',)
+
+
+def _query_rows(connection, dataset, election_id=None):
+    """Yield the column names, then each row, FETCH_ROWS at a time"""
+    query, election_filter = QUERIES[dataset]
+    params = ()
+    if election_id is not None and election_filter:
+        query += f" WHERE {election_filter}"
+        params = (election_id,)
+    if dataset == 'candidates':
+        query += " ORDER BY c.election_id, c.position, c.id"
+    # Unbuffered: the server sends rows as they are fetched instead of all at once
+    cursor = connection.cursor(buffered=False)
+    cursor.execute(query, params)
+    yield list(cursor.column_names)
+    while True:
+        rows = cursor.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        yield from rows
+    # Only closed once every row is read: an unbuffered cursor with unread rows
+    # refuses to close, so after an early stop or an error the owner of the
+    # connection closes it instead, which discards the rest of the result
+    cursor.close()
+
+
+def _result_rows(connection, election_id):
+    """Column names, then one row per candidate per position from the tally engine"""
+    import tally
+    yield ['election_id', 'position', 'method', 'seats', 'ballots', 'candidate_id', 'candidate',
+           'votes', 'percent', 'elected']
+    results = tally.get_results(connection, election_id)
+    if results is None:
+        return
+    for position in results['positions']:
+        for candidate in position['candidates']:
+            yield [election_id, position['position'], position['method'], position['seats'],
+                   position['ballots'], candidate['id'], candidate['name'], candidate['votes'],
+                   candidate['percent'], candidate['elected']]
+
+
+def rows(connection, dataset, election_id=None):
+    if dataset == 'results':
+        return _result_rows(connection, election_id)
+    return _query_rows(connection, dataset, election_id)
+
+
+def _value(value):
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode()
+    if hasattr(value, 'isoformat'):
+        return value.isoformat(sep=' ') if hasattr(value, 'hour') else value.isoformat()
+    return value
+
+
+def _csv_cell(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def error_line(fmt, message):
+    """Last line of an export that failed part way"""
+    if fmt == 'csv':
+        return f"# EXPORT INCOMPLETE: {message}\n"
+    return json.dumps({'error': 'export incomplete', 'detail': message}) + '\n'
+
+
+def encode(row_iter, fmt, dataset='export'):
+    """Turn rows into text chunks of about FETCH_ROWS rows each"""
+    columns = next(row_iter, None)
+    if columns is None:
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(columns)
+
+    count = 0
+    for row in row_iter:
+        values = [_value(value) for value in row]
+        if writer:
+            writer.writerow([_csv_cell(value) for value in values])
+        else:
+            buffer.write(json.dumps(dict(zip(columns, values)), default=str))
+            buffer.write('\n')
+        count += 1
+        if count % FETCH_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            EXPORTED_ROWS.inc((dataset, fmt), FETCH_ROWS)
+    if buffer.getvalue():
+        yield buffer.getvalue()
+    EXPORTED_ROWS.inc((dataset, fmt), count % FETCH_ROWS)
+
+
+def acquire():
+    """Take an export slot without waiting; False when EXPORT_CONCURRENCY exports are running"""
+    return _slots.acquire(blocking=False)
+
+
+def release():
+    _slots.release()
+
+
+def stream(create_connection, dataset, fmt, election_id=None):
+    """Generator for an HTTP response; owns its connection until the last row is sent"""
+    connection = create_connection()
+    if connection is None:
+        raise Error(msg='Database connection error')
+
+    def chunks():
+        try:
+            yield from encode(iter(rows(connection, dataset, election_id)), fmt, dataset)
+        except Error as e:
+            # The 200 is already sent: mark the end of the file, then raise so the
+            # server drops the connection instead of finishing the chunked transfer
+            print(f"Export of {dataset} failed: {e}")
+            yield error_line(fmt, 'database error, the rows above are not the whole export')
+            raise
+        finally:
+            # Also reached through GeneratorExit when the client goes away mid
+            # export; closing the connection drops any rows still unread
+            try:
+                connection.close()
+            except Error:
+                pass
+    return chunks()
+
+
+def write_file(connection, dataset, fmt, output, election_id=None):
+    """Export to a file (gzip when it ends in .gz) or stdout; returns the bytes written"""
+    if output in (None, '-'):
+        handle = sys.stdout
+    elif output.endswith('.gz'):
+        handle = gzip.open(output, 'wt', newline='')
+    else:
+        handle = open(output, 'w', newline='')
+    written = 0
+    try:
+        for chunk in encode(iter(rows(connection, dataset, election_id)), fmt, dataset):
+            handle.write(chunk)
+            written += len(chunk)
+    except Error as e:
+        if handle is sys.stdout:
+            handle.write(error_line(fmt, str(e)))
+        else:
+            # A partial file is removed rather than left looking complete
+            handle.close()
+            os.remove(output)
+        raise
+    finally:
+        if handle is not sys.stdout:
+            handle.close()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export voters, candidates or results as CSV or JSON lines')
+    parser.add_argument('dataset', choices=DATASETS)
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--election', type=int, help='Election to export (required for results)')
+    parser.add_argument('--output', help='File to write, gzipped when it ends in .gz (default: stdout)')
+    args = parser.parse_args()
+    if args.dataset == 'results' and args.election is None:
+        parser.error('results needs --election ID')
+
+    import app as voting_app
+    connection = voting_app.create_connection()
+    if connection is None:
+        raise SystemExit('Database connection failed')
+    try:
+        written = write_file(connection, args.dataset, args.format, args.output, args.election)
+    except Error as e:
+        raise SystemExit(f"Export failed: {e}")
+    finally:
+        connection.close()
+    if args.output not in (None, '-'):
+        print(f"Wrote {args.dataset} to {args.output} ({written} characters)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Live turnout for the admin dashboard over server-sent events.
+
+One aggregator thread per worker reads the shared dashboard snapshot (see
+dashboard_snapshot.py) every LIVE_TURNOUT_INTERVAL seconds (default 5), and
+only while at least one dashboard is listening. Every open
+/admin/live-turnout stream is fed from that single reading, so the
+database load is the same whether one admin or fifty are watching.
+
+Each stream is closed after LIVE_TURNOUT_STREAM_SECONDS (default 300) and
+the browser's EventSource reconnects on its own, so a stream never holds a
+worker thread for long. A stream does hold a thread while it is open, so
+at most LIVE_TURNOUT_MAX_STREAMS (default 4) are open per worker; past
+that the endpoint answers 503 with Retry-After and the dashboard polls
+/admin/live-turnout?poll=1 for the same figures instead.
+"""
+import json
+import os
+import threading
+import time
+
+from mysql.connector import Error
+
+import dashboard_snapshot
+import metrics
+
+SUBSCRIBERS = metrics.Gauge('live_turnout_subscribers', 'Open live turnout streams', (),
+                            lambda: {(): _aggregator.subscribers if _aggregator else 0})
+POLLS = metrics.Counter('live_turnout_polls_total', 'Snapshot reads made by the live turnout aggregator')
+
+# Comment line sent when nothing changed, keeps proxies from closing the stream
+HEARTBEAT_SECONDS = 15
+MAX_STREAMS = int(os.environ.get('LIVE_TURNOUT_MAX_STREAMS', '4'))
+
+_stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+
+
+def poll_interval():
+    return float(os.environ.get('LIVE_TURNOUT_INTERVAL', '5'))
+
+
+def stream_seconds():
+    return float(os.environ.get('LIVE_TURNOUT_STREAM_SECONDS', '300'))
+
+
+def turnout_from_snapshot(snapshot):
+    """Turnout totals and per-election vote counts out of the dashboard snapshot"""
+    data = dict(snapshot['stats'])
+    data['elections'] = [{'id': row['id'], 'name': row['name'], 'votes_cast': int(row['votes_cast']),
+                          'ballots': int(row['ballots'])} for row in snapshot['elections']]
+    return data
+
+
+def acquire():
+    """Take a stream slot without waiting; False when MAX_STREAMS streams are open"""
+    return _stream_slots.acquire(blocking=False)
+
+
+def release():
+    _stream_slots.release()
+
+
+def current(create_connection):
+    """One reading for dashboards that poll instead of streaming; None without a snapshot"""
+    snapshot = dashboard_snapshot.get_snapshot(create_connection)
+    if snapshot is None:
+        return None
+    return dict(turnout_from_snapshot(snapshot), generated_at=snapshot['generated_at'])
+
+
+class TurnoutAggregator:
+    """Polls once per interval and hands the same snapshot to every subscriber"""
+
+    def __init__(self, create_connection):
+        self.create_connection = create_connection
+        self.condition = threading.Condition()
+        self.counts = None
+        self.snapshot = None
+        self.version = 0
+        self.subscribers = 0
+        self.thread = None
+
+    def _poll(self):
+        POLLS.inc()
+        try:
+            # Shared with dashboard page views, so polling adds no queries of its own
+            snapshot = dashboard_snapshot.get_snapshot(self.create_connection)
+        except Error as e:
+            print(f"Live turnout poll failed: {e}")
+            return None
+        return turnout_from_snapshot(snapshot) if snapshot is not None else None
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if self.subscribers == 0:
+                    # Nobody is watching, stop polling until the next subscriber
+                    self.thread = None
+                    return
+            data = self._poll()
+            if data is not None:
+                with self.condition:
+                    # Viewers are only woken when a number actually moved
+                    if data != self.counts:
+                        self.counts = data
+                        self.snapshot = dict(data, generated_at=time.time())
+                        self.version += 1
+                        self.condition.notify_all()
+            time.sleep(poll_interval())
+
+    def subscribe(self):
+        with self.condition:
+            self.subscribers += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='live-turnout', daemon=True)
+                self.thread.start()
+
+    def unsubscribe(self):
+        with self.condition:
+            self.subscribers -= 1
+
+    def wait_for_update(self, seen_version, timeout):
+        """Block until a snapshot newer than seen_version exists or timeout"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.snapshot is not None and self.version != seen_version,
+                                    timeout=timeout)
+            return self.version, self.snapshot
+
+    def stream(self):
+        """Generator of SSE frames for one dashboard viewer"""
+        self.subscribe()
+        try:
+            deadline = time.monotonic() + stream_seconds()
+            # Ask the browser to reconnect quickly when the stream is recycled
+            yield f"retry: {int(poll_interval() * 1000)}\n\n"
+            seen = 0
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                version, snapshot = self.wait_for_update(seen, min(HEARTBEAT_SECONDS, remaining))
+                if version != seen:
+                    seen = version
+                    yield f"id: {version}\nevent: turnout\ndata: {json.dumps(snapshot)}\n\n"
+                else:
+                    yield ": keep-alive\n\n"
+        finally:
+            self.unsubscribe()
+
+
+_aggregator = None
+_aggregator_lock = threading.Lock()
+
+
+def get_aggregator(create_connection):
+    """The process-wide aggregator, created on first use"""
+    global _aggregator
+    if _aggregator is None:
+        with _aggregator_lock:
+            if _aggregator is None:
+                _aggregator = TurnoutAggregator(create_connection)
+    return _aggregator
@@ -0,0 +1,404 @@
+"""
+In-process metrics for the voting system, exposed in the Prometheus text
+format on /metrics.
+
+Every thread writes into its own shard of plain dicts, so recording a sample
+never takes a lock; the shards are only summed when /metrics is scraped.
+When a thread ends its shard is folded into a base shard, so threads that
+come and go do not grow the list. Each gunicorn worker keeps its own
+numbers, so scrape every worker (or run a single worker) to see the full
+picture.
+
+With METRICS_TOKEN set, /metrics wants it as "Authorization: Bearer <token>"
+or ?token=; without it only loopback and private addresses (an internal
+scraper) are answered.
+"""
+import hmac
+import ipaddress
+import os
+import re
+import threading
+import time
+import weakref
+
+from flask import Response, abort, g, has_request_context, request
+
+# Default latency buckets in seconds, shared by request and query histograms
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+class _ShardOwner:
+    """Kept in a thread's local storage only, so it is freed when the thread ends"""
+    __slots__ = ('shard', '__weakref__')
+
+    def __init__(self, shard):
+        self.shard = shard
+
+
+class _ShardedMetric:
+    """Base class holding one dict per thread so writers never contend"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        # The first shard is the base that ended threads are folded into
+        self._shards = [{}]
+        # Taken when a thread starts or stops recording and while summing, never per sample.
+        # Reentrant because a finalizer may run in a thread that already holds it
+        self._shards_lock = threading.RLock()
+        _registry.append(self)
+
+    def _shard(self):
+        owner = getattr(self._local, 'owner', None)
+        if owner is None:
+            owner = _ShardOwner({})
+            with self._shards_lock:
+                self._shards.append(owner.shard)
+            weakref.finalize(owner, self._retire, owner.shard)
+            self._local.owner = owner
+        return owner.shard
+
+    def _retire(self, shard):
+        """Fold the shard of a thread that has ended into the base shard"""
+        with self._shards_lock:
+            for index in range(1, len(self._shards)):
+                if self._shards[index] is shard:
+                    del self._shards[index]
+                    break
+            self._merge(self._shards[0], shard)
+
+    def _merge(self, totals, shard):
+        raise NotImplementedError
+
+    def values(self):
+        totals = {}
+        with self._shards_lock:
+            for shard in list(self._shards):
+                self._merge(totals, shard)
+        return totals
+
+    def _label_text(self, labels, extra=None):
+        pairs = list(zip(self.labelnames, labels))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        escaped = ['%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in pairs]
+        return '{' + ','.join(escaped) + '}'
+
+
+class Counter(_ShardedMetric):
+    """Monotonic counter, optionally split by labels"""
+
+    def inc(self, labels=(), amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, totals, shard):
+        for labels, value in list(shard.items()):
+            totals[labels] = totals.get(labels, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{self._label_text(labels)} {value}")
+        return lines
+
+
+class Histogram(_ShardedMetric):
+    """Cumulative latency histogram with fixed buckets"""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        shard = self._shard()
+        state = shard.get(labels)
+        if state is None:
+            # One slot per bucket plus +Inf, then the running sum
+            state = [0] * (len(self.buckets) + 2)
+            shard[labels] = state
+        index = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            index += 1
+        state[index] += 1
+        state[-1] += value
+
+    def _merge(self, totals, shard):
+        for labels, state in list(shard.items()):
+            merged = totals.get(labels)
+            if merged is None:
+                totals[labels] = list(state)
+            else:
+                for i, value in enumerate(state):
+                    merged[i] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, state in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), state[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._label_text(labels, ('le', bound))} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(labels)} {state[-1]:.6f}")
+            lines.append(f"{self.name}_count{self._label_text(labels)} {cumulative}")
+        return lines
+
+
+class Gauge(_ShardedMetric):
+    """Value computed at scrape time by a callback returning {labels: value}"""
+
+    def __init__(self, name, help_text, labelnames, callback):
+        super().__init__(name, help_text, labelnames)
+        self.callback = callback
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self.callback().items()):
+            lines.append(f"{self.name}{self._label_text(labels)} {value}")
+        return lines
+
+
+# Request level metrics
+REQUEST_LATENCY = Histogram('http_request_duration_seconds',
+                            'Request latency per endpoint', ('endpoint', 'method'))
+REQUESTS_TOTAL = Counter('http_requests_total',
+                         'Requests served per endpoint and status code', ('endpoint', 'method', 'status'))
+
+# Database metrics
+QUERY_LATENCY = Histogram('db_query_duration_seconds',
+                          'SQL execution time per named query', ('query',))
+QUERY_ERRORS = Counter('db_query_errors_total',
+                       'SQL statements that raised an error', ('query',))
+CONNECTION_WAIT = Histogram('db_connection_wait_seconds',
+                            'Time spent waiting to obtain a database connection')
+CONNECTION_ERRORS = Counter('db_connection_errors_total',
+                            'Failed attempts to obtain a database connection')
+
+# Cache metrics, fed by the in-memory caches through record_cache()
+CACHE_REQUESTS = Counter('cache_requests_total',
+                         'Cache lookups per cache and result', ('cache', 'result'))
+
+
+def _cache_hit_ratios():
+    lookups = {}
+    for (cache, result), value in CACHE_REQUESTS.values().items():
+        hits, total = lookups.get(cache, (0, 0))
+        lookups[cache] = (hits + (value if result == 'hit' else 0), total + value)
+    return {(cache,): round(hits / total, 4) for cache, (hits, total) in lookups.items() if total}
+
+
+CACHE_HIT_RATIO = Gauge('cache_hit_ratio', 'Share of cache lookups answered from memory',
+                        ('cache',), _cache_hit_ratios)
+
+
+def record_cache(cache_name, hit):
+    """Count one lookup against a named cache"""
+    CACHE_REQUESTS.inc((cache_name, 'hit' if hit else 'miss'))
+
+
+def observe_connection_wait(seconds, failed=False):
+    """Record how long create_connection() took to hand out a connection"""
+    CONNECTION_WAIT.observe(seconds)
+    if failed:
+        CONNECTION_ERRORS.inc()
+
+
+# Query naming: "<endpoint>:<verb>_<table>", e.g. "admin_dashboard:select_voters"
+_TABLE_PATTERNS = (
+    re.compile(r'^\s*insert\s+(?:ignore\s+)?into\s+`?(\w+)', re.I),
+    re.compile(r'^\s*update\s+`?(\w+)', re.I),
+    re.compile(r'^\s*delete\s+from\s+`?(\w+)', re.I),
+    re.compile(r'\bfrom\s+`?(\w+)', re.I),
+)
+_query_names = {}
+
+
+def query_name(sql):
+    """Short stable name for a statement, grouped by the endpoint issuing it"""
+    base = _query_names.get(sql)
+    if base is None:
+        words = sql.split(None, 1)
+        verb = words[0].lower() if words else 'unknown'
+        table = ''
+        for pattern in _TABLE_PATTERNS:
+            match = pattern.search(sql)
+            if match:
+                table = match.group(1).lower()
+                break
+        base = f"{verb}_{table}" if table else verb
+        # Statements are literals in the code, so this stays small
+        if len(_query_names) < 5000:
+            _query_names[sql] = base
+    return f"{current_endpoint()}:{base}"
+
+
+def current_endpoint():
+    """Endpoint name of the active request, or 'background' outside requests"""
+    if has_request_context():
+        return request.endpoint or 'unknown'
+    return 'background'
+
+
+# Observers get a record dict for every statement executed through an
+# instrumented cursor: {'sql', 'params', 'seconds', 'rows', 'error'}.
+# 'rows' keeps growing as the caller fetches results.
+_query_observers = []
+
+
+def add_query_observer(observer):
+    """Register a callable invoked with the record of each executed statement"""
+    _query_observers.append(observer)
+
+
+def _record_query_metrics(record):
+    name = query_name(record['sql'])
+    QUERY_LATENCY.observe(record['seconds'], (name,))
+    if record['error']:
+        QUERY_ERRORS.inc((name,))
+
+
+add_query_observer(_record_query_metrics)
+
+
+class InstrumentedCursor:
+    """Cursor proxy that times every execute() and counts fetched rows"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._record = None
+
+    def _run(self, method, sql, params):
+        record = {'sql': sql, 'params': params, 'seconds': 0.0, 'rows': 0, 'error': None}
+        started = time.perf_counter()
+        try:
+            if params is None:
+                return method(sql)
+            return method(sql, params)
+        except Exception as e:
+            record['error'] = e
+            raise
+        finally:
+            record['seconds'] = time.perf_counter() - started
+            self._record = record
+            for observer in _query_observers:
+                observer(record)
+
+    def execute(self, sql, params=None, *args, **kwargs):
+        if args or kwargs:
+            return self._cursor.execute(sql, params, *args, **kwargs)
+        return self._run(self._cursor.execute, sql, params)
+
+    def executemany(self, sql, seq_params):
+        return self._run(self._cursor.executemany, sql, seq_params)
+
+    def _count(self, rows):
+        if self._record is not None:
+            self._record['rows'] += rows
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._count(1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._count(len(rows))
+        return rows
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._count(1)
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    """Connection proxy whose cursors report to the query observers"""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._connection.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+def instrument_connection(connection):
+    """Wrap a DB-API connection so its queries are timed"""
+    if connection is None or isinstance(connection, InstrumentedConnection):
+        return connection
+    return InstrumentedConnection(connection)
+
+
+def render_metrics():
+    """Full Prometheus text exposition for every registered metric"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def _scrape_allowed():
+    """Token when METRICS_TOKEN is set, otherwise only internal addresses"""
+    token = os.environ.get('METRICS_TOKEN')
+    if token:
+        header = request.headers.get('Authorization', '')
+        given = header[7:] if header.startswith('Bearer ') else request.args.get('token', '')
+        return hmac.compare_digest(given.encode(), token.encode())
+    try:
+        address = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        return False
+    return address.is_loopback or address.is_private
+
+
+def init_app(app):
+    """Attach request timing hooks and the /metrics endpoint to the Flask app"""
+
+    @app.before_request
+    def _start_request_timer():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('_metrics_started', None)
+        if started is not None:
+            endpoint = request.endpoint or 'unknown'
+            REQUEST_LATENCY.observe(time.perf_counter() - started, (endpoint, request.method))
+            REQUESTS_TOTAL.inc((endpoint, request.method, str(response.status_code)))
+        return response
+
+    @app.teardown_request
+    def _record_failed_request(exc):
+        # after_request is skipped when a view raises, count those as 500s
+        started = g.pop('_metrics_started', None)
+        if started is not None:
+            endpoint = request.endpoint or 'unknown'
+            REQUEST_LATENCY.observe(time.perf_counter() - started, (endpoint, request.method))
+            REQUESTS_TOTAL.inc((endpoint, request.method, '500'))
+
+    def metrics_endpoint():
+        """Prometheus scrape endpoint"""
+        if not _scrape_allowed():
+            abort(403)
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
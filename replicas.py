@@ -0,0 +1,162 @@
+"""
+Read/write routing to MySQL read replicas.
+
+Read-only views (dashboards and listings) call create_read_connection() in
+app.py, which asks this module for a replica connection. Replicas are listed
+in MYSQL_REPLICA_URLS as comma-separated URLs in the same form as MYSQL_URL.
+
+A replica is only used while its replication lag, checked at most every
+REPLICA_LAG_CHECK_INTERVAL seconds, stays under REPLICA_MAX_LAG seconds.
+Otherwise, when no replica is healthy, or for REPLICA_PIN_SECONDS after the
+same browser session wrote something (read-your-writes), reads go to the
+primary. Writes always use create_connection() and the primary.
+"""
+import itertools
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import mysql.connector
+from flask import has_request_context, request, session
+from mysql.connector import Error
+
+import metrics
+
+READ_ROUTING = metrics.Counter('db_read_routing_total',
+                               'Read-only connections by target and reason', ('target', 'reason'))
+REPLICA_LAG = metrics.Gauge('db_replica_lag_seconds', 'Last measured replication lag per replica', ('replica',),
+                            lambda: {(state['name'],): state['lag'] for state in _states.values()
+                                     if state['lag'] is not None})
+
+_states = {}
+_states_lock = threading.Lock()
+_round_robin = itertools.count()
+
+
+def max_lag():
+    return float(os.environ.get('REPLICA_MAX_LAG', '5'))
+
+
+def lag_check_interval():
+    return float(os.environ.get('REPLICA_LAG_CHECK_INTERVAL', '5'))
+
+
+def pin_seconds():
+    return float(os.environ.get('REPLICA_PIN_SECONDS', str(max_lag() + 1)))
+
+
+def get_replica_configs():
+    """Connection settings for every configured replica"""
+    configs = []
+    for url in (os.environ.get('MYSQL_REPLICA_URLS') or '').split(','):
+        url = url.strip()
+        if not url:
+            continue
+        db_url = urlparse(url)
+        configs.append({
+            'host': db_url.hostname,
+            'user': db_url.username,
+            'password': db_url.password,
+            'database': db_url.path[1:],
+            'port': db_url.port or 3306
+        })
+    return configs
+
+
+def _state_for(config):
+    key = (config['host'], config['port'], config['database'])
+    state = _states.get(key)
+    if state is None:
+        with _states_lock:
+            state = _states.setdefault(key, {'name': f"{config['host']}:{config['port']}",
+                                             'lag': None, 'healthy': False, 'checked_at': 0.0})
+    return state
+
+
+def _measure_lag(connection):
+    """Seconds behind the primary, or None if replication is not running"""
+    cursor = connection.cursor(dictionary=True)
+    try:
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+        except Error:
+            # MySQL before 8.0.22 and MariaDB
+            cursor.execute("SHOW SLAVE STATUS")
+        status = cursor.fetchone()
+    finally:
+        cursor.close()
+    if not status:
+        return None
+    lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+    return float(lag) if lag is not None else None
+
+
+def _refresh(config, state, connection):
+    """Re-check replication lag when the last check is older than the interval"""
+    now = time.monotonic()
+    if now - state['checked_at'] < lag_check_interval():
+        return
+    state['checked_at'] = now
+    try:
+        lag = _measure_lag(connection)
+    except Error as e:
+        print(f"Replica lag check failed for {state['name']}: {e}")
+        lag = None
+    state['lag'] = lag
+    state['healthy'] = lag is not None and lag <= max_lag()
+
+
+def pin_to_primary():
+    """Send this session's reads to the primary for a while after it wrote"""
+    session['_primary_until'] = time.time() + pin_seconds()
+
+
+def is_pinned():
+    return has_request_context() and session.get('_primary_until', 0) > time.time()
+
+
+def connect_replica():
+    """
+    Connection to a healthy replica, or (None, reason) when reads should
+    go to the primary instead
+    """
+    configs = get_replica_configs()
+    if not configs:
+        return None, 'no_replicas'
+    if is_pinned():
+        READ_ROUTING.inc(('primary', 'read_your_writes'))
+        return None, 'read_your_writes'
+
+    start = next(_round_robin)
+    for offset in range(len(configs)):
+        config = configs[(start + offset) % len(configs)]
+        state = _state_for(config)
+        # Skip replicas known to be lagging until their next check is due
+        if not state['healthy'] and time.monotonic() - state['checked_at'] < lag_check_interval():
+            continue
+        try:
+            connection = mysql.connector.connect(connection_timeout=2, **config)
+        except Error as e:
+            print(f"Replica {state['name']} unreachable: {e}")
+            state['healthy'] = False
+            state['checked_at'] = time.monotonic()
+            continue
+        _refresh(config, state, connection)
+        if state['healthy']:
+            READ_ROUTING.inc(('replica', 'healthy'))
+            return connection, 'replica'
+        connection.close()
+
+    READ_ROUTING.inc(('primary', 'replicas_unavailable'))
+    return None, 'replicas_unavailable'
+
+
+def init_app(app):
+    """Pin a session to the primary after every successful write request"""
+
+    @app.after_request
+    def _pin_after_write(response):
+        if request.method == 'POST' and response.status_code < 400 and get_replica_configs():
+            pin_to_primary()
+        return response
@@ -0,0 +1,173 @@
+"""
+Background election lifecycle scheduler.
+
+A daemon thread in each worker checks every SCHEDULER_INTERVAL seconds
+(default 30) for 'upcoming' elections whose start_date has passed and
+'active' elections whose end_date has passed, and moves them to 'active'
+and 'completed'. An 'upcoming' election whose end_date has passed as well
+(the app was down for its whole voting window) goes straight to
+'completed'. Each transition is a conditional UPDATE, so when several
+workers race only the one whose UPDATE changed the row runs the hooks.
+
+Hooks registered with on_open() / on_close() do the expensive work once at
+transition time: final tallies are frozen when an election closes, however
+it got there. Open hooks warm caches, and only in the worker that won the
+transition; every other worker fills the same caches lazily on its first
+request for the election, so warming is a head start, never a requirement.
+Set ELECTION_SCHEDULER=0 to disable the thread.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+from mysql.connector import Error
+
+import archival
+import eligibility
+import metrics
+
+TRANSITIONS = metrics.Counter('election_transitions_total',
+                              'Election status changes made by the scheduler', ('transition',))
+
+_open_hooks = []
+_close_hooks = []
+_started = False
+_start_lock = threading.Lock()
+
+
+def on_open(func):
+    """Register func(connection, election_id) to run when an election opens"""
+    _open_hooks.append(func)
+    return func
+
+
+def on_close(func):
+    """Register func(connection, election_id) to run when an election closes"""
+    _close_hooks.append(func)
+    return func
+
+
+def interval():
+    return float(os.environ.get('SCHEDULER_INTERVAL', '30'))
+
+
+def is_enabled():
+    return os.environ.get('ELECTION_SCHEDULER', '1').lower() not in ('0', 'false', 'no')
+
+
+def _run_hooks(hooks, connection, election_id, label):
+    for hook in hooks:
+        started = time.perf_counter()
+        try:
+            hook(connection, election_id)
+        except Exception as e:
+            # One failing hook must not stop the transition or the others
+            print(f"Scheduler {label} hook {hook.__name__} failed for election {election_id}: {e}")
+            try:
+                connection.rollback()
+            except Error:
+                pass
+        else:
+            print(f"Scheduler {label} hook {hook.__name__} for election {election_id} "
+                  f"took {time.perf_counter() - started:.2f}s")
+
+
+def _transition(connection, from_status, to_status, due_query, params):
+    """Move every due election; returns the ids this worker transitioned"""
+    cursor = connection.cursor()
+    won = []
+    try:
+        cursor.execute(due_query, params)
+        due = [row[0] for row in cursor.fetchall()]
+        for election_id in due:
+            cursor.execute("UPDATE elections SET status = %s WHERE id = %s AND status = %s",
+                           (to_status, election_id, from_status))
+            connection.commit()
+            if cursor.rowcount == 1:
+                won.append(election_id)
+    finally:
+        cursor.close()
+    return won
+
+
+def tick(connection, now=None):
+    """Open and close every election that is due; returns (opened, closed)"""
+    now = now or datetime.now()
+
+    opened = _transition(connection, 'upcoming', 'active', """
+        SELECT id FROM elections
+        WHERE status = 'upcoming' AND start_date <= %s AND end_date > %s
+        ORDER BY start_date
+    """, (now, now))
+    for election_id in opened:
+        TRANSITIONS.inc(('opened',))
+        print(f"Scheduler opened election {election_id}")
+        _run_hooks(_open_hooks, connection, election_id, 'open')
+
+    closed = _transition(connection, 'active', 'completed', """
+        SELECT id FROM elections
+        WHERE status = 'active' AND end_date <= %s
+        ORDER BY end_date
+    """, (now,))
+    # Missed entirely: never opened, but closed so its (empty) tallies are frozen too
+    closed += _transition(connection, 'upcoming', 'completed', """
+        SELECT id FROM elections
+        WHERE status = 'upcoming' AND end_date <= %s
+        ORDER BY end_date
+    """, (now,))
+    for election_id in closed:
+        TRANSITIONS.inc(('closed',))
+        print(f"Scheduler closed election {election_id}")
+        _run_hooks(_close_hooks, connection, election_id, 'close')
+
+    return opened, closed
+
+
+@on_open
+def warm_eligibility(connection, election_id):
+    """Resolve the eligibility rules before the first student arrives"""
+    eligibility.warm(connection, election_id)
+
+
+@on_close
+def freeze_final_tallies(connection, election_id):
+    """Snapshot the final per-candidate counts into election_tallies"""
+    archival.freeze_tallies(connection, election_id)
+    eligibility.invalidate(election_id)
+
+
+def _loop(create_connection):
+    while True:
+        connection = create_connection()
+        if connection is not None:
+            try:
+                tick(connection)
+            except Error as e:
+                print(f"Scheduler tick failed: {e}")
+            finally:
+                if connection.is_connected():
+                    connection.close()
+        time.sleep(interval())
+
+
+def start(create_connection):
+    """Start the scheduler thread once per process"""
+    global _started
+    if _started or not is_enabled():
+        return
+    with _start_lock:
+        if _started:
+            return
+        thread = threading.Thread(target=_loop, args=(create_connection,), name='election-scheduler', daemon=True)
+        thread.start()
+        _started = True
+
+
+def init_app(app, create_connection):
+    """Start the scheduler with the first request, so CLI tools importing app do not"""
+
+    @app.before_request
+    def _start_scheduler():
+        if not _started:
+            start(create_connection)
@@ -0,0 +1,360 @@
+"""
+Deterministic synthetic campus data for benchmarks and capacity planning.
+
+Generates voters spread across the schools/programs/academic years already
+seeded by init_database, several terms of Student Union and Class
+Representative elections with their positions and candidates, and votes.
+The same --seed and --now always produce the same database.
+
+The latest term's elections open on --now (default 2024-09-02, a fixed
+date so the dataset is reproducible) and run for four days; they are
+seeded 'active' and earlier terms 'completed'. With a past --now the
+election scheduler closes that term as soon as the app starts, so
+anything that votes against the seed either passes --now (e.g. today)
+or runs with ELECTION_SCHEDULER=0, as benchmarks.py does.
+
+has_voted is set for every voter with a ballot in any election, as
+submit_vote does, and the ballots and turnout_rollup tables are filled
+from the generated votes.
+
+    python seed_data.py --voters 1000 --votes 3000 --reset
+    python seed_data.py --voters 1000000 --votes 10000000 --reset
+
+Rows are bulk loaded with multi-row INSERTs in large batches, with explicit
+primary keys so nothing has to be read back while loading. Works on either
+storage backend (DB_BACKEND=mysql|sqlite).
+"""
+import argparse
+import json
+import math
+import random
+import time
+from array import array
+from datetime import datetime, timedelta
+
+FIRST_NAMES = ['Mwila', 'Chanda', 'Bwalya', 'Mutale', 'Natasha', 'Kondwani', 'Chipo', 'Lombe', 'Musonda',
+               'Thandiwe', 'Kelvin', 'Mercy', 'Joseph', 'Grace', 'Emmanuel', 'Ruth', 'Daniel', 'Esther',
+               'Brian', 'Memory', 'Patrick', 'Faith', 'Moses', 'Precious']
+LAST_NAMES = ['Mulenga', 'Banda', 'Phiri', 'Tembo', 'Zulu', 'Mwanza', 'Lungu', 'Chileshe', 'Sakala',
+              'Mumba', 'Kabwe', 'Ngoma', 'Daka', 'Sichone', 'Kapembwa', 'Nkonde', 'Chisanga', 'Hamweene']
+
+# Relative share of students per program code; unknown codes get 1.0
+PROGRAM_WEIGHTS = {'CS': 1.6, 'CE': 1.0, 'SE': 1.2, 'IT': 1.4, 'DS': 0.7, 'BIO': 0.5,
+                   'BA': 2.0, 'MED': 0.9, 'PSY': 0.8}
+
+# Later academic years are smaller because of attrition
+YEAR_ATTRITION = 0.88
+
+STUDENT_UNION_POSITIONS = ['President', 'Academics Minister', 'Prime Minister']
+CLASS_REP_POSITIONS = ['Male Class Representative', 'Female Class Representative']
+
+
+def load_reference_data(cursor):
+    """Schools, programs and academic years as seeded by init_database"""
+    cursor.execute("SELECT id, name FROM schools WHERE is_active = TRUE ORDER BY id")
+    schools = cursor.fetchall()
+    cursor.execute("SELECT id, name, code, school_id, duration_years FROM programs WHERE is_active = TRUE ORDER BY id")
+    programs = cursor.fetchall()
+    cursor.execute("SELECT id, name, code FROM academic_years WHERE is_active = TRUE ORDER BY code")
+    academic_years = cursor.fetchall()
+    if not programs or not academic_years:
+        raise RuntimeError('Reference data missing, start the app once so init_database seeds it')
+    return schools, programs, academic_years
+
+
+def next_id(cursor, table):
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+    return cursor.fetchone()[0] + 1
+
+
+def insert_batches(connection, cursor, query, rows, batch_size, label):
+    """executemany() in fixed-size batches, committing after each one"""
+    started = time.perf_counter()
+    batch = []
+    total = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            cursor.executemany(query, batch)
+            connection.commit()
+            total += len(batch)
+            batch = []
+    if batch:
+        cursor.executemany(query, batch)
+        connection.commit()
+        total += len(batch)
+    elapsed = time.perf_counter() - started
+    rate = total / elapsed if elapsed else 0
+    print(f"  {label}: {total} rows in {elapsed:.1f}s ({rate:,.0f} rows/s)")
+    return total
+
+
+class CampusGenerator:
+    """Builds the whole dataset in memory as compact arrays before loading"""
+
+    def __init__(self, seed, voters, votes, turnout, candidates_per_position, programs, academic_years):
+        self.rng = random.Random(seed)
+        self.voter_count = voters
+        self.vote_target = votes
+        self.turnout = turnout
+        self.candidates_per_position = candidates_per_position
+        self.programs = programs
+        self.academic_years = academic_years
+
+        # Cohort = (program index, academic year index)
+        self.cohorts = []
+        weights = []
+        for p_index, program in enumerate(programs):
+            base = PROGRAM_WEIGHTS.get(program[2], 1.0)
+            for y_index in range(min(program[4] or 4, len(academic_years))):
+                self.cohorts.append((p_index, y_index))
+                weights.append(base * YEAR_ATTRITION ** y_index)
+        self.cohort_weights = weights
+
+    def assign_voters(self):
+        """Integer-coded cohort per voter plus the voter ids in each cohort"""
+        self.voter_cohort = array('i', self.rng.choices(range(len(self.cohorts)), weights=self.cohort_weights,
+                                                        k=self.voter_count))
+        self.cohort_members = [array('i') for _ in self.cohorts]
+        for voter_index, cohort in enumerate(self.voter_cohort):
+            self.cohort_members[cohort].append(voter_index)
+
+    def plan_elections(self, now):
+        """Enough past terms of elections to reach the vote target, the last one opening at now"""
+        rows_per_term = self.voter_count * self.turnout * (len(STUDENT_UNION_POSITIONS) + len(CLASS_REP_POSITIONS))
+        self.terms = max(1, math.ceil(self.vote_target / rows_per_term)) if rows_per_term else 1
+        self.elections = []
+        for term in range(self.terms):
+            start = now - timedelta(days=182 * (self.terms - 1 - term))
+            status = 'active' if term == self.terms - 1 else 'completed'
+            label = f"{start.year} Term {1 if start.month < 7 else 2}"
+            self.elections.append({'name': f"Student Union {label}", 'type': 'Student Union',
+                                   'positions': STUDENT_UNION_POSITIONS, 'cohorts': None,
+                                   'start': start, 'status': status})
+            for cohort_index, (p_index, y_index) in enumerate(self.cohorts):
+                if not self.cohort_members[cohort_index]:
+                    continue
+                program = self.programs[p_index]
+                year = self.academic_years[y_index]
+                self.elections.append({'name': f"{program[2]} {year[2]} Class Representatives {label}",
+                                       'type': 'Class Representative', 'positions': CLASS_REP_POSITIONS,
+                                       'cohorts': [cohort_index], 'start': start, 'status': status})
+
+        # Split the vote budget across elections by eligible voters x positions
+        capacity = []
+        for election in self.elections:
+            eligible = self.voter_count if election['cohorts'] is None else sum(
+                len(self.cohort_members[c]) for c in election['cohorts'])
+            election['eligible'] = eligible
+            capacity.append(eligible * len(election['positions']))
+        total_capacity = sum(capacity) or 1
+        for election, cap in zip(self.elections, capacity):
+            rows = self.vote_target * cap / total_capacity
+            election['ballots'] = min(election['eligible'], int(rows / len(election['positions'])))
+
+    def eligible_voters(self, election):
+        if election['cohorts'] is None:
+            return range(self.voter_count)
+        members = array('i')
+        for cohort in election['cohorts']:
+            members.extend(self.cohort_members[cohort])
+        return members
+
+    def pick_ballots(self):
+        """Which voters cast a ballot in each election, and the has_voted flags"""
+        self.has_voted = bytearray(self.voter_count)
+        for election in self.elections:
+            eligible = self.eligible_voters(election)
+            ballots = array('i', self.rng.sample(eligible, election['ballots'])) if election['ballots'] else array('i')
+            election['ballot_voters'] = ballots
+            # submit_vote sets the flag on any ballot, whatever the election
+            for voter_index in ballots:
+                self.has_voted[voter_index] = 1
+
+    def pick_candidates(self):
+        """Candidates per position drawn from the election's eligible voters"""
+        for election in self.elections:
+            eligible = self.eligible_voters(election)
+            count = min(len(eligible), self.candidates_per_position * len(election['positions']))
+            chosen = self.rng.sample(eligible, count)
+            election['candidates'] = {}
+            for i, position in enumerate(election['positions']):
+                picked = chosen[i * self.candidates_per_position:(i + 1) * self.candidates_per_position]
+                if picked:
+                    # Skewed popularity so results are not uniform
+                    weights = [self.rng.uniform(0.2, 1.0) ** 2 for _ in picked]
+                    election['candidates'][position] = (picked, weights)
+
+
+def generate(args, connection, backend):
+    cursor = connection.cursor()
+    schools, programs, academic_years = load_reference_data(cursor)
+
+    if args.reset:
+        print("Removing existing voters, elections, candidates and votes")
+        for table in ('votes', 'ballots', 'election_tallies', 'election_archives', 'turnout_rollup',
+                      'candidates', 'positions', 'elections', 'voters'):
+            cursor.execute(f"DELETE FROM {table}")
+        connection.commit()
+
+    started = time.perf_counter()
+    generator = CampusGenerator(args.seed, args.voters, args.votes, args.turnout,
+                                args.candidates_per_position, programs, academic_years)
+    generator.assign_voters()
+    generator.plan_elections(args.now)
+    generator.pick_ballots()
+    generator.pick_candidates()
+    print(f"Planned {args.voters} voters, {len(generator.elections)} elections over {generator.terms} term(s) "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    cursor.execute("SELECT id FROM admin_users ORDER BY id LIMIT 1")
+    admin = cursor.fetchone()
+    admin_id = admin[0] if admin else None
+
+    voter_base = next_id(cursor, 'voters')
+    election_base = next_id(cursor, 'elections')
+    position_base = next_id(cursor, 'positions')
+    candidate_base = next_id(cursor, 'candidates')
+    vote_base = next_id(cursor, 'votes')
+
+    # Bulk loading: skip per-row constraint checks, rows are consistent by construction
+    backend.set_constraint_checks(cursor, False)
+
+    rng = random.Random(args.seed + 1)
+    registration_start = datetime(2022, 1, 10, 8, 0, 0)
+
+    def voter_rows():
+        for i in range(args.voters):
+            p_index, y_index = generator.cohorts[generator.voter_cohort[i]]
+            program = programs[p_index]
+            voter_id = voter_base + i
+            student_number = f"{10000000 + voter_id:08d}"
+            first = FIRST_NAMES[rng.randrange(len(FIRST_NAMES))]
+            last = LAST_NAMES[rng.randrange(len(LAST_NAMES))]
+            gender = 'Male' if rng.random() < 0.52 else 'Female'
+            yield (voter_id, first, last, f"{1998 + rng.randrange(8)}-{1 + rng.randrange(12):02d}-{1 + rng.randrange(28):02d}",
+                   program[3], program[1], academic_years[y_index][1], student_number,
+                   f"{rng.randrange(1000000):06d}/{rng.randrange(100):02d}/1", gender,
+                   f"{first.lower()}.{last.lower()}{voter_id}@students.cbu.ac.zm",
+                   f"097{rng.randrange(10000000):07d}", 'Campus' if rng.random() < 0.6 else 'Off-Campus',
+                   registration_start + timedelta(minutes=rng.randrange(60 * 24 * 365 * 4)),
+                   bool(generator.has_voted[i]))
+
+    print("Loading data")
+    insert_batches(connection, cursor, """
+        INSERT INTO voters (id, first_name, last_name, date_of_birth, school_id, program, academic_year,
+                            student_number, nrc, gender, email, phone_number, address_type,
+                            registration_date, has_voted)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, voter_rows(), args.batch_size, 'voters')
+
+    election_rows = []
+    position_rows = []
+    candidate_rows = []
+    for e_index, election in enumerate(generator.elections):
+        election_id = election_base + e_index
+        election['id'] = election_id
+        if election['cohorts'] is None:
+            program_value = year_value = 'all'
+            school = 'CBU'
+        else:
+            p_index, y_index = generator.cohorts[election['cohorts'][0]]
+            program_value = json.dumps([str(programs[p_index][0])])
+            year_value = json.dumps([str(academic_years[y_index][0])])
+            school = next((s[1] for s in schools if s[0] == programs[p_index][3]), '')
+        end = election['start'] + timedelta(days=4, hours=9)
+        election['end'] = end
+        election_rows.append((election_id, election['name'], f"Synthetic {election['type']} election",
+                              election['type'], school, program_value, year_value,
+                              election['start'], end, election['status'], admin_id))
+        election['candidate_ids'] = {}
+        for position, (picked, weights) in election['candidates'].items():
+            position_rows.append((position_base + len(position_rows), election_id, position))
+            ids = []
+            for voter_index in picked:
+                candidate_id = candidate_base + len(candidate_rows)
+                candidate_rows.append((candidate_id, election_id, f"{10000000 + voter_base + voter_index:08d}",
+                                       position, 'Synthetic manifesto', '', True))
+                ids.append(candidate_id)
+            election['candidate_ids'][position] = (ids, weights)
+
+    insert_batches(connection, cursor, """
+        INSERT INTO elections (id, name, description, election_type, school, program, academic_year,
+                               start_date, end_date, status, created_by)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, election_rows, args.batch_size, 'elections')
+    insert_batches(connection, cursor,
+                   "INSERT INTO positions (id, election_id, position_name) VALUES (%s, %s, %s)",
+                   position_rows, args.batch_size, 'positions')
+    insert_batches(connection, cursor, """
+        INSERT INTO candidates (id, election_id, student_number, position, manifesto, photo_url, is_approved)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """, candidate_rows, args.batch_size, 'candidates')
+
+    vote_rng = random.Random(args.seed + 2)
+
+    def vote_rows():
+        vote_id = vote_base
+        for election in generator.elections:
+            window = (election['end'] - election['start']).total_seconds()
+            positions = list(election['candidate_ids'].values())
+            for voter_index in election['ballot_voters']:
+                # Most ballots land early in the voting window
+                voted_at = election['start'] + timedelta(seconds=int(window * vote_rng.random() ** 2))
+                ip_address = f"10.{vote_rng.randrange(1, 8)}.{vote_rng.randrange(256)}.{vote_rng.randrange(1, 255)}"
+                for ids, weights in positions:
+                    candidate_id = vote_rng.choices(ids, weights=weights)[0]
+                    yield (vote_id, election['id'], voter_base + voter_index, candidate_id, voted_at, ip_address)
+                    vote_id += 1
+
+    insert_batches(connection, cursor, """
+        INSERT INTO votes (id, election_id, voter_id, candidate_id, voted_at, ip_address)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """, vote_rows(), args.batch_size, 'votes')
+
+    # One participation row per ballot, as submit_vote writes them
+    cursor.execute("""
+        INSERT INTO ballots (election_id, voter_id, cast_at)
+        SELECT election_id, voter_id, MIN(voted_at) FROM votes
+        WHERE id >= %s
+        GROUP BY election_id, voter_id
+    """, (vote_base,))
+
+    connection.commit()
+    backend.set_constraint_checks(cursor, True)
+    cursor.close()
+
+    # Turnout charts read the rollup, which submit_vote would have kept up to date
+    import turnout
+    for election in generator.elections:
+        if len(election['ballot_voters']):
+            turnout.backfill(connection, election['id'])
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a deterministic synthetic campus dataset')
+    parser.add_argument('--voters', type=int, default=1000, help='Number of voters (1k to 1M)')
+    parser.add_argument('--votes', type=int, default=3000, help='Approximate number of vote rows (up to 10M)')
+    parser.add_argument('--turnout', type=float, default=0.6, help='Share of eligible voters voting per election')
+    parser.add_argument('--candidates-per-position', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=2024, help='Random seed, same seed gives the same data')
+    parser.add_argument('--batch-size', type=int, default=5000, help='Rows per multi-row INSERT')
+    parser.add_argument('--reset', action='store_true', help='Delete existing voters, elections and votes first')
+    parser.add_argument('--now', type=datetime.fromisoformat, default=datetime(2024, 9, 2),
+                        help='When the open term starts, e.g. 2026-03-02T08:00 (default: 2024-09-02)')
+    args = parser.parse_args()
+
+    # Importing the app runs init_database, so the schema and reference data exist
+    import app as voting_app
+    connection = voting_app.create_connection()
+    if connection is None:
+        raise SystemExit('Database connection failed')
+    try:
+        generate(args, connection, voting_app.get_backend())
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+"""
+Server-side sessions.
+
+The session cookie only carries an opaque random id. The session data
+lives in the user_sessions table, shared by every worker, with a version
+that every write increments:
+
+- every request checks its session row by primary key, so a logout,
+  expire_student() or expire_all() on any worker takes effect on the next
+  request everywhere; the per-worker LRU cache only saves fetching the
+  data again while the version is unchanged,
+- a session is only written back when the request changed it, or to push
+  its expiry forward once half of its lifetime has passed,
+- writes are conditional on the version the request read. When another
+  request of the same session wrote first, this request's changes are
+  merged into the newer data and retried, so neither request's flash
+  messages or keys are lost,
+- expired sessions are deleted in one statement every SESSION_SWEEP_SECONDS
+  (default 300) per worker.
+
+Sessions only hold what the user's own requests set, such as the login
+identity and flash messages. State that other requests change, like
+whether a student has voted, is read from its table instead.
+
+If the database is unreachable sessions keep working from the cache of the
+worker that created them.
+"""
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from mysql.connector import Error
+from werkzeug.datastructures import CallbackDict
+
+import metrics
+
+serializer = TaggedJSONSerializer()
+# _check() / _load() result when the database could not be asked
+UNAVAILABLE = object()
+# Attempts at a conditional write before giving up on a contended session
+WRITE_ATTEMPTS = 3
+
+
+def _setting(name, default):
+    return float(os.environ.get(name, default))
+
+
+class ServerSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None, expires_at=None, new=False, version=0, loaded=None):
+        def on_update(session):
+            session.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.new = new
+        self.modified = False
+        self.rotate = False
+        # Version and serialized data as read, to write conditionally and merge on conflict
+        self.version = version
+        self.loaded = loaded
+
+
+class SessionCache:
+    """Bounded LRU of sid -> (data, expires_at, version)"""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, sid):
+        with self.lock:
+            entry = self.entries.get(sid)
+            if entry is not None:
+                self.entries.move_to_end(sid)
+            return entry
+
+    def put(self, sid, data, expires_at, version):
+        with self.lock:
+            self.entries[sid] = (data, expires_at, version)
+            self.entries.move_to_end(sid)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def discard(self, sid):
+        with self.lock:
+            self.entries.pop(sid, None)
+
+    def discard_where(self, predicate):
+        with self.lock:
+            for sid in [sid for sid, entry in self.entries.items() if predicate(entry[0])]:
+                del self.entries[sid]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class DatabaseSessionInterface(SessionInterface):
+
+    def __init__(self, create_connection):
+        self.create_connection = create_connection
+        self.cache = SessionCache(int(_setting('SESSION_CACHE_SIZE', '10000')))
+        self.sweep_seconds = _setting('SESSION_SWEEP_SECONDS', '300')
+        self._last_sweep = time.monotonic()
+
+    # Database access ----------------------------------------------------
+
+    def _fetch(self, query, params):
+        """One row, None if there is no such session, or UNAVAILABLE"""
+        connection = self.create_connection()
+        if connection is None:
+            return UNAVAILABLE
+        try:
+            cursor = connection.cursor()
+            cursor.execute(query, params)
+            row = cursor.fetchone()
+            cursor.close()
+            return row
+        except Error as e:
+            print(f"Error loading session: {e}")
+            return UNAVAILABLE
+        finally:
+            if connection.is_connected():
+                connection.close()
+
+    def _check(self, sid, cached_version):
+        """(version, expires_at, data) with data None when cached_version is still current"""
+        return self._fetch("""
+            SELECT version, expires_at, CASE WHEN version = %s THEN NULL ELSE data END
+            FROM user_sessions WHERE session_id = %s
+        """, (cached_version, sid))
+
+    def _load(self, sid):
+        """(data, version) as stored now"""
+        return self._fetch("SELECT data, version FROM user_sessions WHERE session_id = %s", (sid,))
+
+    def _execute(self, query, params=()):
+        """Run one write statement; returns the affected rows, or None if the database is down"""
+        connection = self.create_connection()
+        if connection is None:
+            return None
+        try:
+            cursor = connection.cursor()
+            cursor.execute(query, params)
+            affected = cursor.rowcount
+            connection.commit()
+            cursor.close()
+            return affected
+        except Error as e:
+            print(f"Error writing session: {e}")
+            return None
+        finally:
+            if connection.is_connected():
+                connection.close()
+
+    def _store(self, session):
+        """Write the session; returns the data stored, or None if it was not"""
+        if session.new:
+            data = serializer.dumps(dict(session))
+            self._execute("""
+                INSERT INTO user_sessions (session_id, data, student_id, expires_at, version)
+                VALUES (%s, %s, %s, %s, 0)
+            """, (session.sid, data, session.get('student_id'), session.expires_at))
+            session.version = 0
+            return data
+
+        values = dict(session)
+        for attempt in range(WRITE_ATTEMPTS):
+            data = serializer.dumps(values)
+            affected = self._execute("""
+                UPDATE user_sessions SET data = %s, student_id = %s, expires_at = %s, version = version + 1
+                WHERE session_id = %s AND version = %s
+            """, (data, values.get('student_id'), session.expires_at, session.sid, session.version))
+            if affected is None:
+                return None
+            if affected:
+                session.version += 1
+                return data
+            # Another request of this session wrote first: redo this one's changes on top of it
+            row = self._load(session.sid)
+            if row is UNAVAILABLE or row is None:
+                # Gone means logged out or expired elsewhere, which wins
+                return None
+            current, session.version = row
+            original = serializer.loads(session.loaded) if session.loaded else {}
+            values = merge(original, dict(session), serializer.loads(current))
+        print(f"Gave up writing a contended session after {WRITE_ATTEMPTS} attempts")
+        return None
+
+    def sweep(self):
+        """Delete every expired session in one statement"""
+        self._last_sweep = time.monotonic()
+        deleted = self._execute("DELETE FROM user_sessions WHERE expires_at < %s", (datetime.now(),))
+        if deleted:
+            print(f"Expired {deleted} sessions")
+        return deleted
+
+    # SessionInterface ---------------------------------------------------
+
+    def _new_session(self, app):
+        return ServerSession(sid=secrets.token_urlsafe(32),
+                             expires_at=datetime.now() + app.permanent_session_lifetime, new=True)
+
+    def open_session(self, app, request):
+        if time.monotonic() - self._last_sweep > self.sweep_seconds:
+            self.sweep()
+
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return self._new_session(app)
+
+        entry = self.cache.get(sid)
+        # Always asked, so a session ended on another worker is not honoured here
+        row = self._check(sid, entry[2] if entry is not None else -1)
+        if row is UNAVAILABLE and entry is not None:
+            # The database is down: keep what this worker has
+            data, expires_at, version = entry
+        elif row is UNAVAILABLE or row is None:
+            # Unknown, logged out, or ended by a bulk expiry
+            self.cache.discard(sid)
+            return self._new_session(app)
+        else:
+            version, expires_at, data = row
+            metrics.record_cache('session', data is None)
+            if data is None:
+                data = entry[0]
+            self.cache.put(sid, data, expires_at, version)
+
+        if expires_at < datetime.now():
+            self.cache.discard(sid)
+            return self._new_session(app)
+        return ServerSession(serializer.loads(data), sid=sid, expires_at=expires_at,
+                             version=version, loaded=data)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if not session.new:
+                # Emptied (logged out): drop it everywhere
+                self.cache.discard(session.sid)
+                self._execute("DELETE FROM user_sessions WHERE session_id = %s", (session.sid,))
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.rotate and not session.new:
+            # New id after login so an id handed out before it is worthless
+            self.cache.discard(session.sid)
+            self._execute("DELETE FROM user_sessions WHERE session_id = %s", (session.sid,))
+            session.sid = secrets.token_urlsafe(32)
+            session.new = True
+            session.modified = True
+
+        lifetime = app.permanent_session_lifetime
+        extend = session.expires_at - datetime.now() < lifetime / 2
+        if extend:
+            session.expires_at = datetime.now() + lifetime
+        if not (session.new or session.modified or extend):
+            return
+
+        data = self._store(session)
+        if data is None:
+            self.cache.discard(session.sid)
+        else:
+            self.cache.put(session.sid, data, session.expires_at, session.version)
+        response.set_cookie(name, session.sid,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+    # Bulk operations ----------------------------------------------------
+
+    def expire_student(self, student_id):
+        """Log one student out everywhere"""
+        self.cache.discard_where(lambda data: serializer.loads(data).get('student_id') == student_id)
+        return self._execute("DELETE FROM user_sessions WHERE student_id = %s", (student_id,))
+
+    def expire_all(self):
+        """Log everyone out"""
+        self.cache.clear()
+        return self._execute("DELETE FROM user_sessions")
+
+
+def merge(original, mine, theirs):
+    """Apply the changes a request made to its session (original -> mine) onto theirs"""
+    merged = dict(theirs)
+    for key in set(original) | set(mine):
+        if key == '_flashes':
+            continue
+        if key not in mine:
+            merged.pop(key, None)
+        elif key not in original or original[key] != mine[key]:
+            merged[key] = mine[key]
+
+    # Flash messages are a queue: keep the other request's, minus any this one showed, plus its own
+    shown = original.get('_flashes', [])
+    own = mine.get('_flashes', [])
+    theirs_flashes = theirs.get('_flashes', [])
+    if own[:len(shown)] == shown:
+        flashes = theirs_flashes + own[len(shown):]
+    else:
+        flashes = [flash for flash in theirs_flashes if flash not in shown] + own
+    if flashes:
+        merged['_flashes'] = flashes
+    else:
+        merged.pop('_flashes', None)
+    return merged
+
+
+_interface = None
+
+
+def expire_student(student_id):
+    return _interface.expire_student(student_id) if _interface else 0
+
+
+def expire_all():
+    return _interface.expire_all() if _interface else 0
+
+
+def rotate(session):
+    """Give the session a new id when it is saved, call on login"""
+    if isinstance(session, ServerSession):
+        session.rotate = True
+
+
+def init_app(app, create_connection):
+    """Replace the signed cookie session with the server-side store"""
+    global _interface
+    _interface = DatabaseSessionInterface(create_connection)
+    app.session_interface = _interface
+    return _interface
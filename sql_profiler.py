@@ -0,0 +1,97 @@
+"""
+Per-request SQL profiler for development and staging.
+
+Enable with SQL_PROFILER=1. Every statement executed through an instrumented
+cursor (see metrics.py) is recorded with its duration and row count. After
+the request an X-SQL-Profile summary header is added, statements sharing the
+same shape are flagged as possible N+1 patterns, and requests that go over
+the round-trip budget (SQL_PROFILER_BUDGET, default 5) are logged.
+"""
+import os
+import re
+
+from flask import g, has_request_context, request
+
+import metrics
+
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def is_enabled():
+    """Profiler is opt-in so production requests pay nothing for it"""
+    return os.environ.get('SQL_PROFILER', '').lower() in ('1', 'true', 'yes')
+
+
+def round_trip_budget():
+    return int(os.environ.get('SQL_PROFILER_BUDGET', '5'))
+
+
+def statement_shape(sql):
+    """Normalise a statement so calls differing only in values compare equal"""
+    shape = _STRING_LITERAL.sub('?', sql)
+    shape = _NUMBER_LITERAL.sub('?', shape)
+    shape = shape.replace('%s', '?')
+    shape = _IN_LIST.sub('(?)', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+def _collect(record):
+    if has_request_context() and is_enabled():
+        statements = g.get('_sql_profile')
+        if statements is None:
+            statements = []
+            g._sql_profile = statements
+        statements.append(record)
+
+
+def summarize(statements):
+    """Aggregate a request's statements into totals and repeated shapes"""
+    shapes = {}
+    for record in statements:
+        shape = statement_shape(record['sql'])
+        entry = shapes.setdefault(shape, {'count': 0, 'seconds': 0.0, 'rows': 0})
+        entry['count'] += 1
+        entry['seconds'] += record['seconds']
+        entry['rows'] += record['rows']
+
+    repeated = {shape: entry for shape, entry in shapes.items() if entry['count'] > 1}
+    return {
+        'queries': len(statements),
+        'seconds': sum(record['seconds'] for record in statements),
+        'rows': sum(record['rows'] for record in statements),
+        'repeated': repeated,
+    }
+
+
+def _report(response):
+    statements = g.pop('_sql_profile', None)
+    if not statements:
+        return response
+
+    summary = summarize(statements)
+    response.headers['X-SQL-Profile'] = (
+        f"queries={summary['queries']}; time={summary['seconds'] * 1000:.1f}ms; "
+        f"rows={summary['rows']}; repeated={len(summary['repeated'])}"
+    )
+
+    budget = round_trip_budget()
+    if summary['queries'] > budget or summary['repeated']:
+        print(f"[sql-profiler] {request.method} {request.path} ({request.endpoint}): "
+              f"{summary['queries']} queries (budget {budget}), "
+              f"{summary['seconds'] * 1000:.1f}ms, {summary['rows']} rows")
+        for shape, entry in summary['repeated'].items():
+            print(f"[sql-profiler]   repeated x{entry['count']} ({entry['seconds'] * 1000:.1f}ms): {shape[:200]}")
+        if summary['queries'] > budget:
+            for record in statements:
+                print(f"[sql-profiler]   {record['seconds'] * 1000:7.2f}ms {record['rows']:6d} rows  "
+                      f"{statement_shape(record['sql'])[:200]}")
+    return response
+
+
+def init_app(app):
+    """Hook the profiler into query instrumentation and request teardown"""
+    metrics.add_query_observer(_collect)
+    app.after_request(_report)
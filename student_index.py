@@ -0,0 +1,158 @@
+"""
+In-memory prefix index of students for autocomplete.
+
+Every voter is indexed under its student number, first name and last name
+(lower-cased) in one sorted list of keys with a parallel array of voter
+ids. A search is a bisect to the first key with the prefix and a short walk
+forwards, so the top-k matches come back in microseconds without touching
+the database.
+
+The index is loaded on the first search. After that only voters with an
+id above the highest one read so far are fetched, at most every
+STUDENT_INDEX_REFRESH seconds (default 30), and register() adds a new voter
+at once in the worker that registered it. Voters are never edited or
+deleted by the app, so nothing else needs to be tracked.
+"""
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from mysql.connector import Error
+
+import metrics
+
+# Above this many new voters a refresh re-sorts instead of inserting one by one
+BULK_INSERT_ROWS = 1000
+MAX_RESULTS = 50
+# Registrations can commit out of id order, so each refresh looks back this many ids
+LOOKBACK_IDS = 100
+
+
+def refresh_interval():
+    return float(os.environ.get('STUDENT_INDEX_REFRESH', '30'))
+
+
+def _keys(student_number, first_name, last_name):
+    keys = {student_number.lower()}
+    for name in (first_name, last_name):
+        if name:
+            keys.add(name.lower())
+    return keys
+
+
+class StudentIndex:
+
+    def __init__(self):
+        self.keys = []
+        self.ids = array('l')
+        self.students = {}
+        self.last_id = 0
+        self.refreshed_at = 0.0
+        self.lock = threading.Lock()
+
+    def _insert(self, voter_id, key):
+        position = bisect_left(self.keys, key)
+        self.keys.insert(position, key)
+        self.ids.insert(position, voter_id)
+
+    def add_rows(self, rows):
+        """Index rows of (id, student_number, first_name, last_name, program)"""
+        with self.lock:
+            new = [row for row in rows if row[0] not in self.students]
+            for voter_id, student_number, first_name, last_name, program in new:
+                self.students[voter_id] = (student_number, f"{first_name} {last_name}".strip(), program)
+            if len(new) > BULK_INSERT_ROWS:
+                pairs = list(zip(self.keys, self.ids))
+                for voter_id, student_number, first_name, last_name, _ in new:
+                    pairs.extend((key, voter_id) for key in _keys(student_number, first_name, last_name))
+                pairs.sort()
+                self.keys = [key for key, _ in pairs]
+                self.ids = array('l', (voter_id for _, voter_id in pairs))
+            else:
+                for voter_id, student_number, first_name, last_name, _ in new:
+                    for key in _keys(student_number, first_name, last_name):
+                        self._insert(voter_id, key)
+        return len(new)
+
+    def load_new(self, connection):
+        """Read voters registered since the last load; returns how many were added"""
+        cursor = connection.cursor()
+        try:
+            cursor.execute("""
+                SELECT id, student_number, first_name, last_name, program
+                FROM voters WHERE id > %s ORDER BY id
+            """, (max(0, self.last_id - LOOKBACK_IDS),))
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        # Only ids read from the table move the watermark: a voter added by register()
+        # may have overtaken one registered meanwhile in another worker
+        if rows:
+            self.last_id = rows[-1][0]
+        self.refreshed_at = time.monotonic()
+        return self.add_rows(rows)
+
+    def search(self, prefix, limit=10):
+        """Up to limit students whose number or a name starts with prefix, in key order"""
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        with self.lock:
+            keys, ids = self.keys, self.ids
+            position = bisect_left(keys, prefix)
+            while position < len(keys) and keys[position].startswith(prefix) and len(results) < limit:
+                voter_id = ids[position]
+                if voter_id not in seen:
+                    seen.add(voter_id)
+                    student_number, name, program = self.students[voter_id]
+                    results.append({'student_number': student_number, 'name': name, 'program': program})
+                position += 1
+        return results
+
+
+_index = StudentIndex()
+_refresh_lock = threading.Lock()
+
+ENTRIES = metrics.Gauge('student_index_students', 'Voters in the autocomplete index', (),
+                        lambda: {(): len(_index.students)})
+
+
+def _refresh(create_connection):
+    if time.monotonic() - _index.refreshed_at < refresh_interval():
+        return
+    # One thread refreshes, the others search what is already indexed
+    if not _refresh_lock.acquire(blocking=not _index.students):
+        return
+    try:
+        if time.monotonic() - _index.refreshed_at < refresh_interval():
+            return
+        connection = create_connection()
+        if connection is None:
+            return
+        try:
+            added = _index.load_new(connection)
+            if added:
+                print(f"Student index: {added} voters added, {len(_index.students)} indexed")
+        except Error as e:
+            print(f"Error refreshing student index: {e}")
+        finally:
+            if connection.is_connected():
+                connection.close()
+    finally:
+        _refresh_lock.release()
+
+
+def search(create_connection, prefix, limit=10):
+    """Top matches for prefix, loading or topping up the index when it is due"""
+    _refresh(create_connection)
+    return _index.search(prefix, max(1, min(limit, MAX_RESULTS)))
+
+
+def register(voter_id, student_number, first_name, last_name, program):
+    """Add a voter right after registration, once the index has been loaded"""
+    if _index.students:
+        _index.add_rows([(voter_id, student_number, first_name, last_name, program)])
@@ -0,0 +1,404 @@
+"""
+Election results engine.
+
+Each position is counted with its own method, stored on the positions row:
+
+    plurality  most first preferences wins; with seats > 1 the top N win
+    block      voters mark up to `seats` candidates, the N most marked win
+    irv        instant runoff: ranked ballots, the weakest candidate is
+               eliminated and its ballots move to their next preference
+               until someone holds a majority of the continuing ballots
+
+Ballots are loaded once into a BallotMatrix per position: candidates are
+coded 0..k-1 and every ballot is one fixed-width row of codes in preference
+order (-1 pads unused ranks) inside a flat array. Counting then works on
+slices of that array with Counter, so first preferences are one slice and
+identical rankings collapse into a single weighted row before IRV starts;
+the runoff rounds loop over the distinct rankings, not the ballots.
+
+Ties are broken deterministically and reported: plurality and block ties
+go to the candidate with more first preferences, then the earlier
+nomination (lower candidate id). In IRV the candidate to eliminate is the
+one with fewer votes in the previous rounds, looking backwards, then the
+later nomination; candidates level at zero in every round so far therefore
+go out latest nomination first.
+
+A candidate with no votes is never elected: a position nobody voted for
+(or an IRV count whose ballots are all exhausted) has no winner rather than
+one picked by the tie-break, and a block or multi-seat plurality position
+fills only the seats that drew votes.
+
+Results are cached per worker: a completed election's until its status
+changes (one primary key lookup per view tells), a running election's for
+RESULTS_TTL seconds. Admin edits to an election or its candidates call
+invalidate() as well.
+"""
+import os
+import threading
+import time
+from array import array
+from collections import Counter
+
+from mysql.connector import Error
+
+import archival
+import metrics
+import scheduler
+
+METHODS = ('plurality', 'block', 'irv')
+FETCH_ROWS = 10000
+
+TALLY_SECONDS = metrics.Histogram('tally_duration_seconds', 'Time to count an election', ('source',))
+
+
+def results_ttl():
+    return float(os.environ.get('RESULTS_TTL', '15'))
+
+
+class BallotMatrix:
+    """Ballots of one position as fixed-width rows of candidate codes"""
+
+    def __init__(self, candidate_ids, width):
+        self.candidate_ids = sorted(candidate_ids)
+        self.codes = {candidate_id: code for code, candidate_id in enumerate(self.candidate_ids)}
+        self.width = max(1, width)
+        self.cells = array('h')
+        self.ballots = 0
+
+    def add(self, ranking):
+        """Append one ballot given as candidate ids in preference order"""
+        row = [self.codes[candidate_id] for candidate_id in ranking[:self.width]]
+        row.extend([-1] * (self.width - len(row)))
+        self.cells.extend(row)
+        self.ballots += 1
+
+    def first_preferences(self):
+        counts = Counter(self.cells[0::self.width])
+        counts.pop(-1, None)
+        return counts
+
+    def marks(self):
+        counts = Counter(self.cells)
+        counts.pop(-1, None)
+        return counts
+
+    def rankings(self):
+        """Identical ballots grouped: {ranking tuple: number of ballots}"""
+        rows = zip(*[iter(self.cells)] * self.width)
+        return Counter(rows)
+
+
+def _order(counts, first, size):
+    """Candidate codes by votes, then first preferences, then nomination order"""
+    return sorted(range(size), key=lambda code: (-counts.get(code, 0), -first.get(code, 0), code))
+
+
+def _has_tie_at(order, counts, seats):
+    """True when the last winning and first losing candidates are level"""
+    if seats >= len(order):
+        return False
+    # Level at zero elects nobody, so no tie was broken
+    last = counts.get(order[seats - 1], 0)
+    return last > 0 and last == counts.get(order[seats], 0)
+
+
+def _voted(codes, counts):
+    """Drop candidates without a single vote from the winners"""
+    return [code for code in codes if counts.get(code, 0) > 0]
+
+
+def count_plurality(matrix, seats=1):
+    counts = matrix.first_preferences()
+    order = _order(counts, counts, len(matrix.candidate_ids))
+    return {'counts': counts, 'order': order, 'winners': _voted(order[:seats], counts),
+            'tie_broken': _has_tie_at(order, counts, seats)}
+
+
+def count_block(matrix, seats):
+    counts = matrix.marks()
+    first = matrix.first_preferences()
+    order = _order(counts, first, len(matrix.candidate_ids))
+    return {'counts': counts, 'order': order, 'winners': _voted(order[:seats], counts),
+            'tie_broken': _has_tie_at(order, counts, seats)}
+
+
+def count_irv(matrix):
+    rankings = matrix.rankings()
+    continuing = set(range(len(matrix.candidate_ids)))
+    rounds = []
+    winners = []
+    tie_broken = False
+
+    while continuing:
+        counts = Counter({code: 0 for code in continuing})
+        exhausted = 0
+        for ranking, weight in rankings.items():
+            for code in ranking:
+                if code in continuing:
+                    counts[code] += weight
+                    break
+            else:
+                exhausted += weight
+        active = sum(counts.values())
+        leader = max(continuing, key=lambda code: (counts[code], -code))
+        current = {'counts': dict(counts), 'exhausted': exhausted, 'eliminated': None}
+        rounds.append(current)
+
+        if not active:
+            # No ballots, or every one exhausted: nobody is elected and
+            # eliminating zero-vote candidates one by one would decide nothing
+            break
+        if len(continuing) == 1 or counts[leader] * 2 > active:
+            winners = [leader]
+            break
+
+        lowest = min(counts[code] for code in continuing)
+        tied = [code for code in continuing if counts[code] == lowest]
+        if len(tied) > 1:
+            tie_broken = True
+            # Look back through earlier rounds for the weaker candidate
+            for earlier in reversed(rounds[:-1]):
+                fewest = min(earlier['counts'].get(code, 0) for code in tied)
+                tied = [code for code in tied if earlier['counts'].get(code, 0) == fewest]
+                if len(tied) == 1:
+                    break
+        eliminated = max(tied)
+        current['eliminated'] = eliminated
+        continuing.discard(eliminated)
+
+    final = rounds[-1]['counts'] if rounds else {}
+    order = sorted(range(len(matrix.candidate_ids)),
+                   key=lambda code: (code not in winners, -final.get(code, 0), code))
+    return {'counts': Counter(final), 'order': order, 'winners': winners,
+            'rounds': rounds, 'tie_broken': tie_broken}
+
+
+def load_positions(connection, election_id):
+    """Positions with their method and seats, and every candidate standing"""
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT position_name, seats, tally_method
+            FROM positions
+            WHERE election_id = %s
+            ORDER BY id
+        """, (election_id,))
+        positions = {}
+        for row in cursor.fetchall():
+            method = row['tally_method'] if row['tally_method'] in METHODS else 'plurality'
+            seats = max(1, int(row['seats'] or 1))
+            positions[row['position_name']] = {'method': method, 'seats': 1 if method == 'irv' else seats,
+                                               'candidates': {}}
+
+        cursor.execute("""
+            SELECT c.id, c.position, v.first_name, v.last_name, c.student_number
+            FROM candidates c
+            LEFT JOIN voters v ON c.student_number = v.student_number
+            WHERE c.election_id = %s AND c.is_approved = TRUE
+            ORDER BY c.id
+        """, (election_id,))
+        for row in cursor.fetchall():
+            # Candidates may stand for a position that was never set up
+            position = positions.setdefault(row['position'], {'method': 'plurality', 'seats': 1, 'candidates': {}})
+            name = f"{row['first_name'] or ''} {row['last_name'] or ''}".strip() or row['student_number']
+            position['candidates'][row['id']] = name
+        return positions
+    finally:
+        cursor.close()
+
+
+def _hot_rows(connection, election_id):
+    """(voter_id, candidate_id) of the votes table in ballot order"""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+            SELECT voter_id, candidate_id
+            FROM votes
+            WHERE election_id = %s
+            ORDER BY voter_id, preference_rank, id
+        """, (election_id,))
+        while True:
+            rows = cursor.fetchmany(FETCH_ROWS)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def _archived_rows(path):
+    """(voter_id, candidate_id) of an archive file, streamed in the ballot order it was written in"""
+    for row in archival.read_archive(path):
+        yield int(row['voter_id']), int(row['candidate_id'])
+
+
+def build_matrices(positions, rows):
+    """Fold (voter_id, candidate_id) rows, grouped by voter, into one matrix per position"""
+    position_of = {}
+    matrices = {}
+    for name, position in positions.items():
+        # Only the preferences a method can use are kept
+        if position['method'] == 'irv':
+            width = len(position['candidates'])
+        elif position['method'] == 'block':
+            width = position['seats']
+        else:
+            width = 1
+        matrices[name] = BallotMatrix(position['candidates'], width)
+        for candidate_id in position['candidates']:
+            position_of[candidate_id] = name
+
+    def flush(picks):
+        ballot = {}
+        for candidate_id in picks:
+            name = position_of.get(candidate_id)
+            if name is not None and candidate_id not in ballot.setdefault(name, []):
+                ballot[name].append(candidate_id)
+        for name, ranking in ballot.items():
+            matrices[name].add(ranking)
+
+    current_voter = None
+    picks = []
+    for voter_id, candidate_id in rows:
+        if voter_id != current_voter:
+            if picks:
+                flush(picks)
+            current_voter = voter_id
+            picks = []
+        picks.append(candidate_id)
+    if picks:
+        flush(picks)
+    return matrices
+
+
+def count_position(name, position, matrix):
+    """Count one position's matrix by its method and describe the outcome"""
+    if position['method'] == 'irv':
+        outcome = count_irv(matrix)
+    elif position['method'] == 'block':
+        outcome = count_block(matrix, position['seats'])
+    else:
+        outcome = count_plurality(matrix, position['seats'])
+    return _describe(name, position, matrix, outcome)
+
+
+def count_election(connection, election_id):
+    """Count every position of an election; None if it does not exist"""
+    started = time.perf_counter()
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT id, name, status FROM elections WHERE id = %s", (election_id,))
+        election = cursor.fetchone()
+        if not election:
+            return None
+        cursor.execute("SELECT archive_path FROM election_archives WHERE election_id = %s", (election_id,))
+        archive = cursor.fetchone()
+    finally:
+        cursor.close()
+
+    positions = load_positions(connection, election_id)
+    if archive:
+        source = 'archive'
+        rows = _archived_rows(archive['archive_path'])
+    else:
+        source = 'votes'
+        rows = _hot_rows(connection, election_id)
+    matrices = build_matrices(positions, rows)
+
+    results = [count_position(name, position, matrices[name]) for name, position in positions.items()]
+
+    seconds = time.perf_counter() - started
+    TALLY_SECONDS.observe(seconds, (source,))
+    return {
+        'election_id': election['id'],
+        'name': election['name'],
+        'status': election['status'],
+        'source': source,
+        'counted_at': time.time(),
+        'count_seconds': round(seconds, 4),
+        'positions': results,
+    }
+
+
+def _describe(name, position, matrix, outcome):
+    """Turn candidate codes back into ids and names"""
+    ids = matrix.candidate_ids
+    counts = outcome['counts']
+    total = matrix.ballots
+    winners = {ids[code] for code in outcome['winners']}
+    described = {
+        'position': name,
+        'method': position['method'],
+        'seats': position['seats'],
+        'ballots': total,
+        'tie_broken': outcome['tie_broken'],
+        'winners': [ids[code] for code in outcome['winners']],
+        'candidates': [{
+            'id': ids[code],
+            'name': position['candidates'][ids[code]],
+            'votes': counts.get(code, 0),
+            'percent': round(100.0 * counts.get(code, 0) / total, 1) if total else 0.0,
+            'elected': ids[code] in winners,
+        } for code in outcome['order']],
+    }
+    if 'rounds' in outcome:
+        described['rounds'] = [{
+            'counts': {ids[code]: votes for code, votes in round_['counts'].items()},
+            'exhausted': round_['exhausted'],
+            'eliminated': ids[round_['eliminated']] if round_['eliminated'] is not None else None,
+        } for round_ in outcome['rounds']]
+    return described
+
+
+_results = {}
+_results_lock = threading.Lock()
+
+
+def _status(connection, election_id):
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT status FROM elections WHERE id = %s", (election_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+    finally:
+        cursor.close()
+
+
+def get_results(connection, election_id):
+    """Cached results; completed elections are counted once per worker while they stay completed"""
+    cached = _results.get(election_id)
+    if cached is not None:
+        if cached['status'] == 'completed':
+            # Any worker may reopen an election, so check it is still closed
+            fresh = _status(connection, election_id) == 'completed'
+        else:
+            fresh = time.time() - cached['counted_at'] < results_ttl()
+        if fresh:
+            metrics.record_cache('results', True)
+            return cached
+    metrics.record_cache('results', False)
+    results = count_election(connection, election_id)
+    with _results_lock:
+        if results is None:
+            _results.pop(election_id, None)
+        else:
+            _results[election_id] = results
+    return results
+
+
+def invalidate(election_id=None):
+    with _results_lock:
+        if election_id is None:
+            _results.clear()
+        else:
+            _results.pop(election_id, None)
+
+
+@scheduler.on_close
+def count_final_results(connection, election_id):
+    """Count a closed election once so the first results view is instant"""
+    invalidate(election_id)
+    try:
+        get_results(connection, election_id)
+    except Error as e:
+        print(f"Counting final results of election {election_id} failed: {e}")
@@ -0,0 +1,149 @@
+"""
+Turnout over time, kept in a small rollup table.
+
+turnout_rollup holds ballot counts per election per minute and per hour,
+both for the whole campus (school_id 0) and per school. submit_vote adds a
+ballot to its four buckets in the same transaction as the ballot itself,
+with one multi-row upsert, so charts and reports read a few hundred rollup
+rows instead of scanning votes.voted_at.
+
+Rollups of elections that predate the table are rebuilt from the votes
+table with:
+
+    python turnout.py backfill --all
+    python turnout.py backfill --election 12
+"""
+import argparse
+from collections import Counter
+from datetime import datetime
+
+from mysql.connector import Error
+
+from db_backends import get_backend
+
+GRANULARITIES = ('minute', 'hour')
+ALL_SCHOOLS = 0
+COLUMNS = ['election_id', 'granularity', 'bucket_start', 'school_id', 'ballots']
+KEY_COLUMNS = ['election_id', 'granularity', 'bucket_start', 'school_id']
+
+
+def bucket_start(moment, granularity):
+    if granularity == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(second=0, microsecond=0)
+
+
+def _rows(election_id, moment, school_id):
+    """The buckets one ballot adds to: campus-wide and its school, per minute and hour"""
+    rows = []
+    for granularity in GRANULARITIES:
+        start = bucket_start(moment, granularity)
+        rows.append((election_id, granularity, start, ALL_SCHOOLS, 1))
+        if school_id:
+            rows.append((election_id, granularity, start, school_id, 1))
+    return rows
+
+
+def record_ballot(cursor, election_id, school_id, moment=None):
+    """Count one ballot; call inside the transaction that stores it"""
+    sql = get_backend().upsert_add_sql('turnout_rollup', COLUMNS, KEY_COLUMNS, ['ballots'])
+    cursor.executemany(sql, _rows(election_id, moment or datetime.now(), school_id))
+
+
+def series(connection, election_id, granularity='hour', school_id=None):
+    """Ballots per bucket with a running total, oldest first"""
+    if granularity not in GRANULARITIES:
+        granularity = 'hour'
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT bucket_start, ballots
+            FROM turnout_rollup
+            WHERE election_id = %s AND granularity = %s AND school_id = %s
+            ORDER BY bucket_start
+        """, (election_id, granularity, school_id or ALL_SCHOOLS))
+        buckets = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    cumulative = 0
+    points = []
+    for bucket in buckets:
+        cumulative += bucket['ballots']
+        points.append({'bucket': bucket['bucket_start'].strftime('%Y-%m-%d %H:%M'),
+                       'ballots': bucket['ballots'], 'cumulative': cumulative})
+    return points
+
+
+def backfill(connection, election_id):
+    """Rebuild one election's rollup from the votes table; returns the ballots counted"""
+    cursor = connection.cursor()
+    try:
+        # A ballot is timed by its first vote row
+        cursor.execute("""
+            SELECT MIN(v.voted_at), COALESCE(MAX(vo.school_id), 0)
+            FROM votes v
+            LEFT JOIN voters vo ON v.voter_id = vo.id
+            WHERE v.election_id = %s
+            GROUP BY v.voter_id
+        """, (election_id,))
+        counts = Counter()
+        ballots = 0
+        for voted_at, school_id in cursor.fetchall():
+            if voted_at is None:
+                continue
+            if isinstance(voted_at, str):
+                # SQLite returns aggregates of timestamp columns as text
+                voted_at = datetime.fromisoformat(voted_at)
+            ballots += 1
+            for granularity in GRANULARITIES:
+                start = bucket_start(voted_at, granularity)
+                counts[(granularity, start, ALL_SCHOOLS)] += 1
+                if school_id:
+                    counts[(granularity, start, school_id)] += 1
+
+        cursor.execute("DELETE FROM turnout_rollup WHERE election_id = %s", (election_id,))
+        cursor.executemany(
+            "INSERT INTO turnout_rollup (election_id, granularity, bucket_start, school_id, ballots) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            [(election_id, granularity, start, school_id, count)
+             for (granularity, start, school_id), count in counts.items()])
+        connection.commit()
+        return ballots
+    finally:
+        cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the turnout rollup from the votes table')
+    commands = parser.add_subparsers(dest='command', required=True)
+    rebuild = commands.add_parser('backfill', help='Recount rollup buckets from votes')
+    rebuild.add_argument('--election', type=int, help='Backfill a single election')
+    rebuild.add_argument('--all', action='store_true', help='Backfill every election that still has votes')
+    args = parser.parse_args()
+
+    import app as voting_app
+    connection = voting_app.create_connection()
+    if connection is None:
+        raise SystemExit('Database connection failed')
+    try:
+        if args.election:
+            election_ids = [args.election]
+        elif args.all:
+            cursor = connection.cursor()
+            cursor.execute("SELECT DISTINCT election_id FROM votes ORDER BY election_id")
+            election_ids = [row[0] for row in cursor.fetchall()]
+            cursor.close()
+        else:
+            parser.error('pass --election ID or --all')
+        for election_id in election_ids:
+            ballots = backfill(connection, election_id)
+            print(f"Election {election_id}: {ballots} ballots rolled up")
+    except Error as e:
+        raise SystemExit(f"Backfill failed: {e}")
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()